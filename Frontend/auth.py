@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 from producer import producer_ui  # Import the producer_ui function
 from consumer import consumer_ui  # Import the consumer_ui function
+from state import store_tokens
 
 API_URL = "http://127.0.0.1:8000"  # Make sure the API URL is correct
 
@@ -11,59 +12,26 @@ def login():
     password = st.text_input("Password", type="password")
     
     if st.button("Login"):
-        # Call the backend login API
-        response = requests.post(f"{API_URL}/login", json={"username": username, "password": password})
-        # Debugging: Check if we got a response
-        st.write("Response status code:", response.status_code)
-        st.write("Response data:", response.json())
+        # One call returns the access token, refresh token and profile
+        response = requests.post(f"{API_URL}/auth/login", json={"username": username, "password": password})
 
         if response.status_code == 200:
-            response_data = response.json()
-            st.write(response_data)  # Show the full response for debugging
-
-            if response_data.get("success"):
-                # Parse the necessary info
-                token = requests.post(
-                    f"{API_URL}/token",
-                    data={"username": username, "password": password},
-                    headers={"Content-Type": "application/x-www-form-urlencoded"}
-                )
-
-                token_data = token.json()
-
-                if token.status_code != 200:
-                    st.error("Failed to retrieve access token.")
-                    return
-                
-               
-                st.write("Token status code:", token.status_code)
-                st.write("Token data:", token_data)  # Show the full token response for debugging
-                # Check if token retrieval was successful
-                if "access_token" not in token_data:
-                    st.error("Failed to retrieve access token.")
-                    return
-                # Extract user information
-
-
-                user_id = response_data.get("user_id")
-                access_token = response_data.get("access_token")
-                role = response_data.get("role")
-                access_token = token_data.get("access_token")
-                username = response_data.get("username")
-
-                # Store necessary information in session state
-                st.session_state["access_token"] = access_token
-                st.session_state["user_id"] = user_id
-                st.session_state["role"] = role
-                st.session_state["username"] = username
-                st.session_state["login_success"] = True  # Mark login as successful
-                st.session_state["access_token"] = access_token # Store access token
-                st.success(f"Logged in successfully as {username}!")  # Show login success message
-
-                # Rerun the app to show role-specific page
-                # st.rerun()  # Force a rerun to display the role-specific page
-            else:
-                st.error("Login failed. Invalid username or password.")
+            auth_data = response.json()
+            profile = auth_data["user"]
+
+            # Store necessary information in session state
+            store_tokens(auth_data)
+            st.session_state["user_id"] = profile["user_id"]
+            st.session_state["role"] = profile["role"]
+            st.session_state["username"] = profile["username"]
+            st.session_state["profile"] = profile
+            st.session_state["login_success"] = True  # Mark login as successful
+            st.success(f"Logged in successfully as {profile['username']}!")  # Show login success message
+
+            # Rerun the app to show role-specific page
+            # st.rerun()  # Force a rerun to display the role-specific page
+        elif response.status_code == 401:
+            st.error("Login failed. Invalid username or password.")
         else:
             st.error("Login failed. Server error.")
 
@@ -91,7 +59,6 @@ def display_role_page():
     st.write("### Debug: In display_role_page()")
 
     role = st.session_state.get("role")
-    st.write(f"Session state: {st.session_state}")  # Show session state for debugging
 
     if role == "producer":
         producer_page()  # Show producer page
@@ -1,28 +1,73 @@
 import streamlit as st
-import requests
+
+from offline_store import AuthError, OfflineStore
+from state import get_access_token
 
 API_URL = "http://127.0.0.1:8000"
 
-def distributor_ui(token):
+# One local store per Streamlit process, shared across reruns
+@st.cache_resource
+def get_store():
+    return OfflineStore()
+
+# Fetch a fresh access token for every call so a long session keeps
+# syncing after the first token expires. A rejected or missing token is an
+# auth problem, not a lost connection: tell the user and stop the page.
+def with_token(call, *args):
+    token = get_access_token()
+    if not token:
+        st.error("Your session has expired. Please log in again; queued updates are kept.")
+        st.stop()
+    try:
+        return call(API_URL, token, *args)
+    except AuthError:
+        st.error("The server rejected your session. Please log in again; queued updates are kept.")
+        st.stop()
+
+def distributor_ui():
     st.header("🚚 Distributor Dashboard")
-    headers = {"Authorization": f"Bearer {token}"}
+    store = get_store()
+
+    # Send queued updates first, then refresh the cache; both are skipped when offline
+    if store.pending_count():
+        counts = with_token(store.sync)
+        if counts:
+            st.info(f"Synced queued updates: {counts}")
+    online = with_token(store.refresh)
+    if not online:
+        st.warning("Offline - showing cached products. Updates are queued and synced when the connection returns.")
+
+    pending = store.pending_count()
+    col1, col2 = st.columns(2)
+    col1.metric("Queued updates", pending)
+    if col2.button("Sync now", disabled=not pending):
+        counts = with_token(store.sync)
+        if counts is None:
+            st.error("Still offline, updates remain queued")
+        else:
+            st.success(f"Synced: {counts}")
+
+    for conflict in store.conflicts():
+        current = conflict["result"].get("current") or {}
+        with st.expander(f"⚠️ Conflict on {conflict['product_id']}"):
+            st.write(f"Your update: status **{conflict['status']}**, location **{conflict['new_location']}**")
+            st.write(f"Server now has: status **{current.get('status')}**, owner **{current.get('current_owner')}**")
+            if st.button("Discard my update", key=conflict["idempotency_key"]):
+                store.discard(conflict["idempotency_key"])
 
     st.subheader("📦 My Products")
-    response = requests.get(f"{API_URL}/products", headers=headers)
-    if response.status_code == 200:
-        products = response.json()["products"]
-        for product in products:
-            st.write(f"**{product['name']}** - {product['productId']}")
-            with st.expander("Update Status"):
-                new_status = st.text_input("New Status", key=product['productId'])
-                note = st.text_input("Note", key=product['productId'] + "_note")
-                if st.button("Update", key=product['productId'] + "_update"):
-                    payload = {
-                        "status": new_status,
-                        "note": note
-                    }
-                    res = requests.put(f"{API_URL}/product/{product['productId']}", json=payload, headers=headers)
-                    if res.status_code == 200:
-                        st.success("Updated successfully")
-                    else:
-                        st.error("Update failed")
+    for product in store.products():
+        st.write(f"**{product['name']}** - {product['product_id']} ({product['status']})")
+        with st.expander("Update Status"):
+            new_status = st.text_input("New Status", key=product['product_id'])
+            new_location = st.text_input("Location", key=product['product_id'] + "_location")
+            note = st.text_input("Note", key=product['product_id'] + "_note")
+            if st.button("Update", key=product['product_id'] + "_update"):
+                store.queue_update(product['product_id'], status=new_status or None,
+                                   new_location=new_location or None, note=note or None)
+                # Send right away when online; otherwise it stays queued
+                counts = with_token(store.sync) if online else None
+                if counts and counts.get("applied"):
+                    st.success("Updated successfully")
+                else:
+                    st.info("Update queued")
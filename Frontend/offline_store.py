@@ -0,0 +1,203 @@
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+
+import requests
+
+# Small enough for the server to write a batch within its time budget
+# (BATCH_TIME_BUDGET_SECONDS) and well inside the request timeout
+SYNC_BATCH_SIZE = 50
+
+
+class AuthError(Exception):
+    """The server rejected the access token; the user has to log in again."""
+
+
+class OfflineStore:
+    """SQLite-backed cache of the user's products and a durable queue of
+    status and location updates.
+
+    Updates are applied to the local cache straight away and synced later
+    through POST /products/batch-update. Every queued update has its own
+    idempotency key, so resending a batch after a lost response does not
+    apply anything twice.
+    """
+
+    def __init__(self, path="field_client.db"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                product_id TEXT PRIMARY KEY,
+                name TEXT,
+                category TEXT,
+                status TEXT,
+                location TEXT,
+                current_owner TEXT,
+                last_updated TEXT,
+                cached_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS products_status ON products (status);
+            CREATE INDEX IF NOT EXISTS products_owner ON products (current_owner);
+
+            CREATE TABLE IF NOT EXISTS pending_updates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                product_id TEXT NOT NULL,
+                status TEXT,
+                note TEXT,
+                new_location TEXT,
+                new_owner TEXT,
+                base_updated TEXT,
+                recorded_at TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pending_state ON pending_updates (state, id);
+            CREATE INDEX IF NOT EXISTS pending_product ON pending_updates (product_id);
+        """)
+        self.conn.commit()
+
+    # ------------------ Product cache ------------------
+
+    def cache_products(self, products):
+        now = datetime.utcnow().isoformat()
+        with self.conn:
+            # Products with queued updates keep their local state until synced
+            self.conn.executemany("""
+                INSERT INTO products (product_id, name, category, status, location, current_owner, last_updated, cached_at)
+                VALUES (:productId, :name, :category, :status, :location, :current_owner, :last_updated, :cached_at)
+                ON CONFLICT (product_id) DO UPDATE SET
+                    name = excluded.name, category = excluded.category, status = excluded.status,
+                    location = excluded.location, current_owner = excluded.current_owner,
+                    last_updated = excluded.last_updated, cached_at = excluded.cached_at
+                WHERE product_id NOT IN (SELECT product_id FROM pending_updates WHERE state = 'pending')
+            """, [{
+                "productId": p["productId"],
+                "name": p.get("name"),
+                "category": p.get("category"),
+                "status": p.get("status"),
+                "location": p.get("location"),
+                "current_owner": p.get("current_owner"),
+                "last_updated": p.get("last_updated"),
+                "cached_at": now,
+            } for p in products])
+
+    def products(self, status=None):
+        if status:
+            rows = self.conn.execute("SELECT * FROM products WHERE status = ? ORDER BY product_id", (status,))
+        else:
+            rows = self.conn.execute("SELECT * FROM products ORDER BY product_id")
+        return [dict(row) for row in rows]
+
+    def find(self, product_id):
+        row = self.conn.execute("SELECT * FROM products WHERE product_id = ?", (product_id,)).fetchone()
+        return dict(row) if row else None
+
+    # Download the user's products; returns False when offline and raises
+    # AuthError when the token is rejected
+    def refresh(self, api_url, token, timeout=5):
+        try:
+            response = requests.get(f"{api_url}/products", headers={"Authorization": f"Bearer {token}"}, timeout=timeout)
+        except requests.RequestException:
+            return False
+        if response.status_code == 401:
+            raise AuthError(response.text)
+        if response.status_code != 200:
+            return False
+        self.cache_products(response.json()["products"])
+        return True
+
+    # ------------------ Update queue ------------------
+
+    def queue_update(self, product_id, status=None, note=None, new_location=None, new_owner=None):
+        product = self.find(product_id) or {}
+        key = uuid.uuid4().hex
+        with self.conn:
+            # Only the first queued update of a product carries the server
+            # state it was based on; later ones build on the local changes
+            base_updated = None
+            if not self.conn.execute("SELECT 1 FROM pending_updates WHERE product_id = ? AND state = 'pending'",
+                                     (product_id,)).fetchone():
+                base_updated = product.get("last_updated")
+            self.conn.execute("""
+                INSERT INTO pending_updates (idempotency_key, product_id, status, note, new_location, new_owner,
+                                             base_updated, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, product_id, status, note, new_location, new_owner, base_updated, datetime.utcnow().isoformat()))
+            self.conn.execute("""
+                UPDATE products SET
+                    status = COALESCE(?, status),
+                    location = COALESCE(?, location),
+                    current_owner = COALESCE(?, current_owner)
+                WHERE product_id = ?
+            """, (status, new_location, new_owner, product_id))
+        return key
+
+    def pending(self):
+        return [dict(row) for row in self.conn.execute(
+            "SELECT * FROM pending_updates WHERE state = 'pending' ORDER BY id"
+        )]
+
+    def pending_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM pending_updates WHERE state = 'pending'").fetchone()[0]
+
+    def conflicts(self):
+        rows = self.conn.execute("SELECT * FROM pending_updates WHERE state = 'conflict' ORDER BY id")
+        return [{**dict(row), "result": json.loads(row["result"])} for row in rows]
+
+    def discard(self, idempotency_key):
+        with self.conn:
+            self.conn.execute("DELETE FROM pending_updates WHERE idempotency_key = ?", (idempotency_key,))
+
+    # Send every pending update, SYNC_BATCH_SIZE per request. Returns counts
+    # per outcome, or None if the server could not be reached. Raises
+    # AuthError when the token is rejected; the queue is left untouched.
+    def sync(self, api_url, token, timeout=30):
+        counts = {}
+        pending = self.pending()
+        for start in range(0, len(pending), SYNC_BATCH_SIZE):
+            chunk = pending[start:start + SYNC_BATCH_SIZE]
+            payload = {"updates": [{
+                "idempotency_key": row["idempotency_key"],
+                "productId": row["product_id"],
+                "status": row["status"],
+                "note": row["note"],
+                "new_location": row["new_location"],
+                "new_owner": row["new_owner"],
+                "base_updated": row["base_updated"],
+                "recorded_at": row["recorded_at"],
+            } for row in chunk]}
+            try:
+                response = requests.post(f"{api_url}/products/batch-update", json=payload,
+                                         headers={"Authorization": f"Bearer {token}"}, timeout=timeout)
+            except requests.RequestException:
+                return counts or None
+            if response.status_code == 401:
+                raise AuthError(response.text)
+            if response.status_code in (429, 503):
+                # Online but throttled; the rest stays queued for the next sync
+                return counts
+            if response.status_code != 200:
+                return counts or None
+
+            results = response.json()["results"]
+            with self.conn:
+                for result in results:
+                    outcome = result["outcome"]
+                    counts[outcome] = counts.get(outcome, 0) + 1
+                    # Errors, deferred updates and updates still in progress
+                    # elsewhere are retried next sync
+                    if outcome in ("applied", "duplicate", "not_found"):
+                        self.conn.execute("DELETE FROM pending_updates WHERE idempotency_key = ?",
+                                          (result["idempotency_key"],))
+                    elif outcome == "conflict":
+                        self.conn.execute("UPDATE pending_updates SET state = 'conflict', result = ? WHERE idempotency_key = ?",
+                                          (json.dumps(result), result["idempotency_key"]))
+            # The server ran out of time; send the rest with the next sync
+            if any(result["outcome"] == "deferred" for result in results):
+                break
+        return counts
@@ -2,6 +2,7 @@ import requests
 import streamlit as st
 from datetime import date
 from utils import add_product, add_distributor, view_products
+from state import get_access_token
 
 
 API_URL = "http://127.0.0.1:8000"  # Make sure the API URL is correct
@@ -41,7 +42,7 @@ def producer_ui():
                     'image_url': image_url,
                 }
 
-                access_token = st.session_state.get("access_token")
+                access_token = get_access_token()
                 if not access_token:
                     st.error("You need to log in first.")
                     return
@@ -75,7 +76,7 @@ def producer_ui():
         st.subheader("📋 View Products")
 
         headers = {
-            "Authorization": f"Bearer {token}"
+            "Authorization": f"Bearer {get_access_token()}"
         }
         response = requests.get(f"{API_URL}/products", headers=headers)
         if response.status_code == 200:
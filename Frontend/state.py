@@ -1,5 +1,13 @@
+import time
+
+import requests
 import streamlit as st
 
+API_URL = "http://127.0.0.1:8000"
+
+# Refresh the access token when it has less than this many seconds left
+TOKEN_REFRESH_MARGIN = 60
+
 # Initialize session state if not already initialized
 def init_state():
     if 'logged_in' not in st.session_state:
@@ -30,3 +38,26 @@ def is_logged_in():
 # Set whether to show signup page
 def show_signup(value):
     st.session_state['show_signup'] = value
+
+# Keep the tokens returned by /auth/login or /auth/refresh
+def store_tokens(auth_data):
+    st.session_state['access_token'] = auth_data['access_token']
+    st.session_state['refresh_token'] = auth_data['refresh_token']
+    st.session_state['access_token_expires_at'] = time.time() + auth_data['expires_in']
+
+# Current access token, rotated through /auth/refresh shortly before it
+# expires. Returns None if the session has ended and the user must log in.
+def get_access_token():
+    token = st.session_state.get('access_token')
+    if not token:
+        return None
+    if time.time() < st.session_state.get('access_token_expires_at', 0) - TOKEN_REFRESH_MARGIN:
+        return token
+
+    response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": st.session_state.get('refresh_token')})
+    if response.status_code != 200:
+        st.session_state['access_token'] = None
+        st.session_state['login_success'] = False
+        return None
+    store_tokens(response.json())
+    return st.session_state['access_token']
@@ -0,0 +1,212 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens/second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Take `cost` tokens. Returns 0 on success, otherwise the seconds until
+    # enough tokens are available. A cost above the capacity waits for a
+    # full bucket and leaves it in debt, so later requests wait until the
+    # whole cost has been refilled.
+    def take(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def give_back(self, cost=1):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class AdmissionController:
+    """Admission control for chain-writing requests.
+
+    A request must get a token from the global and its user's bucket, and a
+    slot among max_in_flight concurrent writes. If all slots are busy it may
+    wait in a queue of at most max_queued requests. Requests are rejected
+    straight away with 429 (rate limited) or 503 (saturated) and a
+    Retry-After header instead of piling up behind the node.
+    """
+
+    MAX_TRACKED_USERS = 10000
+
+    def __init__(self, global_rate=50, global_burst=100, user_rate=5, user_burst=10,
+                 max_in_flight=8, max_queued=32, max_confirm_latency=10.0):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_buckets = OrderedDict()
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_confirm_latency = max_confirm_latency
+
+        self.lock = threading.Lock()
+        self.semaphore = None
+        self.in_flight = 0
+        self.queued = 0
+        self.latency_ewma = 0.0
+        self.last_observed = 0.0
+        self.submit_latency_ewma = 0.0
+
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_saturated = 0
+
+        # Chain writes block on RPC and receipts; running them on their own
+        # pool keeps them from starving the event loop and read endpoints
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="chain-write")
+
+    def _user_bucket(self, username):
+        bucket = self.user_buckets.get(username)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self.user_buckets[username] = bucket
+            if len(self.user_buckets) > self.MAX_TRACKED_USERS:
+                self.user_buckets.popitem(last=False)
+        else:
+            self.user_buckets.move_to_end(username)
+        return bucket
+
+    def _reject(self, status_code, detail, retry_after):
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def _check_saturation(self):
+        # Once writes have been quiet for a while, let requests through
+        # again to probe whether the node has recovered
+        recently_slow = time.monotonic() - self.last_observed < self.max_confirm_latency
+        if self.latency_ewma > self.max_confirm_latency and recently_slow:
+            self.rejected_saturated += 1
+            self._reject(status.HTTP_503_SERVICE_UNAVAILABLE,
+                         "Chain confirmations are slow, try again later", self.latency_ewma)
+        if self.in_flight >= self.max_in_flight and self.queued >= self.max_queued:
+            self.rejected_saturated += 1
+            self._reject(status.HTTP_503_SERVICE_UNAVAILABLE,
+                         "Too many pending chain writes, try again later", max(self.latency_ewma, 1))
+
+    # Fail fast when the chain is saturated, without taking tokens
+    def check_saturation(self):
+        with self.lock:
+            self._check_saturation()
+
+    # cost is the number of chain writes the request will make, e.g. for
+    # batch updates; every write costs one token
+    def check(self, username, cost=1):
+        with self.lock:
+            self._check_saturation()
+
+            user_wait = self._user_bucket(username).take(cost)
+            if user_wait:
+                self.rejected_rate += 1
+                self._reject(status.HTTP_429_TOO_MANY_REQUESTS, "Write rate limit exceeded", user_wait)
+            global_wait = self.global_bucket.take(cost)
+            if global_wait:
+                self._user_bucket(username).give_back(cost)
+                self.rejected_rate += 1
+                self._reject(status.HTTP_429_TOO_MANY_REQUESTS, "Write rate limit exceeded", global_wait)
+
+    # Return tokens of writes a request ended up not making
+    def refund(self, username, cost):
+        with self.lock:
+            self._user_bucket(username).give_back(cost)
+            self.global_bucket.give_back(cost)
+
+    async def acquire(self, username, cost=1):
+        self.check(username, cost)
+        try:
+            await self.acquire_slot()
+        except HTTPException:
+            self.refund(username, cost)
+            raise
+
+    # Wait for one of the max_in_flight write slots; callers that already
+    # paid their tokens, like batch updates, take one per write
+    async def acquire_slot(self):
+        with self.lock:
+            self._check_saturation()
+            self.queued += 1
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            with self.lock:
+                self.queued -= 1
+        with self.lock:
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.semaphore.release()
+
+    def observe_latency(self, seconds):
+        with self.lock:
+            self.latency_ewma = seconds if not self.latency_ewma else 0.8 * self.latency_ewma + 0.2 * seconds
+            self.last_observed = time.monotonic()
+
+    def observe_submit_latency(self, seconds):
+        with self.lock:
+            self.submit_latency_ewma = (seconds if not self.submit_latency_ewma
+                                        else 0.8 * self.submit_latency_ewma + 0.2 * seconds)
+
+    # Run a chain write and record its latency. Coroutine functions (the
+    # async chain client) are awaited directly; blocking ones run on the
+    # write pool. Only writes that wait for their receipt (wait=True, the
+    # default) measure confirmation latency and feed the slow-confirmation
+    # check; wait=False writes return once submitted and are tracked as
+    # submission latency instead, since nothing here sees their receipts.
+    async def run(self, fn, *args, **kwargs):
+        observe = self.observe_latency if kwargs.get("wait", True) else self.observe_submit_latency
+        started = time.monotonic()
+        if inspect.iscoroutinefunction(fn):
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                observe(time.monotonic() - started)
+
+        loop = asyncio.get_running_loop()
+        try:
+            # Carry the request context (e.g. profiling timers) into the worker thread
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+        finally:
+            observe(time.monotonic() - started)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queued": self.max_queued,
+                "confirm_latency_ewma": round(self.latency_ewma, 3),
+                "submit_latency_ewma": round(self.submit_latency_ewma, 3),
+                "admitted": self.admitted,
+                "rejected_rate_limited": self.rejected_rate,
+                "rejected_saturated": self.rejected_saturated,
+            }
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Measure per-call contract latency for the HTTP and embedded chain backends.
+
+Usage:
+    python bench_chain.py [--backends http,embedded] [--products 50] [--calls 1000]
+
+The HTTP backend needs a running node (Ganache) with the contract deployed.
+The embedded backend needs eth-tester[py-evm] and compiled bytecode.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+import uuid
+
+import blockchain
+
+
+def make_chain(name):
+    if name == "embedded":
+        return blockchain.EmbeddedChain(data_dir=tempfile.mkdtemp(prefix="bench-chain-"))
+    return blockchain.HttpChain()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench(chain, products, calls):
+    prefix = f"BENCH-{uuid.uuid4().hex[:8]}"
+    product_ids = [f"{prefix}-{i}" for i in range(products)]
+
+    write_samples = []
+    for product_id in product_ids:
+        started = time.perf_counter()
+        chain.transact("addProduct", product_id, "Benchmark product", "bench")
+        write_samples.append(time.perf_counter() - started)
+
+    read_samples = []
+    for i in range(calls):
+        started = time.perf_counter()
+        chain.call("getProduct", product_ids[i % products])
+        read_samples.append(time.perf_counter() - started)
+
+    return {
+        "write_p50_ms": percentile(write_samples, 50) * 1000,
+        "read_mean_ms": statistics.mean(read_samples) * 1000,
+        "read_p50_ms": percentile(read_samples, 50) * 1000,
+        "read_p99_ms": percentile(read_samples, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chain backends")
+    parser.add_argument("--backends", default="http,embedded")
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.backends.split(","):
+        try:
+            results[name] = bench(make_chain(name), args.products, args.calls)
+        except Exception as e:
+            print(f"{name}: skipped ({e})")
+
+    for name, result in results.items():
+        print(f"{name:10s} write p50 {result['write_p50_ms']:8.2f} ms | read mean {result['read_mean_ms']:7.3f} ms "
+              f"p50 {result['read_p50_ms']:7.3f} ms p99 {result['read_p99_ms']:7.3f} ms")
+
+    if "http" in results and "embedded" in results:
+        speedup = results["http"]["read_mean_ms"] / results["embedded"]["read_mean_ms"]
+        print(f"Embedded reads are {speedup:.1f}x faster per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Measure product ID allocation throughput and check for collisions.
+
+Runs the allocator one ID at a time, in batches, from several threads
+sharing one allocator and from several processes with distinct node ids
+(as in multi-worker mode). Every generated ID is checked for uniqueness,
+and IDs from one allocator are checked to be strictly increasing.
+
+Usage:
+    python bench_ids.py [--count 2000000] [--batch 1000] [--threads 4] [--processes 4]
+"""
+import argparse
+import threading
+import time
+from multiprocessing import Pool
+
+import ids
+
+
+def single(count):
+    allocator = ids.IdAllocator(0)
+    started = time.perf_counter()
+    values = [allocator.next_int() for _ in range(count)]
+    return values, time.perf_counter() - started
+
+
+def batched(count, batch):
+    allocator = ids.IdAllocator(0)
+    values = []
+    started = time.perf_counter()
+    while len(values) < count:
+        values.extend(allocator.allocate_ints(min(batch, count - len(values))))
+    return values, time.perf_counter() - started
+
+
+def threaded(count, batch, threads):
+    allocator = ids.IdAllocator(0)
+    results = [[] for _ in range(threads)]
+
+    def worker(index):
+        out = results[index]
+        while len(out) < count // threads:
+            out.extend(allocator.allocate_ints(min(batch, count // threads - len(out))))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for out in results:
+        assert out == sorted(out), "IDs went backwards within a thread"
+    return [value for out in results for value in out], elapsed
+
+
+def node_worker(args):
+    node_id, count, batch = args
+    allocator = ids.IdAllocator(node_id)
+    values = []
+    while len(values) < count:
+        values.extend(allocator.allocate_ints(min(batch, count - len(values))))
+    return values
+
+
+def multiprocess(count, batch, processes):
+    started = time.perf_counter()
+    with Pool(processes) as pool:
+        results = pool.map(node_worker, [(node, count // processes, batch) for node in range(processes)])
+    elapsed = time.perf_counter() - started
+    return [value for out in results for value in out], elapsed
+
+
+def report(name, values, elapsed, ordered=False):
+    collisions = len(values) - len(set(values))
+    if ordered:
+        assert all(a < b for a, b in zip(values, values[1:])), "IDs are not strictly increasing"
+    print(f"{name:28s} {len(values):10,d} ids  {len(values) / elapsed / 1e6:7.2f} M ids/s  {collisions} collisions")
+    return collisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the product ID allocator")
+    parser.add_argument("--count", type=int, default=2000000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    collisions = 0
+    collisions += report("single (next_int)", *single(args.count), ordered=True)
+    collisions += report(f"batched ({args.batch})", *batched(args.count, args.batch), ordered=True)
+    collisions += report(f"{args.threads} threads, one node", *threaded(args.count, args.batch, args.threads))
+    collisions += report(f"{args.processes} processes, one node each", *multiprocess(args.count, args.batch, args.processes))
+
+    # String form keeps numeric order
+    values = ids.IdAllocator(1).allocate(10000)
+    assert values == sorted(values) and len(set(values)) == len(values)
+    print(f"sample id: {values[0]} ({ids.timestamp_of(values[0]).isoformat()})")
+
+    if collisions:
+        raise SystemExit(f"{collisions} collisions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Check that read throughput scales with the number of worker processes.
+
+Starts serve.py with 1, 2, 4, ... workers, drives GET requests against a
+read endpoint from a pool of client threads and prints requests/second and
+scaling efficiency relative to one worker.
+
+Usage:
+    python bench_read_scaling.py --path /product/PROD-1 [--workers 1,2,4] [--seconds 10]
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+
+def wait_until_live(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health/live", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become live")
+
+
+def drive(base_url, path, seconds, clients):
+    counts = [0] * clients
+    errors = [0] * clients
+    deadline = time.time() + seconds
+
+    def client(index):
+        with httpx.Client(base_url=base_url, timeout=10) as http:
+            while time.time() < deadline:
+                try:
+                    if http.get(path).status_code == 200:
+                        counts[index] += 1
+                    else:
+                        errors[index] += 1
+                except httpx.HTTPError:
+                    errors[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure read throughput scaling across workers")
+    parser.add_argument("--path", default="/health/live", help="Read endpoint to exercise")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--clients-per-worker", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        server = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--port", str(args.port)])
+        try:
+            wait_until_live(base_url)
+            # Warm the caches before measuring
+            drive(base_url, args.path, 2, workers * args.clients_per_worker)
+            rps, errors = drive(base_url, args.path, args.seconds, workers * args.clients_per_worker)
+        finally:
+            server.terminate()
+            server.wait()
+
+        baseline = baseline or rps
+        efficiency = rps / (baseline * workers)
+        print(f"{workers:2d} workers: {rps:9.0f} req/s, {errors} errors, scaling efficiency {efficiency:.0%}")
+
+
+if __name__ == "__main__":
+    main()
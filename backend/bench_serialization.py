@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Compare response size and CPU time of the old and new list serialization.
+
+The old path fetched whole product documents, rewrote _id in a Python loop
+and rendered with FastAPI's default jsonable_encoder + json.dumps. The new
+path fetches a projection, validates into ProductListResponse and renders
+with pydantic-core (or MessagePack), optionally gzip-compressed.
+
+Usage:
+    python bench_serialization.py [--products 5000] [--rounds 20]
+"""
+import argparse
+import gzip
+import json
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from models.product import ProductListResponse, ProductSummary
+from responses import msgpack
+
+
+def make_documents(count):
+    return [{
+        "_id": ObjectId(),
+        "productId": f"PROD-{i:08d}",
+        "name": f"Organic tomatoes lot {i}",
+        "description": "Fresh organic tomatoes. Certified by ABC Org. " * 4,
+        "category": "Produce",
+        "quantity": 100,
+        "location": "Warehouse 7, Pune",
+        "date_created": "2025-04-01",
+        "image_url": f"https://images.example.com/products/{i}.jpg",
+        "current_owner": "distributor-42",
+        "status": "In Transit",
+        "last_updated": datetime.utcnow(),
+        "batch_id": f"BATCH-{i // 100}",
+    } for i in range(count)]
+
+
+def old_path(documents):
+    products = []
+    for product in documents:
+        product = dict(product)
+        product["_id"] = str(product["_id"])
+        products.append(product)
+    return json.dumps(jsonable_encoder({"success": True, "products": products})).encode()
+
+
+def project(documents):
+    fields = ProductSummary.model_fields
+    return [{k: v for k, v in doc.items() if k in fields} for doc in documents]
+
+
+def new_path(documents):
+    return ProductListResponse(products=project(documents)).model_dump_json().encode()
+
+
+def msgpack_path(documents):
+    return msgpack.packb(ProductListResponse(products=project(documents)).model_dump(mode="json"))
+
+
+def measure(fn, documents, rounds):
+    body = fn(documents)
+    started = time.process_time()
+    for _ in range(rounds):
+        fn(documents)
+    return body, (time.process_time() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list response serialization")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    documents = make_documents(args.products)
+    paths = [("old (full docs, json)", old_path), ("new (projection, pydantic)", new_path)]
+    if msgpack:
+        paths.append(("new (projection, msgpack)", msgpack_path))
+
+    for name, fn in paths:
+        body, cpu_ms = measure(fn, documents, args.rounds)
+        print(f"{name:28s} {len(body):10,d} bytes  gzip {len(gzip.compress(body)):9,d} bytes  {cpu_ms:8.1f} ms CPU")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,208 +1,506 @@
-from web3 import Web3
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
+import asyncio
+import contextvars
+import functools
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import dotenv_values
 import os
 
+from chain_cache import AsyncViewCache, ViewCache
+import profiling
+
 # Load environment variables
 config = dotenv_values("../.env")
 PROVIDER_URL = config.get("PROVIDER_URL", "http://127.0.0.1:7545")
 CONTRACT_ADDRESS = config.get("CONTRACT_ADDRESS")
 PRIVATE_KEY = config.get("PRIVATE_KEY")
 
-# Initialize Web3
-w3 = Web3(Web3.HTTPProvider(PROVIDER_URL))
+# "http" talks to a node such as Ganache, "embedded" runs an in-process EVM
+CHAIN_BACKEND = config.get("CHAIN_BACKEND", "http")
+CHAIN_DATA_DIR = config.get("CHAIN_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "chaindata"))
 
-# Check if connected to Ethereum node
-def is_connected():
-    return w3.is_connected()
+# Connections to the node shared by all concurrent requests of a worker
+RPC_MAX_CONNECTIONS = int(config.get("RPC_MAX_CONNECTIONS", "32"))
+RPC_TIMEOUT = float(config.get("RPC_TIMEOUT", "30"))
+
+# View call cache settings
+VIEW_CACHE_SIZE = int(config.get("VIEW_CACHE_SIZE", "10000"))
+BLOCK_POLL_INTERVAL = float(config.get("BLOCK_POLL_INTERVAL", "1.0"))
+
+# Field mask bits of the contract's updateProduct
+UPDATE_OWNER = 1
+UPDATE_STATUS = 2
+UPDATE_LOCATION = 4
+UPDATE_QUANTITY = 8
+UPDATE_POSITION = 16
+
+# Path to contract JSON file (compiled contract)
+CONTRACT_PATH = os.path.join(os.path.dirname(__file__), "..", "contracts", "SupplyChain.json")
+SOURCE_PATH = os.path.join(os.path.dirname(__file__), "..", "contracts", "SupplyChain.sol")
+
+
+# Read ABI, bytecode and deployed address from either a Truffle artifact or
+# the standard-JSON output written by contracts/compile.py
+def load_artifact(path=CONTRACT_PATH):
+    with open(path, 'r') as file:
+        contract_json = json.load(file)
+
+    if "contracts" in contract_json:
+        compiled = contract_json["contracts"]["SupplyChain.sol"]["SupplyChain"]
+        return {"abi": compiled["abi"], "bytecode": compiled["evm"]["bytecode"]["object"], "networks": {}}
+
+    return {
+        "abi": contract_json["abi"],
+        "bytecode": contract_json.get("bytecode"),
+        "networks": contract_json.get("networks", {}),
+        "source": contract_json.get("source"),
+    }
+
+
+# Warn when the artifact was compiled from an older SupplyChain.sol: calls
+# added to the contract since then are missing from its ABI and bytecode,
+# so supports() reports them unavailable and the fallbacks are used
+def check_artifact(artifact):
+    if artifact.get("source") is None or not os.path.exists(SOURCE_PATH):
+        return
+    with open(SOURCE_PATH) as file:
+        if file.read() != artifact["source"]:
+            print("Warning: contracts/SupplyChain.json is older than contracts/SupplyChain.sol, "
+                  "run contracts/compile.py to rebuild it")
+
+
+class HttpChain:
+    """Contract access through a JSON-RPC node."""
+
+    name = "http"
+
+    def __init__(self, provider_url=PROVIDER_URL, private_key=PRIVATE_KEY):
+        self.w3 = Web3(Web3.HTTPProvider(provider_url))
+        self.w3.middleware_onion.add(profiling.web3_middleware, "profiling")
+        self.private_key = private_key
+        self.contract = self._load_contract()
+
+    def _load_contract(self):
+        artifact = load_artifact()
+        check_artifact(artifact)
 
-# Load contract ABI
-def load_contract():
-    # Path to contract JSON file (compiled contract)
-    contract_path = os.path.join(os.path.dirname(__file__), "..", "contracts", "SupplyChain.json")
-    
-    try:
-        with open(contract_path, 'r') as file:
-            contract_json = json.load(file)
-            
-        # Get ABI
-        abi = contract_json["abi"]
-        
         # Get contract address from JSON if not in env
-        networks = contract_json.get("networks", {})
+        networks = artifact["networks"]
+        network_id = list(networks.keys())[0] if networks else None
+        address = networks.get(network_id, {}).get("address", CONTRACT_ADDRESS) if network_id else CONTRACT_ADDRESS
+
+        if not address:
+            raise ValueError("Contract address not available")
+
+        return self.w3.eth.contract(address=address, abi=artifact["abi"])
+
+    def is_connected(self):
+        return self.w3.is_connected()
+
+    # Get account address from private key, or the first node account
+    def get_account(self):
+        if not self.private_key:
+            return self.w3.eth.accounts[0]
+        return self.w3.eth.account.from_key(self.private_key).address
+
+    def block_number(self):
+        return self.w3.eth.block_number
+
+    # Whether the deployed ABI has a function; lets newer calls fall back
+    # on contracts compiled before they existed
+    def supports(self, fn_name):
+        return any(entry.get("type") == "function" and entry.get("name") == fn_name
+                   for entry in self.contract.abi)
+
+    # Call a view function
+    def call(self, fn_name, *args):
+        return getattr(self.contract.functions, fn_name)(*args).call()
+
+    # Send a transaction and optionally wait for its receipt.
+    # Returns (tx_hash, receipt); receipt is None when not waiting.
+    # A nonce can be passed in by a caller that allocates them itself.
+    def transact(self, fn_name, *args, wait=True, nonce=None):
+        fn = getattr(self.contract.functions, fn_name)(*args)
+        account = self.get_account()
+
+        if self.private_key:
+            tx = fn.build_transaction({
+                'from': account,
+                'nonce': nonce if nonce is not None else self.w3.eth.get_transaction_count(account),
+                'gas': 2000000,
+                'gasPrice': self.w3.eth.gas_price
+            })
+            signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        else:
+            tx_hash = fn.transact({'from': account})
+
+        receipt = None
+        if wait:
+            with profiling.span("receipt_wait"):
+                receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        return tx_hash.hex(), receipt
+
+
+class EmbeddedChain(HttpChain):
+    """In-process EVM (py-evm via eth-tester) running the compiled contract.
+
+    State is persisted as a journal of contract writes under CHAIN_DATA_DIR
+    and replayed, with the original block timestamps, on startup.
+
+    py-evm and the journal are not thread-safe, so every request to the
+    EVM, including direct use of w3, is serialised on one lock, and a
+    write holds it until its journal line is on disk.
+    """
+
+    name = "embedded"
+
+    def __init__(self, data_dir=CHAIN_DATA_DIR):
+        # Optional dependencies, only needed for this mode
+        from eth_tester import EthereumTester, PyEVMBackend
+        from web3.providers.eth_tester import EthereumTesterProvider
+
+        self.lock = threading.RLock()
+        self.tester = EthereumTester(PyEVMBackend())
+        self.w3 = Web3(EthereumTesterProvider(self.tester))
+        self.w3.middleware_onion.add(self._serialize, "serialize")
+        self.w3.middleware_onion.add(profiling.web3_middleware, "profiling")
+        self.private_key = None
+        self.account = self.w3.eth.accounts[0]
+
+        os.makedirs(data_dir, exist_ok=True)
+        self.journal_path = os.path.join(data_dir, "embedded-journal.ndjson")
+
+        self.contract = self._deploy()
+        self._replay()
+        self.journal = open(self.journal_path, "a")
+
+    def _deploy(self):
+        artifact = load_artifact()
+        check_artifact(artifact)
+        if not artifact["bytecode"]:
+            raise ValueError("Contract bytecode not available, run contracts/compile.py")
+
+        factory = self.w3.eth.contract(abi=artifact["abi"], bytecode=artifact["bytecode"])
+        tx_hash = factory.constructor().transact({'from': self.account})
+        receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        return self.w3.eth.contract(address=receipt.contractAddress, abi=artifact["abi"])
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path) as journal:
+            for line in journal:
+                entry = json.loads(line)
+                try:
+                    self.tester.time_travel(entry["timestamp"])
+                except Exception:
+                    # Timestamps must increase; keep the current clock otherwise
+                    pass
+                getattr(self.contract.functions, entry["fn"])(*entry["args"]).transact({'from': self.account})
+
+    def _serialize(self, make_request, w3):
+        def middleware(method, params):
+            with self.lock:
+                return make_request(method, params)
+        return middleware
+
+    def get_account(self):
+        return self.account
+
+    def transact(self, fn_name, *args, wait=True, nonce=None):
+        # Held across the transaction and its journal line so the journal
+        # keeps the order the EVM applied the writes in
+        with self.lock:
+            tx_hash = getattr(self.contract.functions, fn_name)(*args).transact({'from': self.account})
+
+            # Blocks are mined immediately, so the receipt is always available
+            receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+            block = self.w3.eth.get_block(receipt.blockNumber)
+            if receipt.status == 1:
+                self.journal.write(json.dumps({"fn": fn_name, "args": list(args), "timestamp": block.timestamp}) + "\n")
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+
+        return tx_hash.hex(), receipt if wait else None
+
+
+class AsyncHttpChain:
+    """asyncio-native contract access through a JSON-RPC node.
+
+    All requests of a worker share one aiohttp session whose connector
+    allows at most max_connections concurrent connections, so reads
+    overlap on the event loop without opening a socket each. Signed
+    submissions are serialised to keep nonces in order; receipts are
+    polled concurrently.
+    """
+
+    name = "http"
+
+    def __init__(self, provider_url=PROVIDER_URL, private_key=PRIVATE_KEY, max_connections=RPC_MAX_CONNECTIONS):
+        self.provider = AsyncHTTPProvider(provider_url)
+        self.w3 = AsyncWeb3(self.provider)
+        self.w3.middleware_onion.add(profiling.async_web3_middleware, "profiling")
+        self.private_key = private_key
+        self.max_connections = max_connections
+        self.session = None
+        self.account = None
+        self.contract = None
+        self.submit_lock = None
+
+    # Must run on the event loop that will use the chain
+    async def connect(self):
+        import aiohttp
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT),
+            raise_for_status=True,
+        )
+        await self.provider.cache_async_session(self.session)
+        self.submit_lock = asyncio.Lock()
+
+        artifact = load_artifact()
+        networks = artifact["networks"]
         network_id = list(networks.keys())[0] if networks else None
         address = networks.get(network_id, {}).get("address", CONTRACT_ADDRESS) if network_id else CONTRACT_ADDRESS
-        
         if not address:
             raise ValueError("Contract address not available")
-            
-        # Create contract instance
-        contract = w3.eth.contract(address=address, abi=abi)
-        return contract
-    
+        self.contract = self.w3.eth.contract(address=address, abi=artifact["abi"])
+
+        if self.private_key:
+            self.account = self.w3.eth.account.from_key(self.private_key).address
+        else:
+            self.account = (await self.w3.eth.accounts)[0]
+        return self
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    async def is_connected(self):
+        return await self.w3.is_connected()
+
+    def get_account(self):
+        return self.account
+
+    async def block_number(self):
+        return await self.w3.eth.block_number
+
+    async def get_block(self, number, full_transactions=False):
+        return await self.w3.eth.get_block(number, full_transactions=full_transactions)
+
+    supports = HttpChain.supports
+
+    async def call(self, fn_name, *args):
+        return await getattr(self.contract.functions, fn_name)(*args).call()
+
+    # Same contract as HttpChain.transact
+    async def transact(self, fn_name, *args, wait=True, nonce=None):
+        fn = getattr(self.contract.functions, fn_name)(*args)
+
+        async with self.submit_lock:
+            if self.private_key:
+                tx = await fn.build_transaction({
+                    'from': self.account,
+                    'nonce': nonce if nonce is not None else await self.w3.eth.get_transaction_count(self.account, "pending"),
+                    'gas': 2000000,
+                    'gasPrice': await self.w3.eth.gas_price
+                })
+                signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+                tx_hash = await self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+            else:
+                tx_hash = await fn.transact({'from': self.account})
+
+        receipt = None
+        if wait:
+            with profiling.span("receipt_wait"):
+                receipt = await self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        return tx_hash.hex(), receipt
+
+
+class ThreadedChain:
+    """Awaitable interface over a synchronous chain backend (the embedded
+    EVM, or the coordinator proxy in multi-worker mode). Calls run on a
+    thread pool so they do not block the event loop; writes can be given a
+    pool of their own. The embedded EVM serialises every call anyway, so it
+    gets a single thread instead of a pool."""
+
+    def __init__(self, chain, max_workers=RPC_MAX_CONNECTIONS, write_executor=None):
+        self.chain = chain
+        self.name = getattr(chain, "name", "threaded")
+        self.w3 = chain.w3
+        self.contract = chain.contract
+        self.private_key = chain.private_key
+        if isinstance(chain, EmbeddedChain):
+            max_workers = 1
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chain-read")
+        self.write_executor = write_executor or self.executor
+
+    async def _run(self, executor, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Carry the request context (e.g. profiling timers) into the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    async def connect(self):
+        return self
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def is_connected(self):
+        return await self._run(self.executor, self.chain.is_connected)
+
+    def get_account(self):
+        return self.chain.get_account()
+
+    async def block_number(self):
+        return await self._run(self.executor, self.chain.block_number)
+
+    async def get_block(self, number, full_transactions=False):
+        return await self._run(self.executor, self.w3.eth.get_block, number, full_transactions)
+
+    def supports(self, fn_name):
+        if self.contract is None:
+            # Embedded chain inside the coordinator, deployed from the local artifact
+            return any(entry.get("type") == "function" and entry.get("name") == fn_name
+                       for entry in load_artifact()["abi"])
+        return HttpChain.supports(self, fn_name)
+
+    async def call(self, fn_name, *args):
+        return await self._run(self.executor, self.chain.call, fn_name, *args)
+
+    async def transact(self, fn_name, *args, wait=True):
+        return await self._run(self.write_executor, self.chain.transact, fn_name, *args, wait=wait)
+
+
+# Awaitable chain backend for the API: the native async client for a JSON-RPC
+# node, otherwise the synchronous backend on a thread pool
+async def connect_async_chain(chain=None, write_executor=None):
+    if chain is None and CHAIN_BACKEND != "embedded":
+        return await AsyncHttpChain().connect()
+    if chain is None:
+        chain = await asyncio.get_running_loop().run_in_executor(None, get_chain)
+    return ThreadedChain(chain, write_executor=write_executor)
+
+
+def async_view_cache(chain):
+    return AsyncViewCache(chain, max_entries=VIEW_CACHE_SIZE, poll_interval=BLOCK_POLL_INTERVAL)
+
+
+_chain = None
+_view_cache = None
+
+
+# Shared chain backend selected by CHAIN_BACKEND
+def get_chain():
+    global _chain
+    if _chain is None:
+        if CHAIN_BACKEND == "embedded":
+            _chain = EmbeddedChain()
+        else:
+            _chain = HttpChain()
+    return _chain
+
+
+# Use a specific backend, e.g. the coordinator proxy in multi-worker mode
+def use_chain(chain):
+    global _chain, _view_cache
+    _chain = chain
+    _view_cache = None
+
+
+# Shared block-aware cache in front of the chain's view calls
+def get_view_cache():
+    global _view_cache
+    if _view_cache is None:
+        _view_cache = ViewCache(get_chain(), max_entries=VIEW_CACHE_SIZE, poll_interval=BLOCK_POLL_INTERVAL)
+    return _view_cache
+
+
+# Check if connected to Ethereum node
+def is_connected():
+    return get_chain().is_connected()
+
+
+# Load contract ABI
+def load_contract():
+    try:
+        return get_chain().contract
     except Exception as e:
         print(f"Error loading contract: {e}")
         return None
 
+
 # Get account address from private key
 def get_account():
-    if not PRIVATE_KEY:
-        # If no private key, use the first account from Ganache
-        return w3.eth.accounts[0]
-    
-    # Create account from private key
-    account = w3.eth.account.from_key(PRIVATE_KEY)
-    return account.address
+    return get_chain().get_account()
 
-# Add a product to the blockchain
-def add_product(product_id, name, owner):
+
+def _send(fn_name, *args):
     try:
-        contract = load_contract()
-        if not contract:
-            return None, "Contract not loaded"
-            
-        account = get_account()
-        
-        # Build transaction
-        tx = contract.functions.addProduct(
-            product_id,
-            name,
-            owner
-        ).build_transaction({
-            'from': account,
-            'nonce': w3.eth.get_transaction_count(account),
-            'gas': 2000000,
-            'gasPrice': w3.eth.gas_price
-        })
-        
-        # Sign and send transaction
-        if PRIVATE_KEY:
-            signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        else:
-            tx_hash = contract.functions.addProduct(
-                product_id, 
-                name, 
-                owner
-            ).transact({'from': account})
-        
-        # Wait for transaction receipt
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-        return receipt.transactionHash.hex(), None
-    
+        tx_hash, receipt = get_chain().transact(fn_name, *args)
+        get_view_cache().invalidate(args[0])
+        return tx_hash, None
     except Exception as e:
         return None, str(e)
 
+
+# Add a product to the blockchain
+def add_product(product_id, name, owner):
+    return _send("addProduct", product_id, name, owner)
+
+
 # Transfer product ownership
 def transfer_product(product_id, new_owner, new_status):
-    try:
-        contract = load_contract()
-        if not contract:
-            return None, "Contract not loaded"
-            
-        account = get_account()
-        
-        # Build transaction
-        tx = contract.functions.transferProduct(
-            product_id,
-            new_owner,
-            new_status
-        ).build_transaction({
-            'from': account,
-            'nonce': w3.eth.get_transaction_count(account),
-            'gas': 2000000,
-            'gasPrice': w3.eth.gas_price
-        })
-        
-        # Sign and send transaction
-        if PRIVATE_KEY:
-            signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        else:
-            tx_hash = contract.functions.transferProduct(
-                product_id, 
-                new_owner, 
-                new_status
-            ).transact({'from': account})
-        
-        # Wait for transaction receipt
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-        return receipt.transactionHash.hex(), None
-    
-    except Exception as e:
-        return None, str(e)
+    return _send("transferProduct", product_id, new_owner, new_status)
+
 
 # Update product status
 def update_product_status(product_id, new_status):
-    try:
-        contract = load_contract()
-        if not contract:
-            return None, "Contract not loaded"
-            
-        account = get_account()
-        
-        # Build transaction
-        tx = contract.functions.updateProductStatus(
-            product_id,
-            new_status
-        ).build_transaction({
-            'from': account,
-            'nonce': w3.eth.get_transaction_count(account),
-            'gas': 2000000,
-            'gasPrice': w3.eth.gas_price
-        })
-        
-        # Sign and send transaction
-        if PRIVATE_KEY:
-            signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        else:
-            tx_hash = contract.functions.updateProductStatus(
-                product_id, 
-                new_status
-            ).transact({'from': account})
-        
-        # Wait for transaction receipt
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-        return receipt.transactionHash.hex(), None
-    
-    except Exception as e:
-        return None, str(e)
+    return _send("updateProductStatus", product_id, new_status)
+
 
 # Get product details from blockchain
 def get_product(product_id):
     try:
-        contract = load_contract()
-        if not contract:
-            return None, "Contract not loaded"
-        
-        product = contract.functions.getProduct(product_id).call()
-        
+        chain = get_view_cache()
+
+        product = chain.call("getProduct", product_id)
+
         # Get product history
-        history_count = contract.functions.getProductHistoryCount(product_id).call()
+        history_count = chain.call("getProductHistoryCount", product_id)
         history = []
-        
+
         for i in range(history_count):
-            tx = contract.functions.getProductHistoryItem(product_id, i).call()
+            tx = chain.call("getProductHistoryItem", product_id, i)
             history.append({
                 "fromOwner": tx[0],
                 "toOwner": tx[1],
                 "action": tx[2],
                 "status": tx[3],
-                "timestamp": tx[4]
+                "location": tx[4],
+                "note": tx[5],
+                "timestamp": tx[6]
             })
-        
+
         result = {
             "productId": product[0],
             "name": product[1],
-            "currentOwner": product[2],
-            "status": product[3],
-            "createdAt": product[4],
-            "updatedAt": product[5],
+            "category": product[2],
+            "currentOwner": product[3],
+            "status": product[4],
+            "location": product[5],
+            "createdAt": product[6],
+            "updatedAt": product[7],
             "history": history
         }
-        
+
         return result, None
-    
+
     except Exception as e:
-        return None, str(e)
\ No newline at end of file
+        return None, str(e)
@@ -0,0 +1,44 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Bloom filter over strings using double hashing of one blake2b digest."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "items_added": self.count,
+            "size_bytes": len(self.bits),
+            "hashes": self.hashes,
+            "target_error_rate": self.error_rate,
+        }
+
+
+# Digest of the product state we expect on chain. Kept on the product
+# document so a scan only needs one indexed lookup and one cached view call.
+def authenticity_digest(product_id, name, owner, status):
+    canonical = "\x1f".join([product_id or "", name or "", owner or "", status or ""])
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,187 @@
+"""Circuit breaker and per-call deadlines for chain access.
+
+Every call through GuardedChain gets a deadline. The breaker opens after
+failure_threshold consecutive failures (deadline exceeded, connection
+errors) or slow_calls consecutive reads slower than slow_ms, and then fails
+calls immediately for open_seconds. After that a single probe call is let
+through (half-open); its outcome closes the breaker or opens it again.
+Contract reverts mean the node answered and count as successes.
+"""
+import asyncio
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BreakerOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} unavailable, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def _transport_errors():
+    errors = (asyncio.TimeoutError, TimeoutError, ConnectionError, OSError)
+    try:
+        import aiohttp
+        import requests
+    except ImportError:
+        return errors
+    return errors + (aiohttp.ClientError, requests.RequestException)
+
+
+class CircuitBreaker:
+    def __init__(self, name="chain", failure_threshold=5, slow_ms=1000, slow_calls=5, open_seconds=15):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_ms = slow_ms
+        self.slow_calls = slow_calls
+        self.open_seconds = open_seconds
+
+        # Only touched from the event loop, except stats() from anywhere
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.consecutive_failures = 0
+        self.consecutive_slow = 0
+
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
+        self.short_circuited = 0
+        self.times_opened = 0
+        self.last_error = None
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def is_open(self):
+        with self.lock:
+            return self.state == OPEN and self.retry_after() > 0
+
+    # Raises BreakerOpen unless a call may go ahead
+    def before_call(self):
+        with self.lock:
+            if self.state == OPEN:
+                if self.retry_after() > 0:
+                    self.short_circuited += 1
+                    raise BreakerOpen(self.name, self.retry_after())
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.short_circuited += 1
+                    raise BreakerOpen(self.name, self.open_seconds)
+                self.probing = True
+            self.calls += 1
+
+    def record_success(self, seconds, check_latency=True):
+        with self.lock:
+            self.probing = False
+            # A call that started before the breaker opened proves nothing
+            if self.state == OPEN:
+                return
+            self.consecutive_failures = 0
+            if check_latency and seconds * 1000 > self.slow_ms:
+                self.slow += 1
+                self.consecutive_slow += 1
+                if self.consecutive_slow >= self.slow_calls or self.state == HALF_OPEN:
+                    self._open(f"{self.consecutive_slow} calls slower than {self.slow_ms:.0f}ms")
+                return
+            self.consecutive_slow = 0
+            self.state = CLOSED
+
+    def record_cancelled(self):
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self, error):
+        with self.lock:
+            self.probing = False
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            if self.consecutive_failures >= self.failure_threshold or self.state == HALF_OPEN:
+                self._open(self.last_error)
+
+    def _open(self, reason):
+        if self.state != OPEN:
+            self.times_opened += 1
+            print(f"Warning: {self.name} circuit opened: {reason}")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.consecutive_failures = 0
+        self.consecutive_slow = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "retry_after": round(self.retry_after(), 1) if self.state == OPEN else None,
+                "calls": self.calls,
+                "failures": self.failures,
+                "slow_calls": self.slow,
+                "short_circuited": self.short_circuited,
+                "times_opened": self.times_opened,
+                "last_error": self.last_error,
+            }
+
+
+class GuardedChain:
+    """Awaitable chain backend with deadlines and a circuit breaker in front
+    of another awaitable backend (see blockchain.connect_async_chain)."""
+
+    def __init__(self, chain, breaker, read_timeout=2.0, write_timeout=10.0, confirm_timeout=60.0):
+        self.chain = chain
+        self.breaker = breaker
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.confirm_timeout = confirm_timeout
+        self.transport_errors = _transport_errors()
+
+    def __getattr__(self, attr):
+        # name, w3, contract, private_key, supports, get_account, close, ...
+        return getattr(self.chain, attr)
+
+    async def _guarded(self, awaitable, timeout, check_latency=True):
+        try:
+            self.breaker.before_call()
+        except BreakerOpen:
+            awaitable.close()
+            raise
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout)
+        except self.transport_errors as e:
+            self.breaker.record_failure(e)
+            raise
+        except Exception:
+            # The node answered, e.g. with a revert
+            self.breaker.record_success(time.monotonic() - started, check_latency=False)
+            raise
+        except BaseException:
+            # Cancelled by the caller; says nothing about the node
+            self.breaker.record_cancelled()
+            raise
+        self.breaker.record_success(time.monotonic() - started, check_latency)
+        return result
+
+    async def call(self, fn_name, *args):
+        return await self._guarded(self.chain.call(fn_name, *args), self.read_timeout)
+
+    async def block_number(self):
+        return await self._guarded(self.chain.block_number(), self.read_timeout)
+
+    async def get_block(self, number, full_transactions=False):
+        return await self._guarded(self.chain.get_block(number, full_transactions), self.read_timeout)
+
+    async def is_connected(self):
+        return await self._guarded(self.chain.is_connected(), self.read_timeout)
+
+    # Confirmation time depends on the node's block production, so only
+    # failures count for writes, not latency
+    async def transact(self, fn_name, *args, wait=True):
+        timeout = self.confirm_timeout if wait else self.write_timeout
+        return await self._guarded(self.chain.transact(fn_name, *args, wait=wait), timeout, check_latency=False)
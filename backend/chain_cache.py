@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+# Product ids named by the decoded arguments of a contract call: the product
+# itself, the parent and child of a split and every product of a merge
+def touched_products(params):
+    ids = [params[name] for name in ("_productId", "_parentId", "_childId") if params.get(name)]
+    ids.extend(params.get("_parentIds") or [])
+    return ids
+
+
+class ViewCache:
+    """Bounded LRU cache for contract view calls.
+
+    Entries are keyed by (function, args) and remember the block they were
+    read at. An entry stays valid until a block containing a write to the
+    same product is observed, or until the product is invalidated locally
+    after one of our own writes. The head block is polled at most once per
+    poll_interval, so repeated reads between blocks issue no RPC calls.
+    """
+
+    # Beyond this many new blocks it is cheaper to drop everything
+    MAX_SCAN_BLOCKS = 100
+
+    def __init__(self, chain, max_entries=10000, poll_interval=1.0):
+        self.chain = chain
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+
+        self.entries = OrderedDict()
+        self.keys_by_product = {}
+        self.block_number = None
+        self.last_poll = 0.0
+
+        # Bumped on every clear / per-product invalidation so that a read
+        # racing with a write is not stored after the write invalidated it
+        self.epoch = 0
+        self.generations = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def call(self, fn_name, *args):
+        self._refresh_block()
+
+        key = (fn_name, args)
+        hit, value, version = self._lookup(key)
+        if hit:
+            return value
+        value = self.chain.call(fn_name, *args)
+        self._store(key, value, version)
+        return value
+
+    # Returns (hit, value, version); version is what _store needs on a miss
+    def _lookup(self, key):
+        args = key[1]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1], None
+            self.misses += 1
+            return False, None, (self.block_number, self._version(args))
+
+    def _version(self, args):
+        return self.epoch, self.generations.get(args[0]) if args else None
+
+    def _store(self, key, value, version):
+        args = key[1]
+        block_number, read_version = version
+        with self.lock:
+            # Skip storing if the product was invalidated while we were reading
+            if read_version == self._version(args):
+                self.entries[key] = (block_number, value)
+                self.entries.move_to_end(key)
+                if args:
+                    self.keys_by_product.setdefault(args[0], set()).add(key)
+                while len(self.entries) > self.max_entries:
+                    old_key, _ = self.entries.popitem(last=False)
+                    self._unindex(old_key)
+                    self.evictions += 1
+
+    # Drop cached reads for a product, e.g. right after writing to it
+    def invalidate(self, product_id):
+        with self.lock:
+            self.generations[product_id] = self.generations.get(product_id, 0) + 1
+            for key in self.keys_by_product.pop(product_id, ()):
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.keys_by_product.clear()
+            self.generations.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "block_number": self.block_number,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+    def _unindex(self, key):
+        args = key[1]
+        if args and args[0] in self.keys_by_product:
+            self.keys_by_product[args[0]].discard(key)
+            if not self.keys_by_product[args[0]]:
+                del self.keys_by_product[args[0]]
+
+    def _refresh_block(self):
+        now = time.monotonic()
+        if now - self.last_poll < self.poll_interval:
+            return
+        self.last_poll = now
+
+        try:
+            head = self.chain.block_number()
+        except Exception:
+            # Without a head we cannot tell what changed
+            self.clear()
+            return
+
+        previous = self.block_number
+        if self._needs_scan(previous, head):
+            try:
+                touched = self._touched_products(previous + 1, head)
+            except Exception:
+                touched = None
+            self._apply_touched(touched)
+
+        with self.lock:
+            self.block_number = head
+
+    # Whether the blocks since the last poll must be inspected; handles the
+    # cases where they need not or cannot be
+    def _needs_scan(self, previous, head):
+        if previous is None or head == previous:
+            return False
+        if head < previous or head - previous > self.MAX_SCAN_BLOCKS:
+            self.clear()
+            return False
+        # No local node to inspect (embedded chain behind the coordinator);
+        # invalidations arrive from the coordinator instead
+        return self.chain.contract is not None
+
+    def _apply_touched(self, touched):
+        if touched is None:
+            self.clear()
+        else:
+            for product_id in touched:
+                self.invalidate(product_id)
+
+    # Product ids written by contract transactions in a block range, or None
+    # if a transaction could not be decoded
+    def _touched_products(self, first, last):
+        touched = set()
+        for number in range(first, last + 1):
+            block = self.chain.w3.eth.get_block(number, full_transactions=True)
+            if not self._collect_touched(block, touched):
+                return None
+        return touched
+
+    def _collect_touched(self, block, touched):
+        contract = self.chain.contract
+        for tx in block.transactions:
+            if not tx.get("to") or tx["to"].lower() != contract.address.lower():
+                continue
+            # eth-tester names the call data "data" rather than "input"
+            try:
+                _, params = contract.decode_function_input(tx.get("input", tx.get("data")))
+            except Exception:
+                return False
+            touched.update(touched_products(params))
+        return True
+
+
+class AsyncViewCache(ViewCache):
+    """ViewCache for an awaitable chain backend. Concurrent misses for the
+    same call share one RPC request."""
+
+    def __init__(self, chain, max_entries=10000, poll_interval=1.0):
+        super().__init__(chain, max_entries=max_entries, poll_interval=poll_interval)
+        self.pending = {}
+        self.coalesced = 0
+
+    async def call(self, fn_name, *args):
+        await self._refresh_block()
+
+        key = (fn_name, args)
+        hit, value, version = self._lookup(key)
+        if hit:
+            return value
+
+        future = self.pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            value = await self.chain.call(fn_name, *args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; avoid "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._store(key, value, version)
+            return value
+        finally:
+            del self.pending[key]
+
+    async def _refresh_block(self):
+        now = time.monotonic()
+        if now - self.last_poll < self.poll_interval:
+            return
+        self.last_poll = now
+
+        try:
+            head = await self.chain.block_number()
+        except Exception:
+            self.clear()
+            return
+
+        previous = self.block_number
+        if self._needs_scan(previous, head):
+            try:
+                touched = set()
+                blocks = await asyncio.gather(*(
+                    self.chain.get_block(number, full_transactions=True) for number in range(previous + 1, head + 1)
+                ))
+                for block in blocks:
+                    if not self._collect_touched(block, touched):
+                        touched = None
+                        break
+            except Exception:
+                touched = None
+            self._apply_touched(touched)
+
+        with self.lock:
+            self.block_number = head
+
+    def stats(self):
+        return {**super().stats(), "coalesced": self.coalesced}
@@ -0,0 +1,121 @@
+"""Global change feed of product and transaction mutations.
+
+Every write path allocates the next number of a sequence kept in the
+counters collection and stores one change document under it, in the same
+round trip as the product and history writes (see history.record). A
+client keeps the token of the last change it applied and asks for the
+changes after it, so syncing costs time proportional to what changed.
+
+Sequence numbers are allocated before the change is written, so a reader
+can briefly see a change before an earlier one lands. Reads therefore stop
+at the first gap in the sequence unless the gap is older than
+GAP_WAIT_SECONDS, which means its writer gave up. Changes are kept for
+RETENTION_DAYS; a client with an older token has to download everything
+again.
+"""
+from datetime import datetime, timedelta
+
+from dotenv import dotenv_values
+from pymongo import ReturnDocument
+
+from db import changes_collection, counters_collection
+
+config = dotenv_values("../.env")
+RETENTION_DAYS = int(config.get("CHANGES_RETENTION_DAYS", "30"))
+GAP_WAIT_SECONDS = float(config.get("CHANGES_GAP_WAIT_SECONDS", "5"))
+
+COUNTER_ID = "changes"
+
+# Sequence numbers examined per read when looking for gaps
+SCAN_LIMIT = 10000
+
+
+class TokenExpired(Exception):
+    pass
+
+
+def ensure_indexes():
+    changes_collection.create_index("ts", expireAfterSeconds=RETENTION_DAYS * 24 * 3600)
+    changes_collection.create_index([("users", 1), ("_id", 1)])
+
+
+def next_seq():
+    counter = counters_collection.find_one_and_update(
+        {"_id": COUNTER_ID}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+
+# Tokens are opaque to clients; today they are the sequence number
+def encode_token(seq):
+    return str(seq)
+
+
+def decode_token(token):
+    if not token:
+        return 0
+    seq = int(token)
+    if seq < 0:
+        raise ValueError("Negative token")
+    return seq
+
+
+# Token of the newest change. Taken before a full download, it lets the
+# client continue from the feed without missing anything written meanwhile.
+def head_token():
+    counter = counters_collection.find_one({"_id": COUNTER_ID})
+    return encode_token(counter["seq"] if counter else 0)
+
+
+# Change document for a product write. fields are the product fields
+# that were set; event is the history event written with them.
+def build(kind, product_id, fields, event):
+    users = {event.get("from_user"), event.get("to_user")} - {None}
+    return {
+        "_id": next_seq(),
+        "ts": datetime.utcnow(),
+        "type": kind,
+        "productId": product_id,
+        # Who may see the change besides roles that see every product
+        "users": sorted(users),
+        "fields": {k: v for k, v in fields.items() if k not in ("_id", "auth_digest")},
+        "transaction": {"productId": product_id, **{k: v for k, v in event.items() if k != "tx_hashes"}},
+    }
+
+
+def _horizon(since, now):
+    horizon = since
+    stale_gap = now - timedelta(seconds=GAP_WAIT_SECONDS)
+    scanned = 0
+    for doc in changes_collection.find({"_id": {"$gt": since}}, {"_id": 1, "ts": 1}).sort("_id", 1).limit(SCAN_LIMIT):
+        scanned += 1
+        if doc["_id"] != horizon + 1 and doc["ts"] > stale_gap:
+            return horizon, False
+        horizon = doc["_id"]
+    return horizon, scanned == SCAN_LIMIT
+
+
+# Changes after the token, oldest first. query restricts which changes the
+# caller may see. Returns (changes, next_token, has_more).
+def read(token, query=None, limit=500, now=None):
+    since = decode_token(token)
+    now = now or datetime.utcnow()
+
+    if since:
+        # A token from another feed, or one whose following changes expired
+        head = decode_token(head_token())
+        if since > head:
+            raise TokenExpired()
+        oldest = changes_collection.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+        if oldest is None and since < head:
+            # Every change after the token has expired
+            raise TokenExpired()
+        if oldest is not None and oldest["_id"] > since + 1:
+            raise TokenExpired()
+
+    horizon, truncated = _horizon(since, now)
+    found = list(changes_collection.find({**(query or {}), "_id": {"$gt": since, "$lte": horizon}})
+                 .sort("_id", 1).limit(limit))
+    if len(found) == limit:
+        return found, encode_token(found[-1]["_id"]), True
+    return found, encode_token(horizon), truncated
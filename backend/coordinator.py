@@ -0,0 +1,283 @@
+"""Cross-process coordination for multi-worker serving.
+
+A single coordinator process owns everything that must not be duplicated
+per worker: nonce allocation, the one chain-write submitter, the cache
+invalidation log and the worker slots used as ID allocator node ids. Workers reach it over a local socket through
+multiprocessing managers.
+"""
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+import blockchain
+from chain_cache import touched_products
+
+COORDINATOR_ADDRESS_ENV = "COORDINATOR_ADDRESS"
+COORDINATOR_AUTHKEY_ENV = "COORDINATOR_AUTHKEY"
+COORDINATOR_WORKERS_ENV = "COORDINATOR_WORKERS"
+
+
+class NonceAllocator:
+    """Hands out consecutive nonces per account, starting from the node's
+    pending transaction count."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_nonces = {}
+
+    def next_nonce(self, account):
+        with self.lock:
+            if account not in self.next_nonces:
+                self.next_nonces[account] = blockchain.get_chain().w3.eth.get_transaction_count(account, "pending")
+            nonce = self.next_nonces[account]
+            self.next_nonces[account] += 1
+            return nonce
+
+    # Forget the local counter, e.g. after a transaction was rejected
+    def reset(self, account):
+        with self.lock:
+            self.next_nonces.pop(account, None)
+
+
+# Product ids a contract call writes, one string each
+def _touched_products(contract, fn_name, args):
+    for entry in contract.abi:
+        if entry.get("type") == "function" and entry.get("name") == fn_name and len(entry["inputs"]) == len(args):
+            return touched_products({i["name"]: arg for i, arg in zip(entry["inputs"], args)})
+    # Unknown to the ABI; the first argument is the product id by convention
+    return [args[0]] if args and isinstance(args[0], str) else []
+
+
+class ChainWriter:
+    """Single submitter for all chain writes of all workers."""
+
+    def __init__(self, nonces, bus):
+        self.lock = threading.Lock()
+        self.nonces = nonces
+        self.bus = bus
+
+    def transact(self, fn_name, args, wait=True):
+        chain = blockchain.get_chain()
+        with self.lock:
+            try:
+                if chain.private_key:
+                    account = chain.get_account()
+                    tx_hash, receipt = chain.transact(fn_name, *args, wait=False,
+                                                      nonce=self.nonces.next_nonce(account))
+                else:
+                    tx_hash, receipt = chain.transact(fn_name, *args, wait=False)
+            except Exception:
+                if chain.private_key:
+                    self.nonces.reset(chain.get_account())
+                raise
+
+        # Receipts are awaited outside the lock so submissions keep flowing
+        if wait:
+            receipt = chain.w3.eth.wait_for_transaction_receipt(tx_hash)
+        for product_id in _touched_products(chain.contract, fn_name, args):
+            self.bus.publish(product_id)
+        return tx_hash, receipt
+
+    def call(self, fn_name, args):
+        return blockchain.get_chain().call(fn_name, *args)
+
+    def block_number(self):
+        return blockchain.get_chain().block_number()
+
+
+class InvalidationBus:
+    """Bounded log of invalidated product ids. Workers poll it with the last
+    sequence number they have seen."""
+
+    def __init__(self, capacity=100000):
+        self.lock = threading.Lock()
+        self.log = deque(maxlen=capacity)
+        self.seq = 0
+
+    def publish(self, product_id):
+        with self.lock:
+            self.seq += 1
+            self.log.append((self.seq, product_id))
+
+    # Returns (seq, product_ids); product_ids is None when the caller fell
+    # so far behind that it must drop its whole cache
+    def poll(self, since):
+        with self.lock:
+            if since > self.seq:
+                return self.seq, None
+            if not self.log or since >= self.seq:
+                return self.seq, []
+            if self.log[0][0] > since + 1:
+                return self.seq, None
+            return self.seq, [pid for seq, pid in self.log if seq > since]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkerRegistry:
+    """Gives each live worker process a distinct slot number. Slots of
+    workers that have exited are reused."""
+
+    def __init__(self, size=1024):
+        self.lock = threading.Lock()
+        self.size = size
+        self.slots = {}
+
+    def register(self, pid):
+        with self.lock:
+            for slot, owner in list(self.slots.items()):
+                if owner == pid:
+                    return slot
+                if not _alive(owner):
+                    del self.slots[slot]
+            for slot in range(self.size):
+                if slot not in self.slots:
+                    self.slots[slot] = pid
+                    return slot
+        raise RuntimeError("No free worker slots")
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+# Shared instances, only used inside the coordinator process
+_nonces = NonceAllocator()
+_bus = InvalidationBus()
+_writer = ChainWriter(_nonces, _bus)
+_workers = WorkerRegistry()
+
+
+def _get_nonces():
+    return _nonces
+
+
+def _get_writer():
+    return _writer
+
+
+def _get_bus():
+    return _bus
+
+
+def _get_workers():
+    return _workers
+
+
+CoordinatorManager.register("nonces", callable=_get_nonces)
+CoordinatorManager.register("writer", callable=_get_writer)
+CoordinatorManager.register("bus", callable=_get_bus)
+CoordinatorManager.register("workers", callable=_get_workers)
+
+
+def parse_address(address):
+    # "host:port" for TCP, anything else is a unix socket path
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return address
+
+
+# Start the coordinator in a child process and export its address so that
+# worker processes started afterwards can connect
+def start(address, authkey, workers=1):
+    manager = CoordinatorManager(address=parse_address(address), authkey=authkey.encode())
+    manager.start()
+    os.environ[COORDINATOR_ADDRESS_ENV] = address
+    os.environ[COORDINATOR_AUTHKEY_ENV] = authkey
+    os.environ[COORDINATOR_WORKERS_ENV] = str(workers)
+    return manager
+
+
+def configured():
+    return bool(os.environ.get(COORDINATOR_ADDRESS_ENV))
+
+
+# Number of API worker processes sharing the coordinator
+def worker_count():
+    if not configured():
+        return 1
+    return max(1, int(os.environ.get(COORDINATOR_WORKERS_ENV, "1")))
+
+
+def connect():
+    manager = CoordinatorManager(
+        address=parse_address(os.environ[COORDINATOR_ADDRESS_ENV]),
+        authkey=os.environ[COORDINATOR_AUTHKEY_ENV].encode()
+    )
+    manager.connect()
+    return manager
+
+
+class CoordinatedChain:
+    """Chain backend used by workers when a coordinator is running.
+
+    Writes go through the coordinator's single submitter. Reads go straight
+    to the node so they scale with the number of workers, except for the
+    embedded EVM, which only exists inside the coordinator.
+    """
+
+    def __init__(self, manager):
+        self.writer = manager.writer()
+        self.local = None if blockchain.CHAIN_BACKEND == "embedded" else blockchain.HttpChain()
+        self.w3 = self.local.w3 if self.local else None
+        self.contract = self.local.contract if self.local else None
+        self.private_key = None
+
+    def call(self, fn_name, *args):
+        if self.local:
+            return self.local.call(fn_name, *args)
+        return self.writer.call(fn_name, list(args))
+
+    def transact(self, fn_name, *args, wait=True):
+        return self.writer.transact(fn_name, list(args), wait)
+
+    def block_number(self):
+        if self.local:
+            return self.local.block_number()
+        return self.writer.block_number()
+
+
+# Apply invalidations published by other workers to the local view cache
+def follow_invalidations(manager, view_cache, interval=0.2, on_products=None):
+    bus = manager.bus()
+    seq, _ = bus.poll(0)
+
+    def loop():
+        nonlocal seq
+        while True:
+            time.sleep(interval)
+            try:
+                seq, product_ids = bus.poll(seq)
+            except Exception:
+                view_cache.clear()
+                continue
+            try:
+                if product_ids is None:
+                    view_cache.clear()
+                else:
+                    for product_id in product_ids:
+                        view_cache.invalidate(product_id)
+                # None tells the callback that it missed part of the log
+                if on_products:
+                    on_products(product_ids)
+            except Exception as e:
+                # A bad entry must not stop the follower; start over clean
+                print(f"Warning: Could not apply invalidations: {e}")
+                view_cache.clear()
+                if on_products:
+                    on_products(None)
+
+    thread = threading.Thread(target=loop, name="invalidation-follower", daemon=True)
+    thread.start()
+    return thread
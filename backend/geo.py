@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Structured product positions and geospatial queries.
+
+Products carry their latest fix as a GeoJSON point in `position`; every fix
+is also appended to the location_history collection. Both are covered by
+2dsphere indexes, so proximity and region queries do not scan. Free-form
+location names are geocoded against a local gazetteer (the places
+collection) when no explicit coordinates are given. Usage:
+    python geo.py --load-places places.csv   # name,lat,lon per line
+    python geo.py --backfill                 # geocode existing product locations
+"""
+import argparse
+import csv
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from db import location_history_collection, places_collection, products_collection
+
+
+def ensure_indexes():
+    products_collection.create_index([("position", "2dsphere")])
+    location_history_collection.create_index([("position", "2dsphere"), ("ts", 1)])
+    location_history_collection.create_index([("productId", 1), ("ts", 1)])
+    places_collection.create_index("name", unique=True)
+
+
+def point(lat, lon):
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def normalize(name):
+    return " ".join(name.lower().split())
+
+
+# Geocoded names kept per process, least recently used evicted first
+GEOCODE_CACHE_SIZE = 10000
+_geocode_cache = OrderedDict()
+_geocode_lock = threading.Lock()
+
+
+# Returns (lat, lon) for a known place name, or None. Found places are
+# cached; misses are not, so places added to the gazetteer later are used
+# without a restart.
+def geocode(name):
+    if not name:
+        return None
+    key = normalize(name)
+    with _geocode_lock:
+        if key in _geocode_cache:
+            _geocode_cache.move_to_end(key)
+            return _geocode_cache[key]
+
+    place = places_collection.find_one({"name": key}, {"position": 1, "_id": 0})
+    if not place:
+        return None
+    lon, lat = place["position"]["coordinates"]
+    with _geocode_lock:
+        _geocode_cache[key] = (lat, lon)
+        if len(_geocode_cache) > GEOCODE_CACHE_SIZE:
+            _geocode_cache.popitem(last=False)
+    return lat, lon
+
+
+def to_microdegrees(lat, lon):
+    return int(round(lat * 1e6)), int(round(lon * 1e6))
+
+
+def record_fix(product_id, lat, lon, location=None, owner=None, ts=None):
+    location_history_collection.insert_one({
+        "productId": product_id,
+        "position": point(lat, lon),
+        "location": location,
+        "owner": owner,
+        "ts": ts or datetime.utcnow(),
+    })
+
+
+# Products whose latest position is within radius_km, nearest first
+def near(lat, lon, radius_km, query=None, projection=None, limit=100):
+    pipeline = [
+        {"$geoNear": {
+            "near": point(lat, lon),
+            "key": "position",
+            "distanceField": "distance_m",
+            "maxDistance": radius_km * 1000,
+            "spherical": True,
+            "query": query or {},
+        }},
+        {"$limit": limit},
+    ]
+    if projection:
+        pipeline.append({"$project": {**projection, "distance_m": 1}})
+    results = []
+    for doc in products_collection.aggregate(pipeline):
+        doc["distance_km"] = round(doc.pop("distance_m") / 1000, 3)
+        results.append(doc)
+    return results
+
+
+def box(min_lat, min_lon, max_lat, max_lon):
+    # Closed polygon ring, counter-clockwise
+    return {"type": "Polygon", "coordinates": [[
+        [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]
+    ]]}
+
+
+# Products that had a position fix inside the region during [start, end)
+def region_history(region, start, end, limit=1000):
+    return list(location_history_collection.aggregate([
+        {"$match": {"position": {"$geoWithin": {"$geometry": region}}, "ts": {"$gte": start, "$lt": end}}},
+        {"$group": {
+            "_id": "$productId",
+            "first_seen": {"$min": "$ts"},
+            "last_seen": {"$max": "$ts"},
+            "fixes": {"$sum": 1},
+            "locations": {"$addToSet": "$location"},
+        }},
+        {"$sort": {"first_seen": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "productId": "$_id", "first_seen": 1, "last_seen": 1, "fixes": 1, "locations": 1}},
+    ]))
+
+
+def load_places(path):
+    ops = []
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if len(row) < 3 or row[0].startswith("#"):
+                continue
+            name, lat, lon = row[0], float(row[1]), float(row[2])
+            ops.append(UpdateOne({"name": normalize(name)}, {"$set": {"position": point(lat, lon)}}, upsert=True))
+    if ops:
+        places_collection.bulk_write(ops, ordered=False)
+    # Loaded places may have moved
+    with _geocode_lock:
+        _geocode_cache.clear()
+    return len(ops)
+
+
+# Give products created before positions existed a position from their
+# location name, where the gazetteer knows it
+def backfill():
+    updated = 0
+    for product in products_collection.find({"position": {"$exists": False}, "location": {"$nin": [None, ""]}},
+                                            {"productId": 1, "location": 1, "current_owner": 1, "last_updated": 1}):
+        coords = geocode(product["location"])
+        if coords:
+            products_collection.update_one({"_id": product["_id"]}, {"$set": {"position": point(*coords)}})
+            record_fix(product["productId"], *coords, location=product["location"],
+                       owner=product.get("current_owner"), ts=product.get("last_updated"))
+            updated += 1
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geospatial maintenance")
+    parser.add_argument("--load-places", metavar="CSV", help="Load a name,lat,lon gazetteer")
+    parser.add_argument("--backfill", action="store_true", help="Geocode existing product locations")
+    args = parser.parse_args()
+
+    if args.load_places or args.backfill:
+        ensure_indexes()
+    if args.load_places:
+        print(f"Loaded {load_places(args.load_places)} places")
+    if args.backfill:
+        print(f"Positioned {backfill()} products")
+    if not args.load_places and not args.backfill:
+        parser.print_help()
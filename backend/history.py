@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Bucketed product history.
+
+Lifecycle events are stored in per-product bucket documents holding at most
+BUCKET_SIZE events instead of one document per event. Usage:
+    python history.py --migrate [--drop-legacy]
+"""
+import argparse
+import time
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import InvalidOperation
+
+from db import (
+    DB_NAME, get_client, changes_collection, history_collection, products_collection, transactions_collection, db
+)
+
+BUCKET_SIZE = 100
+
+PRODUCTS_NS = f"{DB_NAME}.products"
+HISTORY_NS = f"{DB_NAME}.history_buckets"
+CHANGES_NS = f"{DB_NAME}.changes"
+
+# Whether the legacy transactions collection has been migrated; re-checked
+# at most every MIGRATION_CHECK_SECONDS until it has
+MIGRATION_CHECK_SECONDS = 60
+_migrated = False
+_migration_checked_at = 0.0
+
+# Whether the server and driver support client-level bulk writes; probed
+# once per process
+_client_bulk_write = None
+
+
+def ensure_indexes():
+    history_collection.create_index([("productId", 1), ("count", 1)])
+    history_collection.create_index([("productId", 1), ("first_ts", 1)])
+    supports_client_bulk_write()
+
+
+# Client bulk write needs MongoDB 8.0 and a driver that has it
+def supports_client_bulk_write():
+    global _client_bulk_write
+    if _client_bulk_write is None:
+        client = get_client()
+        _client_bulk_write = (hasattr(client, "bulk_write")
+                              and tuple(client.server_info()["versionArray"][:2]) >= (8, 0))
+    return _client_bulk_write
+
+
+def _bucket_update(event):
+    return {
+        "$push": {"events": event},
+        "$inc": {"count": 1},
+        "$min": {"first_ts": event["timestamp"]},
+        "$max": {"last_ts": event["timestamp"]},
+    }
+
+
+# Run namespaced ops as one ordered client-level bulk write. Returns False
+# when that is not supported and the caller has to write separately.
+def client_bulk_write(ops):
+    global _client_bulk_write
+    if not supports_client_bulk_write():
+        return False
+    try:
+        get_client().bulk_write(ops, ordered=True)
+        return True
+    except InvalidOperation:
+        # Rejected by the server, e.g. after a failover to an older
+        # member; use separate writes from now on
+        _client_bulk_write = False
+        return False
+
+
+# Append an event to the product's open bucket and apply the product insert
+# or update, and store the change feed entry, in the same round trip. Uses a
+# client-level bulk write, which needs MongoDB 8.0; older servers fall back
+# to separate writes.
+def record(product_id, event, product_insert=None, product_update=None, change=None):
+    event = {k: v for k, v in event.items() if k != "productId"}
+    bucket_filter = {"productId": product_id, "count": {"$lt": BUCKET_SIZE}}
+
+    ops = []
+    if product_insert is not None:
+        ops.append(InsertOne(product_insert, namespace=PRODUCTS_NS))
+    if product_update is not None:
+        ops.append(UpdateOne({"productId": product_id}, product_update, namespace=PRODUCTS_NS))
+    ops.append(UpdateOne(bucket_filter, _bucket_update(event), upsert=True, namespace=HISTORY_NS))
+    if change is not None:
+        ops.append(InsertOne(change, namespace=CHANGES_NS))
+    if client_bulk_write(ops):
+        return
+
+    if product_insert is not None:
+        products_collection.insert_one(product_insert)
+    if product_update is not None:
+        products_collection.update_one({"productId": product_id}, product_update)
+    history_collection.update_one(bucket_filter, _bucket_update(event), upsert=True)
+    if change is not None:
+        changes_collection.insert_one(change)
+
+
+def legacy_migrated():
+    global _migrated, _migration_checked_at
+    if not _migrated and time.monotonic() - _migration_checked_at > MIGRATION_CHECK_SECONDS:
+        _migrated = db["migrations"].find_one({"_id": "history_buckets", "done": True}) is not None
+        _migration_checked_at = time.monotonic()
+    return _migrated
+
+
+# Events of a product in the shape of the old transaction documents
+def read_history(product_id):
+    history = []
+    copied = False
+    for bucket in history_collection.find({"productId": product_id}).sort("first_ts", 1):
+        copied = copied or bucket.get("legacy", False)
+        for index, event in enumerate(bucket.get("events", [])):
+            history.append({"_id": f"{bucket['_id']}:{index}", "productId": product_id, **event})
+
+    # Until the migration has run, older events still live in the legacy
+    # one-document-per-event collection. Products the migration has already
+    # copied into buckets are skipped so a partial run does not double them.
+    if not legacy_migrated() and not copied:
+        for txn in transactions_collection.find({"productId": product_id}):
+            txn["_id"] = str(txn["_id"])
+            history.append(txn)
+
+    history.sort(key=lambda e: e["timestamp"])
+    return history
+
+
+# Number of on-chain history records behind each product's events, for a
+# list of products, in one query. An update sent as several contract calls
+# (contracts without updateProduct) is one event but one record per call.
+def _chain_records(tx_hashes_field):
+    return {"$max": [1, {"$size": {"$ifNull": [tx_hashes_field, []]}}]}
+
+
+def history_counts(product_ids):
+    counts = {pid: 0 for pid in product_ids}
+    copied = set()
+    for row in history_collection.aggregate([
+        {"$match": {"productId": {"$in": product_ids}}},
+        {"$unwind": "$events"},
+        {"$group": {
+            "_id": "$productId",
+            "count": {"$sum": _chain_records("$events.tx_hashes")},
+            "legacy": {"$max": {"$ifNull": ["$legacy", False]}},
+        }},
+    ]):
+        counts[row["_id"]] += row["count"]
+        if row["legacy"]:
+            copied.add(row["_id"])
+
+    if not legacy_migrated():
+        remaining = [pid for pid in product_ids if pid not in copied]
+        for row in transactions_collection.aggregate([
+            {"$match": {"productId": {"$in": remaining}}},
+            {"$group": {"_id": "$productId", "count": {"$sum": _chain_records("$tx_hashes")}}},
+        ]):
+            counts[row["_id"]] += row["count"]
+    return counts
+
+
+# Whether username created any of the products
+def created_any(product_ids, username):
+    created = {"action": "created", "from_user": username}
+    if history_collection.find_one({"productId": {"$in": product_ids}, "events": {"$elemMatch": created}}, {"_id": 1}):
+        return True
+    if legacy_migrated():
+        return False
+    return transactions_collection.find_one({"productId": {"$in": product_ids}, **created}, {"_id": 1}) is not None
+
+
+# Iterate over all events of all products
+def iter_events():
+    copied = set()
+    for bucket in history_collection.find({}, {"productId": 1, "events": 1, "legacy": 1}):
+        if bucket.get("legacy"):
+            copied.add(bucket["productId"])
+        for event in bucket.get("events", []):
+            yield {"productId": bucket["productId"], **event}
+
+    if not legacy_migrated():
+        for txn in transactions_collection.find({}):
+            if txn["productId"] not in copied:
+                yield txn
+
+
+# Copy the one-document-per-event collection into full buckets. Products
+# that were already migrated are skipped, so the migration can be re-run.
+def migrate(drop_legacy=False, batch_size=1000):
+    pending = []
+    migrated_products = 0
+
+    def flush_product(product_id, events):
+        nonlocal migrated_products
+        if history_collection.find_one({"productId": product_id, "legacy": True}, {"_id": 1}):
+            return
+        for i in range(0, len(events), BUCKET_SIZE):
+            chunk = events[i:i + BUCKET_SIZE]
+            pending.append({
+                "productId": product_id,
+                "legacy": True,
+                "count": len(chunk),
+                "first_ts": chunk[0]["timestamp"],
+                "last_ts": chunk[-1]["timestamp"],
+                "events": chunk,
+            })
+        migrated_products += 1
+        if len(pending) >= batch_size:
+            history_collection.insert_many(pending, ordered=False)
+            pending.clear()
+
+    current_id = None
+    events = []
+    cursor = transactions_collection.find({}, {"_id": 0}).sort([("productId", 1), ("timestamp", 1)])
+    for txn in cursor:
+        product_id = txn.pop("productId")
+        if product_id != current_id:
+            if current_id is not None:
+                flush_product(current_id, events)
+            current_id, events = product_id, []
+        events.append(txn)
+    if current_id is not None:
+        flush_product(current_id, events)
+
+    if pending:
+        history_collection.insert_many(pending, ordered=False)
+
+    db["migrations"].update_one({"_id": "history_buckets"}, {"$set": {"done": True}}, upsert=True)
+    if drop_legacy:
+        transactions_collection.drop()
+    return migrated_products
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bucketed history maintenance")
+    parser.add_argument("--migrate", action="store_true", help="Move legacy transactions into buckets")
+    parser.add_argument("--drop-legacy", action="store_true", help="Drop the legacy collection afterwards")
+    args = parser.parse_args()
+
+    if args.migrate:
+        ensure_indexes()
+        print(f"Migrated history of {migrate(drop_legacy=args.drop_legacy)} products")
+    else:
+        parser.print_help()
@@ -0,0 +1,154 @@
+"""Snowflake-style product ID allocation.
+
+An ID is a 63-bit integer laid out as
+
+    41 bits  milliseconds since EPOCH_MS (good until 2093)
+    10 bits  node id, unique per worker process
+    12 bits  sequence within the millisecond
+
+and is written as "PROD-" plus 16 upper-case hex digits. The fixed width
+makes string order equal numeric order, so IDs sort by creation time and
+the productId index can serve time range and keyset scans directly.
+
+Node ids come from NODE_ID in .env, offset by the worker slot handed out by
+the coordinator in multi-worker mode. Hosts sharing a database must use
+NODE_ID ranges that do not overlap.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+from dotenv import dotenv_values
+
+config = dotenv_values("../.env")
+NODE_ID = int(config.get("NODE_ID", "0"))
+
+PREFIX = "PROD-"
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = NODE_BITS + SEQUENCE_BITS
+
+
+class IdAllocator:
+    """Thread-safe, strictly increasing ID source for one node.
+
+    If the clock goes backwards, or the 4096 sequence numbers of a
+    millisecond run out, the allocator keeps counting on from the last
+    millisecond it used instead of waiting, so IDs never repeat or go
+    backwards within a process.
+    """
+
+    def __init__(self, node_id=0):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"node_id must be between 0 and {MAX_NODE_ID}")
+        self.node_id = node_id
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.sequence = 0
+
+    def _now_ms(self):
+        return time.time_ns() // 1000000 - EPOCH_MS
+
+    def _reserve(self, count):
+        # Returns (ms, first sequence, count) for up to count consecutive IDs
+        now = self._now_ms()
+        if now > self.last_ms:
+            self.last_ms = now
+            self.sequence = 0
+        elif self.sequence > SEQUENCE_MASK:
+            self.last_ms += 1
+            self.sequence = 0
+        first = self.sequence
+        count = min(count, SEQUENCE_MASK + 1 - first)
+        self.sequence += count
+        return self.last_ms, first, count
+
+    def next_int(self):
+        with self.lock:
+            ms, sequence, _ = self._reserve(1)
+        return (ms << TIMESTAMP_SHIFT) | (self.node_id << SEQUENCE_BITS) | sequence
+
+    # Reserve n IDs at once, e.g. for batch endpoints. IDs within one
+    # millisecond are consecutive integers, so this is a few ranges.
+    def allocate_ints(self, n):
+        result = []
+        with self.lock:
+            while n > 0:
+                ms, first, count = self._reserve(n)
+                base = (ms << TIMESTAMP_SHIFT) | (self.node_id << SEQUENCE_BITS)
+                result.extend(range(base + first, base + first + count))
+                n -= count
+        return result
+
+    def next_id(self):
+        return format_id(self.next_int())
+
+    def allocate(self, n):
+        return [PREFIX + format(value, "016X") for value in self.allocate_ints(n)]
+
+
+def format_id(value):
+    return PREFIX + format(value, "016X")
+
+
+def parse_id(product_id):
+    if not product_id.startswith(PREFIX) or len(product_id) != len(PREFIX) + 16:
+        raise ValueError(f"Not an allocated product id: {product_id}")
+    return int(product_id[len(PREFIX):], 16)
+
+
+def timestamp_of(product_id):
+    ms = (parse_id(product_id) >> TIMESTAMP_SHIFT) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+# Smallest ID that can be allocated at or after moment, for range scans
+# such as {"productId": {"$gte": lower_bound(start), "$lt": lower_bound(end)}}
+def lower_bound(moment):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    ms = max(0, int(moment.timestamp() * 1000) - EPOCH_MS)
+    return format_id(ms << TIMESTAMP_SHIFT)
+
+
+_allocator = None
+# Set in multi-worker mode, where the static NODE_ID is shared by every
+# worker and must not be used without a worker slot
+_lease_required = False
+
+
+class NodeIdUnavailable(Exception):
+    pass
+
+
+def require_lease():
+    global _lease_required
+    _lease_required = True
+
+
+# Pick the node id for this process; worker_slot comes from the
+# coordinator's registry in multi-worker mode
+def configure(worker_slot=0):
+    global _allocator
+    _allocator = IdAllocator(NODE_ID + worker_slot)
+    return _allocator
+
+
+def get_allocator():
+    if _allocator is None:
+        if _lease_required:
+            raise NodeIdUnavailable("No unique node id has been leased for this worker")
+        configure()
+    return _allocator
+
+
+def new_id():
+    return get_allocator().next_id()
+
+
+def allocate(n):
+    return get_allocator().allocate(n)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Unit-level quantity ledger.
+
+A product's quantity can be spread over several holders. Every movement of
+units is appended to the ledger collection as {productId, kind, from, to,
+amount}, where from is None for units created and to is None for units
+removed, and the resulting per-(product, holder) balances are kept in the
+balances collection, so who holds how much is a single indexed lookup.
+
+Products created before the ledger are seeded on their first movement:
+the owner is credited with the product's quantity. The contract does the
+same (see SupplyChain._seedBalances). The checker replays the ledger and
+compares the result with the stored balances and product quantities.
+Usage:
+    python ledger.py --check [--product PROD-...] [--repair] [--chain]
+    python ledger.py --seed
+"""
+import argparse
+from datetime import datetime
+
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from db import DB_NAME, balances_collection, ledger_collection, products_collection
+import bloom
+import changes
+import history
+import lineage
+import rollups
+
+LEDGER_NS = f"{DB_NAME}.ledger"
+BALANCES_NS = f"{DB_NAME}.balances"
+
+
+class InsufficientUnits(Exception):
+    pass
+
+
+def ensure_indexes():
+    balances_collection.create_index([("productId", 1), ("holder", 1)], unique=True)
+    balances_collection.create_index([("holder", 1), ("quantity", 1)])
+    ledger_collection.create_index([("productId", 1), ("ts", 1)])
+
+
+def entry(product_id, kind, from_holder, to_holder, amount, ts=None, ref=None, tx_hash=None):
+    return {
+        "productId": product_id,
+        "kind": kind,  # mint, seed, adjust, transfer, split or merge
+        "from": from_holder,
+        "to": to_holder,
+        "amount": amount,
+        "ts": ts or datetime.utcnow(),
+        "ref": ref,  # product the units came from or went to
+        "tx_hash": tx_hash,
+    }
+
+
+# Products without a quantity hold a single unit
+def _quantity(product):
+    quantity = product.get("quantity")
+    return 1 if quantity is None else quantity
+
+
+def _balance_update(product_id, holder, delta, ts):
+    return {"productId": product_id, "holder": holder}, {"$inc": {"quantity": delta}, "$max": {"updated": ts}}
+
+
+# Append entries to the ledger and apply them to the balances in one round
+# trip. debited means the from side was already taken with reserve or
+# take_all.
+def post(entries, debited=False):
+    if not entries:
+        return
+    updates = []
+    for e in entries:
+        if e["to"] is not None:
+            updates.append(_balance_update(e["productId"], e["to"], e["amount"], e["ts"]))
+        if e["from"] is not None and not debited:
+            updates.append(_balance_update(e["productId"], e["from"], -e["amount"], e["ts"]))
+
+    ops = [InsertOne(e, namespace=LEDGER_NS) for e in entries]
+    ops += [UpdateOne(f, u, upsert=True, namespace=BALANCES_NS) for f, u in updates]
+    if history.client_bulk_write(ops):
+        return
+
+    ledger_collection.insert_many(entries)
+    balances_collection.bulk_write([UpdateOne(f, u, upsert=True) for f, u in updates], ordered=True)
+
+
+# Take amount units from a holder if they have that many. Returns whether
+# the units were taken.
+def reserve(product_id, holder, amount):
+    result = balances_collection.update_one(
+        {"productId": product_id, "holder": holder, "quantity": {"$gte": amount}},
+        {"$inc": {"quantity": -amount}}
+    )
+    return result.modified_count == 1
+
+
+# Give back units taken by reserve or take_all when the write failed
+def refund(product_id, holder, amount):
+    if amount:
+        balances_collection.update_one({"productId": product_id, "holder": holder}, {"$inc": {"quantity": amount}})
+
+
+# Take every unit a holder has. Returns how many were taken.
+def take_all(product_id, holder):
+    before = balances_collection.find_one_and_update(
+        {"productId": product_id, "holder": holder, "quantity": {"$gt": 0}},
+        {"$set": {"quantity": 0}},
+        return_document=ReturnDocument.BEFORE
+    )
+    return before["quantity"] if before else 0
+
+
+def balance(product_id, holder):
+    doc = balances_collection.find_one({"productId": product_id, "holder": holder}, {"quantity": 1})
+    return doc["quantity"] if doc else 0
+
+
+# Holders of a product with their units, largest first
+def holders(product_id):
+    return list(balances_collection.find(
+        {"productId": product_id, "quantity": {"$gt": 0}}, {"_id": 0, "holder": 1, "quantity": 1}
+    ).sort("quantity", -1))
+
+
+# Products a holder has units of
+def holdings(holder, limit=1000):
+    return list(balances_collection.find(
+        {"holder": holder, "quantity": {"$gt": 0}}, {"_id": 0, "productId": 1, "quantity": 1}
+    ).limit(limit))
+
+
+# Credit the owner of a product created before the ledger with its
+# quantity. product needs productId, current_owner, quantity and ledger.
+def ensure_seeded(product, ts=None):
+    if product.get("ledger"):
+        return
+    seed = entry(product["productId"], "seed", None, product["current_owner"], _quantity(product), ts)
+    seed["_id"] = f"seed:{product['productId']}"
+    try:
+        ledger_collection.insert_one(seed)
+    except DuplicateKeyError:
+        # Seeded by a concurrent write
+        pass
+    else:
+        f, u = _balance_update(seed["productId"], seed["to"], seed["amount"], seed["ts"])
+        balances_collection.update_one(f, u, upsert=True)
+    products_collection.update_one({"productId": product["productId"]}, {"$set": {"ledger": True}})
+    product["ledger"] = True
+
+
+# Fails unless quantity covers the units of the product held by others
+def check_quantity(product, quantity):
+    if not product.get("ledger"):
+        return
+    owned = balance(product["productId"], product["current_owner"])
+    held_by_others = _quantity(product) - owned
+    if quantity < held_by_others:
+        raise InsufficientUnits(f"{held_by_others} units are held by others")
+
+
+# Ledger side of a whole-product update: quantity changes go to the owner,
+# then an ownership transfer moves everything the old owner held. fields
+# are the product fields being set.
+def record_update(product, fields, ts=None, tx_hash=None):
+    if not product.get("ledger"):
+        # Seeded from the updated product on its first partial movement
+        return
+    product_id = product["productId"]
+    owner = product["current_owner"]
+
+    quantity = fields.get("quantity")
+    if quantity is not None and quantity != _quantity(product):
+        delta = quantity - _quantity(product)
+        if delta > 0:
+            post([entry(product_id, "adjust", None, owner, delta, ts, tx_hash=tx_hash)])
+        else:
+            post([entry(product_id, "adjust", owner, None, -delta, ts, tx_hash=tx_hash)])
+
+    new_owner = fields.get("current_owner")
+    if new_owner and new_owner != owner:
+        moved = take_all(product_id, owner)
+        if moved:
+            post([entry(product_id, "transfer", owner, new_owner, moved, ts, tx_hash=tx_hash)], debited=True)
+
+
+# Read model for a partial transfer. The sender's units must already have
+# been taken with reserve unless debited is False.
+def record_transfer(product, from_holder, to_holder, amount, note="", ts=None, tx_hash=None, debited=True):
+    ts = ts or datetime.utcnow()
+    product_id = product["productId"]
+    post([entry(product_id, "transfer", from_holder, to_holder, amount, ts, tx_hash=tx_hash)], debited=debited)
+
+    event = {
+        "productId": product_id,
+        "from_user": from_holder,
+        "to_user": to_holder,
+        "timestamp": ts,
+        "action": "quantity_transferred",
+        "note": note or f"{amount} units transferred",
+        "quantity": amount,
+        "tx_hashes": [tx_hash] if tx_hash else [],
+    }
+    fields = {"last_updated": ts}
+    change = changes.build("product.quantity_transferred", product_id, fields, event)
+    history.record(product_id, event, product_update={"$set": fields}, change=change)
+    lineage.record_handler(product_id, to_holder)
+
+
+def _child_product(parent, child_id, holder, quantity, status, ts):
+    return {
+        "productId": child_id,
+        "name": parent["name"],
+        "description": parent.get("description", ""),
+        "category": parent.get("category", ""),
+        "quantity": quantity,
+        "location": parent.get("location", ""),
+        "date_created": ts.strftime("%Y-%m-%d"),
+        "image_url": parent.get("image_url", ""),
+        "current_owner": holder,
+        "status": status,
+        "last_updated": ts,
+        "batch_id": parent.get("batch_id", ""),
+        "auth_digest": bloom.authenticity_digest(child_id, parent["name"], holder, status),
+        "ledger": True,
+        **({"position": parent["position"]} if parent.get("position") else {}),
+    }
+
+
+# Read model for a split or merge: units taken from each parent (already
+# debited unless debited is False) become a new product owned by holder.
+# parts is a list of (parent product, amount). status is the child's status
+# as written to the contract, so both authenticity digests agree.
+def record_derivation(kind, parts, child_id, holder, status, note="", ts=None, tx_hash=None, debited=True):
+    ts = ts or datetime.utcnow()
+    tx_hashes = [tx_hash] if tx_hash else []
+    total = sum(amount for _, amount in parts)
+
+    entries = [entry(parent["productId"], kind, holder, None, amount, ts, ref=child_id, tx_hash=tx_hash)
+               for parent, amount in parts]
+    entries.append(entry(child_id, kind, None, holder, total, ts,
+                         ref=parts[0][0]["productId"] if len(parts) == 1 else None, tx_hash=tx_hash))
+    post(entries, debited=debited)
+
+    for parent, amount in parts:
+        parent_id = parent["productId"]
+        event = {
+            "productId": parent_id,
+            "from_user": holder,
+            "to_user": holder,
+            "timestamp": ts,
+            "action": kind,
+            "note": f"{amount} units to {child_id}" + (f": {note}" if note else ""),
+            "quantity": amount,
+            "tx_hashes": tx_hashes,
+        }
+        update = {"$inc": {"quantity": -amount}, "$set": {"last_updated": ts}}
+        change = changes.build(f"product.{kind}", parent_id, {"quantity": _quantity(parent) - amount,
+                                                              "last_updated": ts}, event)
+        history.record(parent_id, event, product_update=update, change=change)
+
+    child = _child_product(parts[0][0], child_id, holder, total, status, ts)
+    event = {
+        "productId": child_id,
+        "from_user": holder,
+        "to_user": holder,
+        "timestamp": ts,
+        "action": "created",
+        "note": note or f"{'Split from' if kind == 'split' else 'Merged from'} "
+                        f"{', '.join(parent['productId'] for parent, _ in parts)}",
+        "tx_hashes": tx_hashes,
+    }
+    history.record(child_id, event, product_insert=child,
+                   change=changes.build("product.created", child_id, child, event))
+    rollups.record(event, new_status=child["status"])
+    lineage.record_batch_member(child["batch_id"], child_id)
+    lineage.record_handler(child_id, holder)
+    lineage.record_derivation([parent["productId"] for parent, _ in parts], child_id)
+    return child
+
+
+# Replay the ledger and compare it with the balances and with the product
+# quantities. With repair, balances are rewritten from the ledger. With
+# chain, balances are also compared with the contract's.
+def check(product_id=None, repair=False, chain=None):
+    match = {"productId": product_id} if product_id else {}
+    expected = {}
+    for row in ledger_collection.aggregate([
+        {"$match": match},
+        {"$project": {"productId": 1, "legs": [
+            {"holder": "$from", "delta": {"$multiply": ["$amount", -1]}},
+            {"holder": "$to", "delta": "$amount"},
+        ]}},
+        {"$unwind": "$legs"},
+        {"$match": {"legs.holder": {"$ne": None}}},
+        {"$group": {"_id": {"productId": "$productId", "holder": "$legs.holder"}, "quantity": {"$sum": "$legs.delta"}}},
+    ], allowDiskUse=True):
+        expected[(row["_id"]["productId"], row["_id"]["holder"])] = row["quantity"]
+
+    actual = {(b["productId"], b["holder"]): b["quantity"]
+              for b in balances_collection.find(match, {"_id": 0, "productId": 1, "holder": 1, "quantity": 1})}
+
+    report = {"balances": len(expected), "mismatched": [], "negative": [], "totals": [], "chain": []}
+    for key in expected.keys() | actual.keys():
+        want, have = expected.get(key, 0), actual.get(key, 0)
+        if want < 0:
+            report["negative"].append({"productId": key[0], "holder": key[1], "ledger": want})
+        if want != have:
+            report["mismatched"].append({"productId": key[0], "holder": key[1], "ledger": want, "balance": have})
+
+    totals = {}
+    for (pid, _), quantity in expected.items():
+        totals[pid] = totals.get(pid, 0) + quantity
+    for product in products_collection.find({**match, "ledger": True}, {"_id": 0, "productId": 1, "quantity": 1}):
+        total = totals.get(product["productId"], 0)
+        if total != _quantity(product):
+            report["totals"].append({"productId": product["productId"], "ledger": total,
+                                     "quantity": product.get("quantity")})
+
+    if chain is not None and chain.supports("getBalance"):
+        for (pid, holder), want in expected.items():
+            on_chain = chain.call("getBalance", pid, holder)
+            if on_chain != want:
+                report["chain"].append({"productId": pid, "holder": holder, "ledger": want, "chain": on_chain})
+
+    if repair and report["mismatched"]:
+        balances_collection.bulk_write([
+            UpdateOne({"productId": m["productId"], "holder": m["holder"]},
+                      {"$set": {"quantity": m["ledger"], "updated": datetime.utcnow()}}, upsert=True)
+            for m in report["mismatched"]
+        ], ordered=False)
+    return report
+
+
+# Seed every product created before the ledger
+def seed_all():
+    seeded = 0
+    for product in products_collection.find(
+        {"ledger": {"$ne": True}}, {"_id": 0, "productId": 1, "current_owner": 1, "quantity": 1}
+    ):
+        ensure_seeded(product)
+        seeded += 1
+    return seeded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantity ledger")
+    parser.add_argument("--check", action="store_true", help="Replay the ledger and compare with the balances")
+    parser.add_argument("--product", help="Only check this product")
+    parser.add_argument("--repair", action="store_true", help="Rewrite mismatched balances from the ledger")
+    parser.add_argument("--chain", action="store_true", help="Also compare balances with the contract")
+    parser.add_argument("--seed", action="store_true", help="Seed balances of products created before the ledger")
+    args = parser.parse_args()
+
+    if args.check:
+        chain = None
+        if args.chain:
+            import blockchain
+            chain = blockchain.get_chain()
+        report = check(args.product, repair=args.repair, chain=chain)
+        for name in ("mismatched", "negative", "totals", "chain"):
+            for problem in report[name]:
+                print(f"{name}: {problem}")
+        problems = sum(len(report[name]) for name in ("mismatched", "negative", "totals", "chain"))
+        print(f"Checked {report['balances']} balances, {problems} problems"
+              + (", balances repaired" if args.repair and report["mismatched"] else ""))
+        raise SystemExit(1 if problems else 0)
+    elif args.seed:
+        print(f"Seeded {seed_all()} products")
+    else:
+        parser.print_help()
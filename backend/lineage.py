@@ -0,0 +1,201 @@
+import json
+from datetime import datetime
+
+from db import archive_collection, lineage_collection, products_collection, users_collection
+import history
+
+# Edges are stored as {src, dst, kind}. Nodes are namespaced strings so that
+# batches, products and users can live in the same collection:
+#   batch:<batch_id> --contains--> product:<productId>
+#   product:<parent> --split/merge--> product:<child>
+#   product:<productId> --handled--> user:<username>
+# Size of each $in query issued while walking the graph
+FRONTIER_CHUNK = 1000
+
+
+def batch_node(batch_id):
+    return f"batch:{batch_id}"
+
+
+def product_node(product_id):
+    return f"product:{product_id}"
+
+
+def user_node(username):
+    return f"user:{username}"
+
+
+def _node_id(node):
+    return node.split(":", 1)[1]
+
+
+# Record that a product belongs to a batch
+def record_batch_member(batch_id, product_id):
+    if not batch_id:
+        return
+    _upsert_edge(batch_node(batch_id), product_node(product_id), "contains")
+
+
+# Record that a user has handled (created, held or received) a product
+def record_handler(product_id, username):
+    if not username:
+        return
+    _upsert_edge(product_node(product_id), user_node(username), "handled")
+
+
+# Record products derived from other products: one parent is a split,
+# several parents are a merge
+def record_derivation(parent_ids, child_id):
+    kind = "split" if len(parent_ids) == 1 else "merge"
+    for parent_id in parent_ids:
+        _upsert_edge(product_node(parent_id), product_node(child_id), kind)
+
+
+def _upsert_edge(src, dst, kind):
+    lineage_collection.update_one(
+        {"src": src, "dst": dst, "kind": kind},
+        {"$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# Products created in a batch. Seeded from the lineage graph and from the
+# batch_id field so batches created before edges were recorded are still found
+def batch_members(batch_id):
+    members = [_node_id(e["dst"]) for e in lineage_collection.find(
+        {"src": batch_node(batch_id), "kind": "contains"}, {"dst": 1, "_id": 0}
+    )]
+    members += [p["productId"] for p in products_collection.find(
+        {"batch_id": batch_id}, {"productId": 1, "_id": 0}
+    )]
+    members += [p["productId"] for p in archive_collection.find(
+        {"batch_id": batch_id}, {"productId": 1, "_id": 0}
+    )]
+    return list(dict.fromkeys(members))
+
+
+# Whether username produced the batch, i.e. created one of its products
+def produced_batch(batch_id, username):
+    return any(history.created_any(chunk, username) for chunk in _chunks(batch_members(batch_id), FRONTIER_CHUNK))
+
+
+# Breadth-first walk over derivation edges starting at a batch. Yields lists
+# of product ids level by level so callers can stream results as they go.
+def affected_products(batch_id):
+    seen = set()
+    frontier = batch_members(batch_id)
+    while frontier:
+        seen.update(frontier)
+        yield frontier
+
+        next_frontier = []
+        for chunk in _chunks(frontier, FRONTIER_CHUNK):
+            for edge in lineage_collection.find(
+                {"src": {"$in": [product_node(pid) for pid in chunk]}, "kind": {"$in": ["split", "merge"]}},
+                {"dst": 1, "_id": 0}
+            ):
+                child = _node_id(edge["dst"])
+                if child not in seen:
+                    seen.add(child)
+                    next_frontier.append(child)
+        frontier = next_frontier
+
+
+# Stream the recall impact of a batch as newline-delimited JSON: one line per
+# affected product followed by a summary line
+def stream_recall(batch_id):
+    role_cache = {}
+    holders = set()
+    retailers = set()
+    total = 0
+
+    def roles_for(usernames):
+        missing = [u for u in usernames if u not in role_cache]
+        if missing:
+            for user in users_collection.find({"username": {"$in": missing}}, {"username": 1, "role": 1, "_id": 0}):
+                role_cache[user["username"]] = (user.get("role") or "").lower()
+            for username in missing:
+                role_cache.setdefault(username, "")
+        return role_cache
+
+    for level in affected_products(batch_id):
+        for chunk in _chunks(level, FRONTIER_CHUNK):
+            products = {
+                p["productId"]: p for p in products_collection.find(
+                    {"productId": {"$in": chunk}},
+                    {"productId": 1, "name": 1, "current_owner": 1, "status": 1, "location": 1, "_id": 0}
+                )
+            }
+
+            # Archived products keep these fields uncompressed
+            missing = [pid for pid in chunk if pid not in products]
+            if missing:
+                for p in archive_collection.find(
+                    {"_id": {"$in": missing}},
+                    {"productId": 1, "name": 1, "current_owner": 1, "status": 1, "location": 1, "_id": 0}
+                ):
+                    products[p["productId"]] = p
+
+            handlers = {}
+            for edge in lineage_collection.find(
+                {"src": {"$in": [product_node(pid) for pid in chunk]}, "kind": "handled"},
+                {"src": 1, "dst": 1, "_id": 0}
+            ):
+                handlers.setdefault(_node_id(edge["src"]), []).append(_node_id(edge["dst"]))
+
+            usernames = {u for users in handlers.values() for u in users}
+            usernames.update(p.get("current_owner") for p in products.values() if p.get("current_owner"))
+            roles = roles_for(list(usernames))
+
+            for pid in chunk:
+                product = products.get(pid, {"productId": pid})
+                product_handlers = handlers.get(pid, [])
+                owner = product.get("current_owner")
+                if owner:
+                    holders.add(owner)
+                downstream = [u for u in product_handlers + [owner] if u and roles.get(u) == "retailer"]
+                retailers.update(downstream)
+                total += 1
+
+                yield json.dumps({
+                    "type": "product",
+                    "productId": pid,
+                    "name": product.get("name"),
+                    "current_owner": owner,
+                    "status": product.get("status"),
+                    "location": product.get("location"),
+                    "handlers": product_handlers,
+                    "retailers": sorted(set(downstream)),
+                }) + "\n"
+
+    yield json.dumps({
+        "type": "summary",
+        "batch_id": batch_id,
+        "affected_products": total,
+        "current_holders": sorted(holders),
+        "retailers": sorted(retailers),
+    }) + "\n"
+
+
+# Build edges for data written before lineage tracking existed
+def backfill():
+    count = 0
+    for product in products_collection.find({}, {"productId": 1, "batch_id": 1, "current_owner": 1, "_id": 0}):
+        record_batch_member(product.get("batch_id"), product["productId"])
+        record_handler(product["productId"], product.get("current_owner"))
+        count += 1
+
+    for txn in history.iter_events():
+        record_handler(txn["productId"], txn.get("from_user"))
+        record_handler(txn["productId"], txn.get("to_user"))
+
+    return count
+
+
+if __name__ == "__main__":
+    print(f"Backfilled lineage for {backfill()} products")
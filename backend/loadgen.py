@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""Scenario-driven load generator for the full product lifecycle.
+
+Two subcommands:
+
+    build  Writes a synthetic dataset straight into MongoDB (users, products,
+           bucketed multi-hop histories) and optionally replays part of it
+           onto the SupplyChain contract so chain and database agree.
+    run    Drives the API with the real role mix at open-loop Poisson arrival
+           rates: producers create products, distributors and retailers move
+           them along, consumers trace them and regulators list. Latency is
+           measured from each request's scheduled start, so a slow server
+           cannot hide queueing delay. Write confirmation lag is measured by
+           polling the node for the receipts of returned transaction hashes.
+
+Usage:
+    python loadgen.py build [--users 10000] [--products 1000000] [--chain-products 1000]
+    python loadgen.py run [--url http://127.0.0.1:8000] [--seconds 300]
+                          [--rate producer=5,distributor=10,retailer=10,consumer=50,regulator=1]
+                          [--report loadgen-report.json]
+
+Synthetic users share the password given by --password and are named
+lg-<role>-<n>, so a dataset can be found and removed with one prefix query.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import httpx
+from passlib.context import CryptContext
+
+import bloom
+import ids
+from db import history_collection, products_collection, users_collection
+
+ROLES = ["producer", "distributor", "retailer", "consumer", "regulator"]
+
+# Share of synthetic users per role
+ROLE_MIX = {"producer": 0.05, "distributor": 0.10, "retailer": 0.15, "consumer": 0.69, "regulator": 0.01}
+
+DEFAULT_RATES = "producer=5,distributor=10,retailer=10,consumer=50,regulator=1"
+USER_PREFIX = "lg-"
+LOCATIONS = ["Pune", "Mumbai", "Delhi", "Chennai", "Kolkata", "Bengaluru", "Hyderabad", "Ahmedabad"]
+CATEGORIES = ["Produce", "Dairy", "Grain", "Spices", "Textiles", "Pharma"]
+
+
+def username(role, index):
+    return f"{USER_PREFIX}{role}-{index:07d}"
+
+
+def parse_rates(text):
+    rates = {}
+    for part in text.split(","):
+        role, rate = part.split("=")
+        if role not in ROLES:
+            raise ValueError(f"Unknown role: {role}")
+        rates[role] = float(rate)
+    return rates
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# ---------------------------------------------------------------------------
+# Dataset builder
+# ---------------------------------------------------------------------------
+
+def build_users(total, password, batch_size=10000):
+    # One bcrypt hash for everyone; hashing millions of passwords would take days
+    password_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(password)
+    counts = {role: max(1, int(total * share)) for role, share in ROLE_MIX.items()}
+
+    batch = []
+    for role, count in counts.items():
+        for i in range(count):
+            batch.append({
+                "username": username(role, i),
+                "password_hash": password_hash,
+                "role": role,
+                "email": f"{username(role, i)}@loadgen.invalid",
+                "phone": "",
+                "registered_at": datetime.utcnow(),
+            })
+            if len(batch) >= batch_size:
+                users_collection.insert_many(batch, ordered=False)
+                batch = []
+    if batch:
+        users_collection.insert_many(batch, ordered=False)
+    return counts
+
+
+# A product's path through the chain: created by a producer, shipped by a
+# distributor with a few location updates, then delivered and maybe sold
+def make_lifecycle(product_id, counts, rng, now):
+    producer = username("producer", rng.randrange(counts["producer"]))
+    distributor = username("distributor", rng.randrange(counts["distributor"]))
+    retailer = username("retailer", rng.randrange(counts["retailer"]))
+    ts = now - timedelta(days=rng.uniform(0, 90))
+    steps = rng.choice([1, 2, 3, 3, 4])
+    name = f"{rng.choice(CATEGORIES)} lot {product_id[-6:]}"
+
+    events = [{"from_user": producer, "to_user": producer, "timestamp": ts,
+               "action": "created", "note": "Product created and registered"}]
+    owner, status, location = producer, "Produced", rng.choice(LOCATIONS)
+    chain_ops = [("addProduct", (product_id, name, producer))]
+
+    if steps >= 2:
+        ts += timedelta(hours=rng.uniform(1, 48))
+        events.append({"from_user": owner, "to_user": distributor, "timestamp": ts,
+                       "action": "transferred", "note": "Picked up"})
+        owner, status = distributor, "In Transit"
+        chain_ops.append(("transferProduct", (product_id, distributor, status)))
+        for _ in range(rng.randrange(3)):
+            ts += timedelta(hours=rng.uniform(1, 24))
+            location = rng.choice(LOCATIONS)
+            events.append({"from_user": owner, "to_user": owner, "timestamp": ts,
+                           "action": "updated", "note": f"Arrived at {location}"})
+    if steps >= 3:
+        ts += timedelta(hours=rng.uniform(1, 48))
+        events.append({"from_user": owner, "to_user": retailer, "timestamp": ts,
+                       "action": "transferred", "note": "Delivered to store"})
+        owner, status = retailer, "Delivered"
+        chain_ops.append(("transferProduct", (product_id, retailer, status)))
+    if steps >= 4:
+        ts += timedelta(hours=rng.uniform(1, 240))
+        events.append({"from_user": owner, "to_user": owner, "timestamp": ts,
+                       "action": "updated", "note": "Sold"})
+        status = "Sold"
+        chain_ops.append(("updateProductStatus", (product_id, status)))
+
+    product = {
+        "productId": product_id,
+        "name": name,
+        "description": "Synthetic load test product",
+        "category": name.split()[0],
+        "quantity": rng.randrange(1, 500),
+        "location": location,
+        "date_created": events[0]["timestamp"].strftime("%Y-%m-%d"),
+        "image_url": "",
+        "current_owner": owner,
+        "status": status,
+        "last_updated": ts,
+        "batch_id": f"LG-BATCH-{product_id[-8:-3]}",
+        "auth_digest": bloom.authenticity_digest(product_id, name, owner, status),
+    }
+    bucket = {
+        "productId": product_id,
+        "count": len(events),
+        "first_ts": events[0]["timestamp"],
+        "last_ts": events[-1]["timestamp"],
+        "events": events,
+    }
+    return product, bucket, chain_ops
+
+
+# Operations of one product run in order, different products in parallel
+def replay_on_chain(lifecycles, workers=8):
+    import blockchain
+
+    chain = blockchain.get_chain()
+    if chain is None:
+        raise RuntimeError("No chain backend available")
+
+    # Signed transactions from several threads need nonces handed out locally,
+    # and the embedded EVM is single-threaded
+    import coordinator
+    nonces = coordinator.NonceAllocator() if chain.private_key else None
+    if chain.name == "embedded":
+        workers = 1
+
+    def replay(ops):
+        for fn, args in ops:
+            if nonces:
+                chain.transact(fn, *args, nonce=nonces.next_nonce(chain.get_account()))
+            else:
+                chain.transact(fn, *args)
+
+    with ThreadPoolExecutor(workers) as pool:
+        return sum(1 for _ in pool.map(replay, lifecycles))
+
+
+def build(args):
+    rng = random.Random(args.seed)
+    counts = build_users(args.users, args.password)
+    print(f"Inserted users: {counts}")
+
+    now = datetime.utcnow()
+    allocator = ids.IdAllocator(ids.MAX_NODE_ID)  # reserved for synthetic data
+    chain_ops = []  # one list of contract calls per replayed product
+    written = 0
+    while written < args.products:
+        size = min(args.batch, args.products - written)
+        products, buckets = [], []
+        for product_id in allocator.allocate(size):
+            product, bucket, ops = make_lifecycle(product_id, counts, rng, now)
+            products.append(product)
+            buckets.append(bucket)
+            if written + len(products) <= args.chain_products:
+                chain_ops.append(ops)
+        products_collection.insert_many(products, ordered=False)
+        history_collection.insert_many(buckets, ordered=False)
+        written += size
+        print(f"\rInserted products: {written:,d}/{args.products:,d}", end="", flush=True)
+    print()
+
+    if chain_ops:
+        print(f"Replayed {replay_on_chain(chain_ops, args.workers):,d} products onto the contract")
+    print("Run `python rollups.py --backfill` and the lineage backfill to populate derived collections")
+
+
+# ---------------------------------------------------------------------------
+# Scenario runner
+# ---------------------------------------------------------------------------
+
+class RoleStats:
+    def __init__(self):
+        self.sent = 0
+        self.ok = 0
+        self.errors = {}
+        self.dropped = 0
+        self.latencies = []
+        self.confirmation_lags = []
+
+    def report(self, seconds):
+        failed = sum(self.errors.values())
+        to_ms = lambda value: round(value * 1000, 1) if value is not None else None
+        return {
+            "sent": self.sent,
+            "ok": self.ok,
+            "throughput_per_s": round(self.ok / seconds, 2),
+            "error_rate": round(failed / self.sent, 4) if self.sent else 0.0,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "latency_ms": {p: to_ms(percentile(self.latencies, q)) for p, q in
+                           (("p50", 50), ("p99", 99), ("p999", 99.9))},
+            "confirmation_lag_ms": {p: to_ms(percentile(self.confirmation_lags, q)) for p, q in
+                                    (("p50", 50), ("p99", 99), ("p999", 99.9))},
+        }
+
+
+class Scenario:
+    """Shared state of one run: logged-in users and products at each stage."""
+
+    def __init__(self, http, users_per_role, password, rng):
+        self.http = http
+        self.users_per_role = users_per_role
+        self.password = password
+        self.rng = rng
+        self.tokens = {role: [] for role in ROLES}
+        # Products waiting for the next lifecycle step
+        self.produced = []
+        self.in_transit = []
+        self.known = []
+        self.stats = {role: RoleStats() for role in ROLES}
+        self.pending_receipts = []
+
+    async def login_all(self):
+        for role in ROLES:
+            for user in users_collection.find({"username": {"$regex": f"^{USER_PREFIX}{role}-"}},
+                                              {"username": 1, "_id": 0}).limit(self.users_per_role):
+                response = await self.http.post("/token", data={"username": user["username"], "password": self.password})
+                response.raise_for_status()
+                self.tokens[role].append(response.json()["access_token"])
+            if not self.tokens[role]:
+                raise RuntimeError(f"No synthetic {role} users found; run `loadgen.py build` first")
+
+    def seed_products(self, sample=10000):
+        # Start with existing synthetic products so updates have targets at once
+        for product in products_collection.find({"status": {"$in": ["Produced", "In Transit"]}},
+                                                {"productId": 1, "status": 1, "_id": 0}).limit(sample):
+            (self.produced if product["status"] == "Produced" else self.in_transit).append(product["productId"])
+        self.known = [p["productId"] for p in products_collection.find({}, {"productId": 1, "_id": 0}).limit(sample)]
+
+    def headers(self, role):
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens[role])}"}
+
+    def take(self, queue):
+        if not queue:
+            return None
+        index = self.rng.randrange(len(queue))
+        queue[index], queue[-1] = queue[-1], queue[index]
+        return queue.pop()
+
+    # One request per role; returns (response, product id, next queue)
+    async def producer(self):
+        response = await self.http.post("/product", headers=self.headers("producer"), json={
+            "name": f"Load test product {self.rng.randrange(10 ** 9)}",
+            "category": self.rng.choice(CATEGORIES),
+            "location": self.rng.choice(LOCATIONS),
+            "quantity": self.rng.randrange(1, 500),
+        })
+        product_id = response.json().get("product_id") if response.status_code == 201 else None
+        return response, product_id, self.produced
+
+    async def distributor(self):
+        product_id = self.take(self.produced)
+        if product_id is None:
+            return None, None, None
+        response = await self.http.put(f"/product/{product_id}", headers=self.headers("distributor"), json={
+            "status": "In Transit", "new_location": self.rng.choice(LOCATIONS), "note": "Picked up",
+        })
+        return response, product_id, self.in_transit
+
+    async def retailer(self):
+        product_id = self.take(self.in_transit)
+        if product_id is None:
+            return None, None, None
+        response = await self.http.put(f"/product/{product_id}", headers=self.headers("retailer"), json={
+            "status": "Delivered", "note": "Received in store",
+        })
+        return response, product_id, None
+
+    async def consumer(self):
+        if not self.known:
+            return None, None, None
+        return await self.http.get(f"/trace/{self.rng.choice(self.known)}"), None, None
+
+    async def regulator(self):
+        return await self.http.get("/products", headers=self.headers("regulator")), None, None
+
+    async def issue(self, role, scheduled):
+        stats = self.stats[role]
+        try:
+            response, product_id, next_queue = await getattr(self, role)()
+        except httpx.HTTPError as e:
+            stats.sent += 1
+            stats.errors[type(e).__name__] = stats.errors.get(type(e).__name__, 0) + 1
+            return
+        if response is None:
+            stats.dropped += 1
+            return
+
+        finished = time.perf_counter()
+        stats.sent += 1
+        if response.status_code < 400:
+            stats.ok += 1
+            stats.latencies.append(finished - scheduled)
+            if product_id and next_queue is not None:
+                next_queue.append(product_id)
+                self.known.append(product_id)
+            tx_hash = response.json().get("tx_hash") if role in ("producer", "distributor", "retailer") else None
+            if tx_hash and tx_hash.startswith("0x"):
+                self.pending_receipts.append((tx_hash, scheduled, role))
+        else:
+            key = str(response.status_code)
+            stats.errors[key] = stats.errors.get(key, 0) + 1
+
+
+# Open-loop arrivals: requests are started on a Poisson schedule whether or
+# not earlier ones have finished. Beyond max_outstanding they are counted as
+# dropped so an overloaded server cannot exhaust the client.
+async def arrivals(scenario, role, rate, deadline, max_outstanding, tasks):
+    outstanding = set()
+    next_at = time.perf_counter()
+    while True:
+        next_at += scenario.rng.expovariate(rate)
+        if next_at >= deadline:
+            break
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if len(outstanding) >= max_outstanding:
+            scenario.stats[role].dropped += 1
+            continue
+        task = asyncio.create_task(scenario.issue(role, next_at))
+        outstanding.add(task)
+        task.add_done_callback(outstanding.discard)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+# Poll the node for receipts of returned transaction hashes until stopped
+# and then for at most drain_seconds more
+async def confirmations(scenario, stop, drain_seconds, interval=0.2):
+    import blockchain
+
+    chain = blockchain.get_chain()
+    if chain is None or chain.w3 is None:
+        return
+    loop = asyncio.get_running_loop()
+    drain_deadline = None
+
+    def check(pending):
+        confirmed, waiting = [], []
+        for item in pending:
+            try:
+                receipt = chain.w3.eth.get_transaction_receipt(item[0])
+            except Exception:
+                receipt = None
+            (confirmed if receipt else waiting).append(item)
+        return confirmed, waiting
+
+    while not stop.is_set() or scenario.pending_receipts:
+        pending, scenario.pending_receipts = scenario.pending_receipts, []
+        if pending:
+            confirmed, waiting = await loop.run_in_executor(None, check, pending)
+            now = time.perf_counter()
+            for _, scheduled, role in confirmed:
+                scenario.stats[role].confirmation_lags.append(now - scheduled)
+            scenario.pending_receipts.extend(waiting)
+        if stop.is_set():
+            drain_deadline = drain_deadline or time.perf_counter() + drain_seconds
+            if time.perf_counter() > drain_deadline:
+                break
+        await asyncio.sleep(interval)
+
+
+async def run_scenario(args):
+    rates = parse_rates(args.rate)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+        scenario = Scenario(http, args.users_per_role, args.password, random.Random(args.seed))
+        await scenario.login_all()
+        scenario.seed_products()
+
+        stop = asyncio.Event()
+        confirmer = asyncio.create_task(confirmations(scenario, stop, args.confirm_timeout))
+
+        started = time.perf_counter()
+        deadline = started + args.seconds
+        tasks = set()
+        await asyncio.gather(*(arrivals(scenario, role, rate, deadline, args.max_outstanding, tasks)
+                               for role, rate in rates.items() if rate > 0))
+        if tasks:
+            await asyncio.wait(list(tasks))
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await confirmer
+
+    report = {
+        "url": args.url,
+        "seconds": round(elapsed, 1),
+        "rates": rates,
+        "roles": {role: scenario.stats[role].report(elapsed) for role in rates},
+        "unconfirmed": len(scenario.pending_receipts),
+        # End-to-end capacity: products created and products delivered per hour
+        "products_created_per_hour": round(scenario.stats["producer"].ok / elapsed * 3600),
+        "products_delivered_per_hour": round(scenario.stats["retailer"].ok / elapsed * 3600),
+    }
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['seconds']}s against {report['url']}")
+    print(f"{'role':12s} {'sent':>8s} {'ok/s':>8s} {'err%':>6s} {'drop':>6s} "
+          f"{'p50':>8s} {'p99':>8s} {'p999':>8s} {'conf p50':>9s} {'conf p99':>9s}")
+    for role, row in report["roles"].items():
+        latency, lag = row["latency_ms"], row["confirmation_lag_ms"]
+        cell = lambda value: f"{value:8.1f}" if value is not None else f"{'-':>8s}"
+        print(f"{role:12s} {row['sent']:8d} {row['throughput_per_s']:8.2f} {row['error_rate'] * 100:6.2f} "
+              f"{row['dropped']:6d} {cell(latency['p50'])} {cell(latency['p99'])} {cell(latency['p999'])} "
+              f"{cell(lag['p50'])} {cell(lag['p99'])}")
+    print(f"products created/hour: {report['products_created_per_hour']:,d}  "
+          f"delivered/hour: {report['products_delivered_per_hour']:,d}  "
+          f"unconfirmed writes: {report['unconfirmed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lifecycle load generator")
+    parser.add_argument("--password", default="loadgen-password", help="Password of the synthetic users")
+    parser.add_argument("--seed", type=int, default=1)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Write a synthetic dataset")
+    build_parser.add_argument("--users", type=int, default=10000)
+    build_parser.add_argument("--products", type=int, default=100000)
+    build_parser.add_argument("--batch", type=int, default=5000)
+    build_parser.add_argument("--chain-products", type=int, default=0,
+                              help="Also replay this many products onto the contract")
+    build_parser.add_argument("--workers", type=int, default=8, help="Parallel chain replay threads")
+
+    run_parser = commands.add_parser("run", help="Drive the API with the role mix")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--seconds", type=float, default=300)
+    run_parser.add_argument("--rate", default=DEFAULT_RATES, help="Requests per second per role")
+    run_parser.add_argument("--users-per-role", type=int, default=50)
+    run_parser.add_argument("--connections", type=int, default=200)
+    run_parser.add_argument("--max-outstanding", type=int, default=1000, help="Per role")
+    run_parser.add_argument("--timeout", type=float, default=60)
+    run_parser.add_argument("--confirm-timeout", type=float, default=60,
+                            help="How long to wait for receipts after the run")
+    run_parser.add_argument("--report", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build(args)
+    else:
+        report = asyncio.run(run_scenario(args))
+        print_report(report)
+        if args.report:
+            with open(args.report, "w") as file:
+                json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,275 @@
-from fastapi import FastAPI, HTTPException, Depends, Body, status
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, Body, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any
 from passlib.context import CryptContext
-from web3 import Web3
-import json
+import asyncio
+import math
 import os
+import threading
+import uuid
 from dotenv import dotenv_values
 
 # Import local modules
-from models.user import User
-from models.product import Product
-from models.transaction import Transaction
+from models.user import User, UserCreate, LoginRequest, RefreshRequest, AuthResponse
+from models.product import (
+    Product, ProductCreate, ProductUpdate, ProductSummary, ProductListResponse,
+    ProductWriteResponse, ProductDetailResponse, ProductTraceResponse, ProductVerifyResponse,
+    BatchUpdateRequest, BatchUpdateResponse, ProductNearResponse, RegionHistoryResponse
+)
+from models.transaction import Transaction, TransactionListResponse
+from models.change import ChangeFeedResponse
+from models.ledger import (
+    QuantityTransferRequest, ProductSplitRequest, ProductMergeRequest, ProductBalancesResponse, HoldingsResponse
+)
+from responses import FastJSONResponse, negotiate
 from models.role_permission import RolePermission
-from db import users_collection, products_collection, transactions_collection, roles_permissions_collection
+from db import (
+    users_collection, products_collection, roles_permissions_collection, refresh_tokens_collection,
+    idempotency_collection
+)
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import admission
+import bloom
+import breaker
+import changes
+import db
+import blockchain
+import coordinator
+import geo
+import history
+import ids
+import ledger
+import lineage
+import profiling
+import rollups
+import search
+import tiering
 
 # Load environment variables
 config = dotenv_values("../.env")
 SECRET_KEY = config.get("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(config.get("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+
+# Time allowed from import to ready before a warning is logged
+STARTUP_BUDGET_SECONDS = float(config.get("STARTUP_BUDGET_SECONDS", "3.0"))
+
+# Largest batch accepted by /products/batch-update
+MAX_BATCH_UPDATES = int(config.get("MAX_BATCH_UPDATES", "500"))
+# Time a batch may spend writing; updates not started by then are returned
+# as deferred so the response arrives well within the client's timeout
+BATCH_TIME_BUDGET_SECONDS = float(config.get("BATCH_TIME_BUDGET_SECONDS", "20"))
+
+# Sizing of the in-memory filter of registered product IDs used by /verify
+BLOOM_CAPACITY = int(config.get("BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = float(config.get("BLOOM_ERROR_RATE", "0.001"))
+
+# Admission control for chain-writing endpoints. MAX_CONFIRM_LATENCY_SECONDS
+# is checked against writes that wait for their receipt; product updates
+# submit with wait=False and only report submission latency at /metrics.
+# Every worker started by serve.py admits writes on its own, so the
+# configured limits are for the whole server and split between workers.
+WRITE_WORKERS = coordinator.worker_count()
+admission_control = admission.AdmissionController(
+    global_rate=float(config.get("WRITE_RATE_GLOBAL", "50")) / WRITE_WORKERS,
+    global_burst=max(1, int(config.get("WRITE_BURST_GLOBAL", "100")) // WRITE_WORKERS),
+    user_rate=float(config.get("WRITE_RATE_USER", "5")) / WRITE_WORKERS,
+    user_burst=max(1, int(config.get("WRITE_BURST_USER", "10")) // WRITE_WORKERS),
+    max_in_flight=max(1, int(config.get("MAX_INFLIGHT_WRITES", "8")) // WRITE_WORKERS),
+    max_queued=int(config.get("MAX_QUEUED_WRITES", "32")) // WRITE_WORKERS,
+    max_confirm_latency=float(config.get("MAX_CONFIRM_LATENCY_SECONDS", "10"))
+)
+
+# Deadlines for chain calls and the breaker that stops calling a sick node
+chain_breaker = breaker.CircuitBreaker(
+    failure_threshold=int(config.get("BREAKER_FAILURES", "5")),
+    slow_ms=float(config.get("BREAKER_SLOW_MS", "1000")),
+    slow_calls=int(config.get("BREAKER_SLOW_CALLS", "5")),
+    open_seconds=float(config.get("BREAKER_OPEN_SECONDS", "15"))
+)
+CHAIN_READ_TIMEOUT = float(config.get("CHAIN_READ_TIMEOUT", "2"))
+CHAIN_WRITE_TIMEOUT = float(config.get("CHAIN_WRITE_TIMEOUT", "10"))
+CHAIN_CONFIRM_TIMEOUT = float(config.get("CHAIN_CONFIRM_TIMEOUT", "60"))
+
+# Chain backend (HTTP node or embedded EVM) and its view call cache,
+# created during startup
+chain = None
+view_cache = None
+
+# Bloom filter of every registered product ID, built during startup
+product_filter = None
+# IDs written while the filter is rebuilt, added to the new one on swap
+filter_rebuild_ids = None
+filter_lock = threading.Lock()
+filter_rebuild_lock = threading.Lock()
+
+# Outcome of each warm-up step, reported by /health/ready
+startup_state = {"ready": False, "components": {}, "startup_seconds": None}
+
+
+# Connect to the configured chain backend and load the contract. Routes
+# use an awaitable chain: the async client for a JSON-RPC node, or the
+# synchronous backend on a thread pool.
+async def load_chain():
+    global chain, view_cache
+    
+    # In multi-worker mode writes go through the coordinator process
+    manager = None
+    if coordinator.configured():
+        manager = await run_blocking(coordinator.connect)
+        coordinated = await run_blocking(lambda: coordinator.CoordinatedChain(manager))
+        blockchain.use_chain(coordinated)
+        backend = await blockchain.connect_async_chain(coordinated, write_executor=admission_control.executor)
+    else:
+        backend = await blockchain.connect_async_chain(write_executor=admission_control.executor)
+    chain = breaker.GuardedChain(backend, chain_breaker, read_timeout=CHAIN_READ_TIMEOUT,
+                                 write_timeout=CHAIN_WRITE_TIMEOUT, confirm_timeout=CHAIN_CONFIRM_TIMEOUT)
+    
+    view_cache = blockchain.async_view_cache(chain)
+    if manager:
+        coordinator.follow_invalidations(manager, view_cache, on_products=note_products)
+
+
+# Build the product ID filter from a covered scan of the products collection.
+# The old filter keeps answering until the new one is complete; IDs written
+# during the scan are recorded and added to it when it is swapped in.
+def load_product_filter():
+    global product_filter, filter_rebuild_ids
+    
+    with filter_rebuild_lock:
+        with filter_lock:
+            filter_rebuild_ids = set()
+        try:
+            capacity = max(BLOOM_CAPACITY, 2 * products_collection.estimated_document_count())
+            new_filter = bloom.BloomFilter(capacity, BLOOM_ERROR_RATE)
+            for product in products_collection.find({}, {"_id": 0, "productId": 1}).batch_size(10000):
+                new_filter.add(product["productId"])
+            for product_id in tiering.iter_archived_ids():
+                new_filter.add(product_id)
+            
+            with filter_lock:
+                for product_id in filter_rebuild_ids:
+                    new_filter.add(product_id)
+                product_filter = new_filter
+        finally:
+            with filter_lock:
+                filter_rebuild_ids = None
+
+
+# Record newly written product IDs in the filter
+def remember_products(product_ids):
+    with filter_lock:
+        if product_filter is not None:
+            for product_id in product_ids:
+                product_filter.add(product_id)
+        if filter_rebuild_ids is not None:
+            filter_rebuild_ids.update(product_ids)
+
+
+# Called with the IDs other workers wrote to, or None if some were missed
+def note_products(product_ids):
+    if product_ids is None:
+        load_product_filter()
+    else:
+        remember_products(product_ids)
+
+
+# Give this process a distinct ID allocator node id
+def configure_ids():
+    worker_slot = 0
+    if coordinator.configured():
+        # Every worker shares NODE_ID, so without a slot IDs would collide
+        ids.require_lease()
+        try:
+            worker_slot = coordinator.connect().workers().register(os.getpid())
+        except Exception as e:
+            print(f"ERROR: Could not lease a node id from the coordinator, product creation is disabled: {str(e)}")
+            raise
+    ids.configure(worker_slot)
+
+# Allocate a product ID, refusing the write while no node id is leased
+def new_product_id():
+    try:
+        return ids.new_id()
+    except ids.NodeIdUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+
+
+def ensure_indexes():
+    db.ensure_indexes()
+    search.ensure_indexes()
+    history.ensure_indexes()
+    rollups.ensure_indexes()
+    tiering.ensure_indexes()
+    geo.ensure_indexes()
+    changes.ensure_indexes()
+    ledger.ensure_indexes()
+
+
+async def run_blocking(fn):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, fn)
+
+
+# Warm up independent dependencies in parallel. A failing step is reported
+# as not ready instead of preventing the worker from starting.
+async def warm_up():
+    steps = {
+        "mongo": db.ping,
+        "roles": db.seed_roles,
+        "indexes": ensure_indexes,
+        "chain": load_chain,
+        "product_filter": load_product_filter,
+        "ids": configure_ids,
+    }
+    results = await asyncio.gather(*(
+        fn() if asyncio.iscoroutinefunction(fn) else run_blocking(fn) for fn in steps.values()
+    ), return_exceptions=True)
+    
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            print(f"Warning: Startup step '{name}' failed: {str(result)}")
+            startup_state["components"][name] = {"ok": False, "error": str(result)}
+        else:
+            startup_state["components"][name] = {"ok": True}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up()
+    
+    startup_seconds = time.perf_counter() - IMPORT_STARTED
+    startup_state["startup_seconds"] = round(startup_seconds, 3)
+    # A worker without a unique node id would allocate colliding IDs
+    startup_state["ready"] = startup_state["components"]["mongo"]["ok"] and startup_state["components"]["ids"]["ok"]
+    if startup_seconds > STARTUP_BUDGET_SECONDS:
+        print(f"Warning: Cold start took {startup_seconds:.2f}s, budget is {STARTUP_BUDGET_SECONDS:.2f}s")
+    else:
+        print(f"Cold start completed in {startup_seconds:.2f}s")
+    
+    yield
+    
+    if chain:
+        await chain.close()
 
 
 # Setup FastAPI
-app = FastAPI(title="Supply Chain Traceability API")
+app = FastAPI(title="Supply Chain Traceability API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Setup CORS
 app.add_middleware(
@@ -36,38 +280,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# Outermost, so timings include compression
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Fields fetched from MongoDB for product listings
+PRODUCT_SUMMARY_FIELDS = {field: 1 for field in ProductSummary.model_fields}
+PRODUCT_SUMMARY_FIELDS["_id"] = 0
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # OAuth2 with Password flow
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Web3 setup - connect to local Ganache instance
-w3 = Web3(Web3.HTTPProvider("http://127.0.0.1:7545"))
-
-# Load and compile the smart contract (in production, would use the deployed ABI)
-try:
-    with open("../contracts/SupplyChain.json") as f:
-        contract_json = json.load(f)
-    
-    contract_abi = contract_json["abi"]
-    contract_address = contract_json.get("networks", {}).get("5777", {}).get("address")
-    
-    if not contract_address:
-        print("Warning: Contract address not found in JSON. Using placeholder.")
-        contract_address = "0x0000000000000000000000000000000000000000"  # Placeholder
-    
-    contract = w3.eth.contract(address=contract_address, abi=contract_abi)
-except Exception as e:
-    print(f"Warning: Unable to load contract: {str(e)}")
-    contract = None
-
 # Authentication functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with profiling.span("bcrypt"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    with profiling.span("bcrypt"):
+        return pwd_context.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -82,19 +318,103 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    with profiling.span("auth"):
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None or payload.get("type") == "refresh":
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
+        
+        user = users_collection.find_one({"username": username})
+        if user is None:
+            raise credentials_exception
+        return user
+
+# Look up a user and check the password; None if either is wrong
+def authenticate_user(username, password):
     user = users_collection.find_one({"username": username})
-    if user is None:
-        raise credentials_exception
+    if not user or not verify_password(password, user["password_hash"]):
+        return None
     return user
 
+def user_profile(user):
+    return {
+        "user_id": str(user["_id"]),
+        "username": user["username"],
+        "role": user["role"],
+        "email": user.get("email"),
+        "phone": user.get("phone")
+    }
+
+# Issue an access token and a new refresh token in the given family. Each
+# refresh token can be used once; presenting it again revokes the family.
+def issue_tokens(user, family=None):
+    now = datetime.utcnow()
+    jti = uuid.uuid4().hex
+    family = family or jti
+    refresh_expires = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    
+    refresh_tokens_collection.insert_one({
+        "_id": jti,
+        "family": family,
+        "username": user["username"],
+        "used": False,
+        "revoked": False,
+        "created_at": now,
+        "expires_at": now + refresh_expires
+    })
+    
+    return {
+        "access_token": create_access_token({"sub": user["username"], "role": user["role"]}),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": jwt.encode(
+            {"sub": user["username"], "type": "refresh", "jti": jti, "fam": family, "exp": now + refresh_expires},
+            SECRET_KEY, algorithm=ALGORITHM
+        ),
+        "refresh_expires_in": int(refresh_expires.total_seconds()),
+        "user": user_profile(user)
+    }
+
+def decode_refresh_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        payload = {}
+    if payload.get("type") != "refresh" or not payload.get("jti"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token"
+        )
+    return payload
+
+# Checks every chain-writing request passes before it is charged: the
+# chain must be up and the write queue not saturated
+async def check_write(current_user: dict = Depends(get_current_user)):
+    reject_if_chain_down()
+    admission_control.check_saturation()
+    return current_user
+
+# Admit a chain-writing request or reject it fast with 429/503
+async def admit_write(current_user: dict = Depends(check_write)):
+    await admission_control.acquire(current_user["username"])
+    try:
+        yield current_user
+    finally:
+        admission_control.release()
+
+# While the chain circuit is open writes fail fast instead of waiting for
+# the node to time out
+def reject_if_chain_down():
+    if chain and chain_breaker.is_open():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Blockchain node unavailable, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(chain_breaker.retry_after())))}
+        )
+
 # Role-based access control
 def has_permission(user, required_permission):
     user_role = user.get("role").lower()
@@ -105,9 +425,11 @@ def has_permission(user, required_permission):
 
 # Authentication endpoints
 @app.post("/register", status_code=status.HTTP_201_CREATED)
-async def register_user(user_data: Dict[str, Any] = Body(...)):
+async def register_user(user: UserCreate):
+    user_data = user.model_dump()
+    
     # Check if user already exists
-    if users_collection.find_one({"username": user_data["username"]}):
+    if users_collection.find_one({"username": user_data["username"]}, {"_id": 1}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
@@ -133,8 +455,8 @@ async def register_user(user_data: Dict[str, Any] = Body(...)):
 
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = users_collection.find_one({"username": form_data.username})
-    if not user or not verify_password(form_data.password, user["password_hash"]):
+    user = authenticate_user(form_data.username, form_data.password)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -154,8 +476,8 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 @app.post("/login", status_code=status.HTTP_200_OK)
 async def login(username: str = Body(...), password: str = Body(...)):
-    user = users_collection.find_one({"username": username})
-    if not user or not verify_password(password, user["password_hash"]):
+    user = authenticate_user(username, password)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
@@ -170,34 +492,81 @@ async def login(username: str = Body(...), password: str = Body(...)):
         
     }
 
-# Product endpoints
-@app.post("/product", status_code=status.HTTP_201_CREATED)
-async def add_product(product_data: Dict[str, Any] = Body(...), current_user: dict = Depends(get_current_user)):
-    # Check if user has permission to add product
+# One round trip and one password check: access token, refresh token and profile
+@app.post("/auth/login", response_model=AuthResponse)
+async def auth_login(credentials: LoginRequest):
+    user = authenticate_user(credentials.username, credentials.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid username or password"
+        )
+    return issue_tokens(user)
+
+# Rotate a refresh token: a signature check and two indexed lookups, no bcrypt
+@app.post("/auth/refresh", response_model=AuthResponse)
+async def auth_refresh(request: RefreshRequest):
+    payload = decode_refresh_token(request.refresh_token)
     
+    # Mark the token used atomically so concurrent refreshes cannot both win
+    record = refresh_tokens_collection.find_one_and_update(
+        {"_id": payload["jti"], "used": False, "revoked": False},
+        {"$set": {"used": True, "used_at": datetime.utcnow()}}
+    )
+    if record is None:
+        # A token presented twice was probably stolen; end the whole session
+        refresh_tokens_collection.update_many({"family": payload["fam"]}, {"$set": {"revoked": True}})
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token already used or revoked"
+        )
     
+    user = users_collection.find_one({"username": record["username"]}, {"password_hash": 0})
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User no longer exists"
+        )
+    return issue_tokens(user, family=record["family"])
+
+@app.post("/auth/logout")
+async def auth_logout(request: RefreshRequest):
+    payload = decode_refresh_token(request.refresh_token)
+    refresh_tokens_collection.update_many({"family": payload["fam"]}, {"$set": {"revoked": True}})
+    return {"success": True}
+
+# Product endpoints
+@app.post("/product", status_code=status.HTTP_201_CREATED, response_model=ProductWriteResponse)
+async def add_product(product: ProductCreate, current_user: dict = Depends(admit_write)):
+    product_data = product.model_dump(exclude_none=True)
     
     # Generate product ID if not provided
     if "productId" not in product_data:
-        product_data["productId"] = f"PROD-{datetime.utcnow().timestamp():.0f}"
+        product_data["productId"] = new_product_id()
     
     # Add product to blockchain
     try:
-        if contract:
-            # Get an address with funds from Ganache
-            account = w3.eth.accounts[0]
-            
-            # Execute contract function
-            tx_hash = contract.functions.addProduct(
+        if chain and chain.supports("addProductLot"):
+            # Execute contract function and wait for the receipt
+            blockchain_tx, tx_receipt = await admission_control.run(
+                chain.transact,
+                "addProductLot",
                 product_data["productId"],
                 product_data["name"],
                 current_user["username"],
-            ).transact({'from': account})
-            
-            # Wait for transaction receipt
-            tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-            
-            blockchain_tx = tx_hash.hex()
+                product_data.get("quantity", 1),
+            )
+            view_cache.invalidate(product_data["productId"])
+        elif chain:
+            # Contracts deployed before the quantity ledger
+            blockchain_tx, tx_receipt = await admission_control.run(
+                chain.transact,
+                "addProduct",
+                product_data["productId"],
+                product_data["name"],
+                current_user["username"],
+            )
+            view_cache.invalidate(product_data["productId"])
         else:
             blockchain_tx = "mock-tx-hash-contract-not-available"
         
@@ -215,10 +584,13 @@ async def add_product(product_data: Dict[str, Any] = Body(...), current_user: di
             "status": "Produced",
             "last_updated": datetime.utcnow(),
             "batch_id": product_data.get("batch_id", ""),
+            "auth_digest": bloom.authenticity_digest(
+                product_data["productId"], product_data["name"], current_user["username"], "Produced"
+            ),
+            # The creator holds every unit
+            "ledger": True,
         }
         
-        result = products_collection.insert_one(product_dict)
-        
         # Create initial transaction record
         transaction = {
             "productId": product_data["productId"],
@@ -226,10 +598,32 @@ async def add_product(product_data: Dict[str, Any] = Body(...), current_user: di
             "to_user": current_user["username"],
             "timestamp": datetime.utcnow(),
             "action": "created",
-            "note": "Product created and registered"
+            "note": "Product created and registered",
+            "tx_hashes": [blockchain_tx] if chain else []
         }
         
-        transactions_collection.insert_one(transaction)
+        # Explicit coordinates win over the gazetteer
+        coords = product_coordinates(product_data, product_dict["location"])
+        if coords:
+            product_dict["position"] = geo.point(*coords)
+        
+        # Insert the product, its first history event and the feed entry in one round trip
+        change = changes.build("product.created", product_data["productId"], product_dict, transaction)
+        history.record(product_data["productId"], transaction, product_insert=product_dict, change=change)
+        ledger.post([ledger.entry(product_data["productId"], "mint", None, current_user["username"],
+                                  product_dict["quantity"], transaction["timestamp"],
+                                  tx_hash=blockchain_tx if chain else None)])
+        if coords:
+            geo.record_fix(product_data["productId"], *coords, location=product_dict["location"],
+                           owner=current_user["username"], ts=transaction["timestamp"])
+        remember_products([product_data["productId"]])
+        rollups.record(transaction, new_status=product_dict["status"])
+        
+        # Record lineage edges for recall queries
+        lineage.record_batch_member(product_dict["batch_id"], product_data["productId"])
+        lineage.record_handler(product_data["productId"], current_user["username"])
+        if product_data.get("parent_ids"):
+            lineage.record_derivation(product_data["parent_ids"], product_data["productId"])
         
         return {
             "success": True,
@@ -262,7 +656,7 @@ async def add_distributor(distributor_data: Dict[str, Any] = Body(...), current_
             "created_at": datetime.utcnow()
         }
         
-        result = db.distributors.insert_one(distributor)
+        result = db.db["distributors"].insert_one(distributor)
         
         return {
             "success": True,
@@ -295,14 +689,197 @@ async def get_distributors():
             detail=f"Failed to retrieve distributors: {str(e)}"
         )
 
-@app.put("/product/{product_id}")
+# Client timestamps may carry a zone; MongoDB returns naive UTC
+def naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# Explicit lat/lon if both were given, otherwise the gazetteer position of
+# the location name, or None
+def product_coordinates(data, location):
+    if data.get("lat") is not None and data.get("lon") is not None:
+        return data["lat"], data["lon"]
+    return geo.geocode(location) if location else None
+
+# Fields of a product needed to apply an update to it
+PRODUCT_UPDATE_FIELDS = {
+    "_id": 0, "productId": 1, "name": 1, "current_owner": 1, "status": 1, "location": 1, "last_updated": 1,
+    "quantity": 1, "ledger": 1
+}
+
+# One updateProduct transaction carrying every changed field and a single
+# history record
+async def send_composite_update(product_id, update_data, chain_status, coords):
+    mask = 0
+    if update_data.get("new_owner"):
+        mask |= blockchain.UPDATE_OWNER
+    if chain_status is not None:
+        mask |= blockchain.UPDATE_STATUS
+    if update_data.get("new_location") is not None:
+        mask |= blockchain.UPDATE_LOCATION
+    if update_data.get("quantity") is not None:
+        mask |= blockchain.UPDATE_QUANTITY
+    lat_e6, lon_e6 = 0, 0
+    if coords:
+        mask |= blockchain.UPDATE_POSITION
+        lat_e6, lon_e6 = geo.to_microdegrees(*coords)
+    
+    blockchain_tx, _ = await admission_control.run(
+        chain.transact,
+        "updateProduct",
+        product_id,
+        mask,
+        update_data.get("new_owner", ""),
+        chain_status or "",
+        update_data.get("new_location", ""),
+        update_data.get("quantity", 0),
+        lat_e6,
+        lon_e6,
+        update_data.get("note", ""),
+        wait=False
+    )
+    return [blockchain_tx]
+
+# Contracts deployed before updateProduct: one transaction per changed field.
+# Quantity is not kept on chain there. Returns (tx_hashes, chain_status).
+async def send_field_updates(product_id, product, update_data, chain_status, coords):
+    new_owner = update_data.get("new_owner")
+    new_location = update_data.get("new_location")
+    moved = new_location is not None or coords is not None
+    # Any update other than a pure move sets a status, as it always has
+    if chain_status is None and not moved:
+        chain_status = "Updated"
+    
+    tx_hashes = []
+    # If ownership transfer
+    if new_owner:
+        # Execute contract function to transfer ownership
+        blockchain_tx, _ = await admission_control.run(
+            chain.transact,
+            "transferProduct",
+            product_id,
+            new_owner,
+            chain_status,
+            wait=False
+        )
+        tx_hashes.append(blockchain_tx)
+    elif chain_status is not None:
+        # Just update status
+        blockchain_tx, _ = await admission_control.run(
+            chain.transact,
+            "updateProductStatus",
+            product_id,
+            chain_status,
+            wait=False
+        )
+        tx_hashes.append(blockchain_tx)
+    if moved:
+        location = new_location if new_location is not None else product.get("location", "")
+        if coords and chain.supports("updateProductLocationGeo"):
+            location_tx, _ = await admission_control.run(
+                chain.transact,
+                "updateProductLocationGeo",
+                product_id,
+                location,
+                *geo.to_microdegrees(*coords),
+                update_data.get("note", ""),
+                wait=False
+            )
+        else:
+            location_tx, _ = await admission_control.run(
+                chain.transact,
+                "updateProductLocation",
+                product_id,
+                location,
+                update_data.get("note", ""),
+                wait=False
+            )
+        tx_hashes.append(location_tx)
+    return tx_hashes, chain_status
+
+# Write one update to the chain and to MongoDB. product is the state before
+# the update and is changed in place so that further updates to the same
+# product in a batch see it. Returns the transaction hash.
+async def apply_product_update(product_id, product, update_data, timestamp=None):
+    new_owner = update_data.get("new_owner")
+    new_location = update_data.get("new_location")
+    coords = product_coordinates(update_data, new_location)
+    # Status the contract will hold after this write, None if it keeps its own
+    chain_status = update_data.get("status", "Transferred" if new_owner else None)
+    if update_data.get("quantity") is not None:
+        ledger.check_quantity(product, update_data["quantity"])
+    
+    tx_hashes = []
+    if chain:
+        if chain.supports("updateProduct"):
+            tx_hashes = await send_composite_update(product_id, update_data, chain_status, coords)
+        else:
+            tx_hashes, chain_status = await send_field_updates(product_id, product, update_data, chain_status, coords)
+        view_cache.invalidate(product_id)
+        blockchain_tx = tx_hashes[0]
+    else:
+        blockchain_tx = "mock-tx-hash-contract-not-available"
+    
+    # Create transaction record
+    transaction = {
+        "productId": product_id,
+        "from_user": product["current_owner"],
+        "to_user": update_data.get("new_owner", product["current_owner"]),
+        "timestamp": timestamp or datetime.utcnow(),
+        "action": "transferred" if new_owner else "updated",
+        "note": update_data.get("note", ""),
+        # Lets snapshot catch-up recognise transactions already applied
+        "tx_hashes": tx_hashes
+    }
+    if new_location is not None:
+        transaction["location"] = new_location
+    
+    # Update timestamp and, when status or owner change, the expected on-chain digest
+    update_data["last_updated"] = datetime.utcnow()
+    if chain_status is not None:
+        update_data["auth_digest"] = bloom.authenticity_digest(
+            product_id, product.get("name"), new_owner or product["current_owner"], chain_status
+        )
+    
+    # Coordinates are stored as a GeoJSON point
+    update_data.pop("lat", None)
+    update_data.pop("lon", None)
+    if coords:
+        update_data["position"] = geo.point(*coords)
+    
+    # For distributor location updates
+    if "new_location" in update_data:
+        update_data["location"] = update_data.pop("new_location")
+    
+    # If ownership transfer
+    if "new_owner" in update_data:
+        update_data["current_owner"] = update_data.pop("new_owner")
+    
+    # Update MongoDB record and append the history and feed entries together
+    change = changes.build("product." + transaction["action"], product_id, update_data, transaction)
+    history.record(product_id, transaction, product_update={"$set": update_data}, change=change)
+    ledger.record_update(product, update_data, transaction["timestamp"], tx_hashes[0] if tx_hashes else None)
+    rollups.record(transaction, old_status=product.get("status"), new_status=update_data.get("status"))
+    lineage.record_handler(product_id, transaction["to_user"])
+    if coords:
+        geo.record_fix(product_id, *coords, location=update_data.get("location", product.get("location")),
+                       owner=transaction["to_user"], ts=transaction["timestamp"])
+    
+    product.update({k: v for k, v in update_data.items() if k in PRODUCT_UPDATE_FIELDS})
+    return blockchain_tx
+
+@app.put("/product/{product_id}", response_model=ProductWriteResponse)
 async def update_product(
     product_id: str,
-    update_data: dict = Body(...),
-    current_user: dict = Depends(get_current_user)
+    update: ProductUpdate,
+    current_user: dict = Depends(admit_write)
 ):
-    # Check product exists
-    product = products_collection.find_one({"productId": product_id})
+    update_data = update.model_dump(exclude_none=True)
+    
+    # Check product exists; archived products are restored before writing
+    product = (products_collection.find_one({"productId": product_id}, PRODUCT_UPDATE_FIELDS)
+               or tiering.restore(product_id))
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -311,110 +888,414 @@ async def update_product(
     
     # Update product on blockchain and in database
     try:
-        if contract:
-            # Get an address with funds from Ganache
-            account = w3.eth.accounts[0]
-            
-            # If ownership transfer
-            new_owner = update_data.get("new_owner")
-            if new_owner:
-                # Execute contract function to transfer ownership
-                tx_hash = contract.functions.transferProduct(
-                    product_id,
-                    new_owner,
-                    update_data.get("status", "Transferred")
-                ).transact({'from': account})
-                
-                blockchain_tx = tx_hash.hex()
-            else:
-                # Just update status
-                tx_hash = contract.functions.updateProductStatus(
-                    product_id,
-                    update_data.get("status", "Updated")
-                ).transact({'from': account})
-                
-                blockchain_tx = tx_hash.hex()
+        blockchain_tx = await apply_product_update(product_id, product, update_data)
+        
+        return {
+            "success": True,
+            "message": "Product updated successfully",
+            "tx_hash": blockchain_tx
+        }
+    
+    except ledger.InsufficientUnits as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Quantity too low: {str(e)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to update product: {str(e)}"
+        )
+
+# Quantity ledger functions need a redeployed contract; without a chain
+# the ledger is kept in the database only
+def require_ledger_contract(fn_name):
+    if chain and not chain.supports(fn_name):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"Deployed contract has no {fn_name}; redeploy it to use the quantity ledger"
+        )
+
+# Product for a ledger write, restoring archived products and seeding
+# balances of products created before the ledger
+def ledger_product(product_id):
+    # Whole document, split and merge copy its details
+    product = (products_collection.find_one({"productId": product_id}, {"_id": 0})
+               or tiering.restore(product_id))
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Product {product_id} not found"
+        )
+    ledger.ensure_seeded(product)
+    return product
+
+# Move some of the caller's units of a product to another user. The
+# product's owner does not change.
+@app.post("/product/{product_id}/transfer-quantity", response_model=ProductWriteResponse)
+async def transfer_quantity(
+    product_id: str,
+    transfer: QuantityTransferRequest,
+    current_user: dict = Depends(admit_write)
+):
+    username = current_user["username"]
+    if transfer.to_holder == username:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot transfer units to yourself"
+        )
+    if not users_collection.find_one({"username": transfer.to_holder}, {"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recipient not found"
+        )
+    require_ledger_contract("transferQuantity")
+    product = ledger_product(product_id)
+    
+    # Take the units first so concurrent transfers cannot overspend them
+    if not ledger.reserve(product_id, username, transfer.amount):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"You hold fewer than {transfer.amount} units of this product"
+        )
+    
+    try:
+        if chain:
+            blockchain_tx, _ = await admission_control.run(
+                chain.transact,
+                "transferQuantity",
+                product_id,
+                username,
+                transfer.to_holder,
+                transfer.amount,
+                transfer.note or "",
+            )
+            view_cache.invalidate(product_id)
         else:
             blockchain_tx = "mock-tx-hash-contract-not-available"
+    except Exception as e:
+        ledger.refund(product_id, username, transfer.amount)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to transfer units: {str(e)}"
+        )
+    
+    try:
+        ledger.record_transfer(product, username, transfer.to_holder, transfer.amount, transfer.note,
+                               tx_hash=blockchain_tx if chain else None)
         
-        # Create transaction record
-        transaction = {
-            "productId": product_id,
-            "from_user": product["current_owner"],
-            "to_user": update_data.get("new_owner", product["current_owner"]),
-            "timestamp": datetime.utcnow(),
-            "action": "transferred" if update_data.get("new_owner") else "updated",
-            "note": update_data.get("note", "")
+        return {
+            "success": True,
+            "message": f"{transfer.amount} units transferred to {transfer.to_holder}",
+            "product_id": product_id,
+            "tx_hash": blockchain_tx
         }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to record unit transfer: {str(e)}"
+        )
+
+# Move some of the caller's units of a product into a new product they own
+@app.post("/product/{product_id}/split", status_code=status.HTTP_201_CREATED, response_model=ProductWriteResponse)
+async def split_product(
+    product_id: str,
+    split: ProductSplitRequest,
+    current_user: dict = Depends(admit_write)
+):
+    username = current_user["username"]
+    child_id = split.productId or new_product_id()
+    require_ledger_contract("splitProduct")
+    parent = ledger_product(product_id)
+    if products_collection.find_one({"productId": child_id}, {"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Product {child_id} already exists"
+        )
+    
+    # Written to the contract with the child so both digests use it
+    child_status = parent.get("status") or "Produced"
+    
+    if not ledger.reserve(product_id, username, split.amount):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"You hold fewer than {split.amount} units of this product"
+        )
+    
+    try:
+        if chain:
+            blockchain_tx, _ = await admission_control.run(
+                chain.transact,
+                "splitProduct",
+                product_id,
+                child_id,
+                username,
+                split.amount,
+                child_status,
+                split.note or "",
+            )
+            view_cache.invalidate(product_id)
+            view_cache.invalidate(child_id)
+        else:
+            blockchain_tx = "mock-tx-hash-contract-not-available"
+    except Exception as e:
+        ledger.refund(product_id, username, split.amount)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to split product: {str(e)}"
+        )
+    
+    try:
+        child = ledger.record_derivation("split", [(parent, split.amount)], child_id, username, child_status,
+                                         split.note, tx_hash=blockchain_tx if chain else None)
+        remember_products([child_id])
         
-        transactions_collection.insert_one(transaction)
-        
-        # Update timestamp
-        update_data["last_updated"] = datetime.utcnow()
-        
-        # For distributor location updates
-        if "new_location" in update_data:
-            update_data["location"] = update_data.pop("new_location")
-        
-        # If ownership transfer
-        if "new_owner" in update_data:
-            update_data["current_owner"] = update_data.pop("new_owner")
-        
-        # Update MongoDB record
-        products_collection.update_one(
-            {"productId": product_id},
-            {"$set": update_data}
+        return {
+            "success": True,
+            "message": f"{split.amount} units split into a new product",
+            "product_id": child["productId"],
+            "tx_hash": blockchain_tx
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to record split: {str(e)}"
+        )
+
+# Combine every unit the caller holds of several products into a new product
+@app.post("/products/merge", status_code=status.HTTP_201_CREATED, response_model=ProductWriteResponse)
+async def merge_products(merge: ProductMergeRequest, current_user: dict = Depends(admit_write)):
+    username = current_user["username"]
+    child_id = merge.productId or new_product_id()
+    if len(set(merge.parent_ids)) != len(merge.parent_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Products to merge must be distinct"
+        )
+    require_ledger_contract("mergeProducts")
+    parents = [ledger_product(parent_id) for parent_id in merge.parent_ids]
+    if products_collection.find_one({"productId": child_id}, {"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Product {child_id} already exists"
+        )
+    
+    child_status = parents[0].get("status") or "Produced"
+    parts = [(parent, ledger.take_all(parent["productId"], username)) for parent in parents]
+    
+    def refund_all():
+        for parent, amount in parts:
+            ledger.refund(parent["productId"], username, amount)
+    
+    empty = [parent["productId"] for parent, amount in parts if not amount]
+    if empty:
+        refund_all()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"You hold no units of {', '.join(empty)}"
+        )
+    
+    try:
+        if chain:
+            blockchain_tx, _ = await admission_control.run(
+                chain.transact,
+                "mergeProducts",
+                merge.parent_ids,
+                child_id,
+                username,
+                child_status,
+                merge.note or "",
+            )
+            for parent_id in merge.parent_ids:
+                view_cache.invalidate(parent_id)
+            view_cache.invalidate(child_id)
+        else:
+            blockchain_tx = "mock-tx-hash-contract-not-available"
+    except Exception as e:
+        refund_all()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to merge products: {str(e)}"
         )
+    
+    try:
+        child = ledger.record_derivation("merge", parts, child_id, username, child_status,
+                                         merge.note, tx_hash=blockchain_tx if chain else None)
+        remember_products([child_id])
         
         return {
             "success": True,
-            "message": "Product updated successfully",
+            "message": f"{child['quantity']} units merged into a new product",
+            "product_id": child["productId"],
             "tx_hash": blockchain_tx
         }
     
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to update product: {str(e)}"
+            detail=f"Failed to record merge: {str(e)}"
         )
 
-@app.get("/product/{product_id}")
+# Apply a batch of queued field updates in one request. Each update carries
+# an idempotency key, so a batch can be resent after a lost response, and
+# the last_updated the client saw, so updates made against stale data are
+# reported as conflicts instead of overwriting newer changes.
+@app.post("/products/batch-update", response_model=BatchUpdateResponse)
+async def batch_update_products(batch: BatchUpdateRequest, current_user: dict = Depends(check_write)):
+    if len(batch.updates) > MAX_BATCH_UPDATES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BATCH_UPDATES} updates per batch"
+        )
+    
+    username = current_user["username"]
+    keys = [f"{username}:{item.idempotency_key}" for item in batch.updates]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Idempotency keys must be unique within a batch"
+        )
+    
+    # One token per update up front; updates that end up making no chain
+    # write are refunded. Each write then takes its own in-flight slot.
+    admission_control.check(username, cost=len(batch.updates))
+    writes = 0
+    try:
+        results = [None] * len(batch.updates)
+        
+        # Claim all keys in one write; keys that already exist were sent before
+        claimed = set(keys)
+        try:
+            idempotency_collection.insert_many(
+                [{"_id": key, "state": "pending", "created_at": datetime.utcnow()} for key in keys],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                if error["code"] == 11000:
+                    claimed.discard(error["op"]["_id"])
+                else:
+                    raise
+        
+        seen = {doc["_id"]: doc for doc in idempotency_collection.find({"_id": {"$in": [k for k in keys if k not in claimed]}})}
+        for index, key in enumerate(keys):
+            if key not in claimed:
+                stored = seen.get(key, {})
+                results[index] = {
+                    **stored.get("result", {"productId": batch.updates[index].productId}),
+                    "idempotency_key": batch.updates[index].idempotency_key,
+                    "outcome": "duplicate" if stored.get("state") == "done" else "in_progress"
+                }
+        
+        # One query for every product touched by the batch
+        to_apply = [i for i, key in enumerate(keys) if key in claimed and results[i] is None]
+        product_ids = list({batch.updates[i].productId for i in to_apply})
+        products = {p["productId"]: p for p in products_collection.find(
+            {"productId": {"$in": product_ids}}, {**PRODUCT_UPDATE_FIELDS, "productId": 1}
+        )}
+        for product_id in product_ids:
+            if product_id not in products:
+                restored = tiering.restore(product_id)
+                if restored:
+                    products[product_id] = restored
+        last_updated_before = {pid: p.get("last_updated") for pid, p in products.items()}
+        
+        # Apply in the order the scans happened on the device
+        to_apply.sort(key=lambda i: naive_utc(batch.updates[i].recorded_at) or datetime.min)
+        done = []
+        deferred = []
+        conflicted = set()
+        started = time.monotonic()
+        for index in to_apply:
+            item = batch.updates[index]
+            key = keys[index]
+            result = {"idempotency_key": item.idempotency_key, "productId": item.productId}
+            product = products.get(item.productId)
+            
+            if time.monotonic() - started > BATCH_TIME_BUDGET_SECONDS:
+                # Out of time; the client resends these with its next sync
+                deferred.append(key)
+                result["outcome"] = "deferred"
+            elif product is None:
+                result["outcome"] = "not_found"
+            elif item.productId in conflicted or (
+                item.base_updated and last_updated_before[item.productId]
+                and last_updated_before[item.productId] > naive_utc(item.base_updated)
+            ):
+                # Someone else changed the product after the client cached it;
+                # later updates of the same product build on the rejected one
+                conflicted.add(item.productId)
+                result["outcome"] = "conflict"
+                result["current"] = {field: product.get(field) for field in ("status", "current_owner", "last_updated")}
+            else:
+                update_data = item.model_dump(include=set(ProductUpdate.model_fields), exclude_none=True)
+                recorded_at = min(naive_utc(item.recorded_at), datetime.utcnow()) if item.recorded_at else None
+                try:
+                    await admission_control.acquire_slot()
+                    writes += 1
+                    try:
+                        result["tx_hash"] = await apply_product_update(item.productId, product, update_data, recorded_at)
+                    finally:
+                        admission_control.release()
+                    result["outcome"] = "applied"
+                except Exception as e:
+                    # Release the key so the client can retry this update
+                    idempotency_collection.delete_one({"_id": key})
+                    result["outcome"] = "error"
+                    result["detail"] = str(e)
+            
+            results[index] = result
+            if result["outcome"] not in ("error", "deferred"):
+                done.append(UpdateOne({"_id": key}, {"$set": {"state": "done", "result": result}}))
+        
+        if done:
+            idempotency_collection.bulk_write(done, ordered=False)
+        if deferred:
+            idempotency_collection.delete_many({"_id": {"$in": deferred}})
+    finally:
+        admission_control.refund(username, len(batch.updates) - writes)
+    
+    counts = {}
+    for result in results:
+        counts[result["outcome"]] = counts.get(result["outcome"], 0) + 1
+    return {"success": True, "results": results, "counts": counts}
+
+@app.get("/product/{product_id}", response_model=ProductDetailResponse)
 async def get_product(product_id: str):
     try:
-        # Get product data from blockchain
+        # Get product data from blockchain; without it the response is
+        # served from the database and flagged stale
         blockchain_data = None
-        if contract:
+        stale = False
+        if chain:
             try:
-                blockchain_data = contract.functions.getProduct(product_id).call()
+                blockchain_data = await view_cache.call("getProduct", product_id)
+            except breaker.BreakerOpen:
+                stale = True
             except Exception as e:
+                stale = "does not exist" not in str(e)
                 print(f"Warning: Could not fetch blockchain data: {str(e)}")
         
-        # Get detailed metadata from MongoDB
-        product = products_collection.find_one({"productId": product_id})
+        # Get detailed metadata from MongoDB, restoring archived products
+        product = products_collection.find_one({"productId": product_id}, {"_id": 0}) or tiering.restore(product_id)
         if not product:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Product not found in database"
             )
         
-        # Convert ObjectId to string for JSON serialization
-        product["_id"] = str(product["_id"])
-        
         # Get transaction history
-        transactions = list(transactions_collection.find(
-            {"productId": product_id}
-        ))
-        
-        # Convert ObjectId to string in each transaction
-        for txn in transactions:
-            txn["_id"] = str(txn["_id"])
+        transactions = history.read_history(product_id)
         
         # Combine blockchain and database data
         return {
             "success": True,
             "product": product,
             "blockchain_data": blockchain_data,
-            "transaction_history": transactions
+            "transaction_history": transactions,
+            "stale": stale
         }
     
     except Exception as e:
@@ -423,35 +1304,28 @@ async def get_product(product_id: str):
             detail=f"Failed to retrieve product data: {str(e)}"
         )
 
-@app.get("/products")
-async def get_products(current_user: dict = Depends(get_current_user)):
+@app.get("/products", response_model=ProductListResponse)
+async def get_products(request: Request, current_user: dict = Depends(get_current_user)):
     try:
         # Determine which products to return based on role
         role = current_user["role"].lower()
+        # Taken first so the client can follow /changes from here without gaps
+        change_token = changes.head_token()
         
         if role == "regulator":
             # Regulators can see all products
-            products_cursor = products_collection.find({})
+            products_cursor = products_collection.find({}, PRODUCT_SUMMARY_FIELDS)
         elif role == "producer":
             # Producers can see products they created
-            products_cursor = products_collection.find({"current_owner": current_user["username"]})
+            products_cursor = products_collection.find({"current_owner": current_user["username"]}, PRODUCT_SUMMARY_FIELDS)
         elif role in ["distributor", "retailer"]:
             # Distributors and retailers can see products assigned to them
-            products_cursor = products_collection.find({"current_owner": current_user["username"]})
+            products_cursor = products_collection.find({"current_owner": current_user["username"]}, PRODUCT_SUMMARY_FIELDS)
         else:  # Consumer
             # Consumers can see all products but with limited info
-            products_cursor = products_collection.find({})
+            products_cursor = products_collection.find({}, PRODUCT_SUMMARY_FIELDS)
         
-        # Convert to list and clean for JSON serialization
-        products = []
-        for product in products_cursor:
-            product["_id"] = str(product["_id"])
-            products.append(product)
-        
-        return {
-            "success": True,
-            "products": products
-        }
+        return negotiate(request, ProductListResponse(products=list(products_cursor), change_token=change_token))
     
     except Exception as e:
         raise HTTPException(
@@ -459,22 +1333,206 @@ async def get_products(current_user: dict = Depends(get_current_user)):
             detail=f"Failed to retrieve products: {str(e)}"
         )
 
-@app.get("/transactions/{product_id}")
-async def get_product_transactions(product_id: str):
+# Visibility of products by role, as for /products
+def product_scope(user):
+    if user["role"].lower() in ["producer", "distributor", "retailer"]:
+        return {"current_owner": user["username"]}
+    return {}
+
+# Which feed entries a user may see, matching product_scope
+def change_scope(user):
+    if user["role"].lower() in ["producer", "distributor", "retailer"]:
+        return {"users": user["username"]}
+    return {}
+
+@app.get("/changes", response_model=ChangeFeedResponse)
+async def get_changes(
+    request: Request,
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        found, next_token, has_more = changes.read(since, query=change_scope(current_user), limit=limit)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid change token"
+        )
+    except changes.TokenExpired:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Change token expired, reload /products and follow its change_token"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve changes: {str(e)}"
+        )
+    
+    for change in found:
+        change["seq"] = change.pop("_id")
+    return negotiate(request, ChangeFeedResponse(changes=found, next_token=next_token, has_more=has_more))
+
+@app.get("/products/near", response_model=ProductNearResponse)
+async def products_near(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(50, gt=0, le=20000),
+    status_filter: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        query = product_scope(current_user)
+        if status_filter:
+            query["status"] = status_filter
+        products = geo.near(lat, lon, radius_km, query=query, projection=PRODUCT_SUMMARY_FIELDS, limit=limit)
+        return negotiate(request, ProductNearResponse(products=products))
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to find nearby products: {str(e)}"
+        )
+
+@app.get("/products/region-history", response_model=RegionHistoryResponse)
+async def products_region_history(
+    request: Request,
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    start: datetime = Query(...),
+    end: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: dict = Depends(get_current_user)
+):
+    # Movement across all owners is regulator data
+    if not has_permission(current_user, "view_all_transactions"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view region history"
+        )
+    if min_lat >= max_lat or min_lon >= max_lon:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="min_lat and min_lon must be below max_lat and max_lon"
+        )
+    
+    try:
+        visits = geo.region_history(
+            geo.box(min_lat, min_lon, max_lat, max_lon),
+            naive_utc(start),
+            naive_utc(end) or datetime.utcnow(),
+            limit=limit,
+        )
+        return negotiate(request, RegionHistoryResponse(products=visits))
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve region history: {str(e)}"
+        )
+
+@app.get("/products/search")
+async def search_products(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    location: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    facets: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        result = search.search_products(
+            q=q,
+            category=category,
+            status=status_filter,
+            location=location,
+            date_from=date_from,
+            date_to=date_to,
+            limit=limit,
+            cursor=cursor,
+            facets=facets,
+            scope=product_scope(current_user)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to search products: {str(e)}"
+        )
+    
+    return {"success": True, **result}
+
+# Who holds how many units of a product
+@app.get("/product/{product_id}/balances", response_model=ProductBalancesResponse)
+async def get_product_balances(
+    product_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    product = products_collection.find_one({"productId": product_id}, PRODUCT_UPDATE_FIELDS) or tiering.restore(product_id)
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    
+    try:
+        quantity = product.get("quantity")
+        quantity = 1 if quantity is None else quantity
+        if product.get("ledger"):
+            balances = ledger.holders(product_id)
+        else:
+            # Not seeded yet: the owner holds every unit
+            balances = [{"holder": product["current_owner"], "quantity": quantity}]
+        return negotiate(request, ProductBalancesResponse(productId=product_id, quantity=quantity, balances=balances))
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve balances: {str(e)}"
+        )
+
+# Products a user holds units of; other users' holdings are regulator data
+@app.get("/holdings", response_model=HoldingsResponse)
+async def get_holdings(
+    request: Request,
+    holder: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: dict = Depends(get_current_user)
+):
+    holder = holder or current_user["username"]
+    if holder != current_user["username"] and not has_permission(current_user, "view_all_transactions"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view other users' holdings"
+        )
+    
+    try:
+        return negotiate(request, HoldingsResponse(holder=holder, holdings=ledger.holdings(holder, limit=limit)))
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve holdings: {str(e)}"
+        )
+
+@app.get("/transactions/{product_id}", response_model=TransactionListResponse)
+async def get_product_transactions(product_id: str, request: Request):
     try:
         # Get transaction history from MongoDB
-        transactions_cursor = transactions_collection.find({"productId": product_id})
-        
-        # Convert to list and clean for JSON serialization
-        transactions = []
-        for txn in transactions_cursor:
-            txn["_id"] = str(txn["_id"])
-            transactions.append(txn)
+        transactions = history.read_history(product_id)
         
-        return {
-            "success": True,
-            "transactions": transactions
-        }
+        return negotiate(request, TransactionListResponse(transactions=transactions))
     
     except Exception as e:
         raise HTTPException(
@@ -482,26 +1540,19 @@ async def get_product_transactions(product_id: str):
             detail=f"Failed to retrieve transactions: {str(e)}"
         )
 
-@app.get("/trace/{product_id}")
+@app.get("/trace/{product_id}", response_model=ProductTraceResponse)
 async def get_product_trace(product_id: str):
     try:
-        # Get product details
-        product = products_collection.find_one({"productId": product_id})
+        # Get product details, restoring archived products
+        product = products_collection.find_one({"productId": product_id}, {"_id": 0}) or tiering.restore(product_id)
         if not product:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Product not found"
             )
         
-        # Convert ObjectId to string
-        product["_id"] = str(product["_id"])
-        
         # Get complete transaction history
-        transactions = list(transactions_collection.find({"productId": product_id}))
-        
-        # Clean transactions for JSON serialization
-        for txn in transactions:
-            txn["_id"] = str(txn["_id"])
+        transactions = history.read_history(product_id)
         
         # Format trace information
         trace = {
@@ -523,6 +1574,156 @@ async def get_product_trace(product_id: str):
             detail=f"Failed to retrieve product trace: {str(e)}"
         )
 
+@app.get("/verify/{product_id}", response_model=ProductVerifyResponse)
+async def verify_product(product_id: str):
+    # Unknown IDs are rejected from memory without touching Mongo or the chain
+    if product_filter is not None and product_id not in product_filter:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"productId": product_id, "authentic": False, "verdict": "unknown"}
+        )
+    
+    try:
+        product = products_collection.find_one(
+            {"productId": product_id},
+            {"_id": 0, "name": 1, "current_owner": 1, "status": 1, "auth_digest": 1}
+        ) or tiering.find_archived(product_id)
+        if not product:
+            # Bloom filter false positive
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={"productId": product_id, "authentic": False, "verdict": "unknown"}
+            )
+        
+        # Products registered before digests were stored fall back to their current fields
+        expected = product.get("auth_digest") or bloom.authenticity_digest(
+            product_id, product.get("name"), product.get("current_owner"), product.get("status")
+        )
+        
+        verdict = "unverified"
+        stale = False
+        if chain:
+            try:
+                on_chain = await view_cache.call("getProduct", product_id)
+                actual = bloom.authenticity_digest(on_chain[0], on_chain[1], on_chain[3], on_chain[4])
+                verdict = "authentic" if actual == expected else "mismatch"
+            except Exception as e:
+                verdict = "not_on_chain" if "does not exist" in str(e) else "unverified"
+                stale = verdict == "unverified"
+        
+        return {
+            "productId": product_id,
+            "authentic": verdict == "authentic",
+            "verdict": verdict,
+            "name": product.get("name"),
+            "current_owner": product.get("current_owner"),
+            "status": product.get("status"),
+            "stale": stale
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to verify product: {str(e)}"
+        )
+
+@app.get("/recall/{batch_id}")
+async def get_recall_impact(batch_id: str, current_user: dict = Depends(get_current_user)):
+    # Every downstream product and handler is listed, so only regulators and
+    # the producer of the batch may see it
+    role = current_user["role"].lower()
+    if role != "regulator" and not (role == "producer" and lineage.produced_batch(batch_id, current_user["username"])):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only regulators and the batch's producer can view its recall impact"
+        )
+    
+    # Streams one JSON line per affected product, then a summary line
+    return StreamingResponse(lineage.stream_recall(batch_id), media_type="application/x-ndjson")
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if startup_state["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if startup_state["ready"] else "not_ready",
+            "startup_seconds": startup_state["startup_seconds"],
+            "startup_budget_seconds": STARTUP_BUDGET_SECONDS,
+            "components": startup_state["components"]
+        }
+    )
+
+@app.get("/stats")
+async def get_stats(
+    metric: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    dim: str = rollups.ALL,
+    granularity: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=1)
+    if granularity and granularity not in rollups.GRANULARITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"granularity must be one of {', '.join(rollups.GRANULARITIES)}"
+        )
+    
+    try:
+        result = {
+            "success": True,
+            "metric": metric,
+            "dim": dim,
+            "start": start,
+            "end": end,
+            "total": rollups.total(metric, start, end, dim)
+        }
+        if granularity:
+            result["series"] = rollups.series(metric, start, end, granularity, dim)
+        return result
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve stats: {str(e)}"
+        )
+
+@app.get("/stats/status")
+async def get_status_stats(current_user: dict = Depends(get_current_user)):
+    try:
+        return {"success": True, "status_counts": rollups.status_counts()}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve stats: {str(e)}"
+        )
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "view_cache": view_cache.stats() if view_cache else None,
+        "chain_breaker": chain_breaker.stats(),
+        "product_filter": product_filter.stats() if product_filter else None,
+        "admission": admission_control.stats()
+    }
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    # Same token that triggers profiling
+    if not profiling.token_matches(request.headers.get("x-profile")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiling token required")
+    try:
+        path = profiling.profile_path(profile_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid profile id")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain")
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Supply Chain Traceability API", "version": "1.0.0"}
@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from models.transaction import Transaction
+
+class Change(BaseModel):
+    seq: int  # position in the feed
+    ts: datetime
+    type: str  # product.created, product.transferred or product.updated
+    productId: str
+    fields: Dict[str, Any]  # product fields set by the change
+    transaction: Optional[Transaction] = None  # history event appended with it
+
+class ChangeFeedResponse(BaseModel):
+    success: bool = True
+    changes: List[Change]
+    next_token: str  # pass as since to continue
+    has_more: bool  # more changes are ready; call again right away
@@ -0,0 +1,36 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+class QuantityTransferRequest(BaseModel):
+    to_holder: str = Field(..., min_length=1)  # username receiving the units
+    amount: int = Field(..., gt=0)
+    note: Optional[str] = ""
+
+class ProductSplitRequest(BaseModel):
+    amount: int = Field(..., gt=0)  # units moved into the new product
+    productId: Optional[str] = Field(None, min_length=1)  # ID of the new product (can be auto-generated)
+    note: Optional[str] = ""
+
+class ProductMergeRequest(BaseModel):
+    parent_ids: List[str] = Field(..., min_length=2)  # every unit the caller holds of each is merged
+    productId: Optional[str] = Field(None, min_length=1)  # ID of the new product (can be auto-generated)
+    note: Optional[str] = ""
+
+class Balance(BaseModel):
+    holder: str
+    quantity: int
+
+class ProductBalancesResponse(BaseModel):
+    success: bool = True
+    productId: str
+    quantity: int  # total units of the product
+    balances: List[Balance]
+
+class Holding(BaseModel):
+    productId: str
+    quantity: int
+
+class HoldingsResponse(BaseModel):
+    success: bool = True
+    holder: str
+    holdings: List[Holding]
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
+
+from models.transaction import Transaction
 
 class Product(BaseModel):
     productId: Optional[str] = None  # blockchain ID (can be auto-generated)
@@ -15,4 +17,115 @@ class Product(BaseModel):
     date_created: Optional[str] = None  # date string, formatted as YYYY-MM-DD
     image_url: Optional[str] = None  # URL to product image if uploaded
     last_updated: Optional[datetime] = None
-    batch_id: Optional[str] = None  # ID of the batch this product belongs to
\ No newline at end of file
+    batch_id: Optional[str] = None  # ID of the batch this product belongs to
+
+class ProductCreate(BaseModel):
+    productId: Optional[str] = None
+    name: str
+    description: Optional[str] = ""
+    category: Optional[str] = ""
+    quantity: int = Field(1, gt=0)  # units held by the creator
+    location: Optional[str] = ""
+    date: Optional[str] = None  # date string, formatted as YYYY-MM-DD
+    image_url: Optional[str] = ""
+    batch_id: Optional[str] = ""
+    parent_ids: Optional[List[str]] = None  # products this one was split or merged from
+    lat: Optional[float] = Field(None, ge=-90, le=90)  # explicit coordinates; otherwise location is geocoded
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+
+class ProductUpdate(BaseModel):
+    status: Optional[str] = None
+    note: Optional[str] = None
+    new_owner: Optional[str] = None  # username of the new owner for transfers
+    new_location: Optional[str] = None
+    quantity: Optional[int] = Field(None, ge=0)
+    lat: Optional[float] = Field(None, ge=-90, le=90)  # explicit coordinates; otherwise new_location is geocoded
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+
+class BatchUpdateItem(ProductUpdate):
+    productId: str
+    idempotency_key: str  # generated by the client, unique per queued update
+    base_updated: Optional[datetime] = None  # last_updated the client saw
+    recorded_at: Optional[datetime] = None  # when the update was made on the device
+
+class BatchUpdateRequest(BaseModel):
+    updates: List[BatchUpdateItem]
+
+class BatchUpdateResult(BaseModel):
+    idempotency_key: str
+    productId: str
+    outcome: str  # applied, duplicate, in_progress, conflict, not_found, deferred or error
+    tx_hash: Optional[str] = None
+    current: Optional[Dict[str, Any]] = None  # server state, for conflicts
+    detail: Optional[str] = None
+
+class BatchUpdateResponse(BaseModel):
+    success: bool = True
+    results: List[BatchUpdateResult]
+    counts: Dict[str, int]
+
+class ProductSummary(BaseModel):
+    productId: str
+    name: str
+    category: Optional[str] = None
+    current_owner: Optional[str] = None
+    status: Optional[str] = None
+    location: Optional[str] = None
+    date_created: Optional[str] = None
+    last_updated: Optional[datetime] = None  # lets offline clients detect conflicting updates
+
+class ProductListResponse(BaseModel):
+    success: bool = True
+    products: List[ProductSummary]
+    change_token: Optional[str] = None  # resume point for /changes
+
+class ProductWriteResponse(BaseModel):
+    success: bool = True
+    message: str
+    product_id: Optional[str] = None
+    tx_hash: Optional[str] = None
+
+class ProductDetailResponse(BaseModel):
+    success: bool = True
+    product: Product
+    blockchain_data: Optional[List[Any]] = None
+    transaction_history: List[Transaction]
+    stale: bool = False  # chain unavailable, served from the database only
+
+class ProductTrace(BaseModel):
+    product: Product
+    history: List[Transaction]
+    origin: Optional[str] = None
+    current_location: Optional[str] = None
+    roles_involved: List[str]
+
+class ProductTraceResponse(BaseModel):
+    success: bool = True
+    trace: ProductTrace
+
+class ProductVerifyResponse(BaseModel):
+    productId: str
+    authentic: bool
+    verdict: str  # authentic, mismatch, unknown, not_on_chain or unverified
+    name: Optional[str] = None
+    current_owner: Optional[str] = None
+    status: Optional[str] = None
+    stale: bool = False  # chain unavailable, the verdict could not be checked
+
+class NearbyProduct(ProductSummary):
+    distance_km: float
+
+class ProductNearResponse(BaseModel):
+    success: bool = True
+    products: List[NearbyProduct]
+
+class RegionVisit(BaseModel):
+    productId: str
+    first_seen: datetime
+    last_seen: datetime
+    fixes: int
+    locations: List[Optional[str]]
+
+class RegionHistoryResponse(BaseModel):
+    success: bool = True
+    products: List[RegionVisit]
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class Transaction(BaseModel):
     productId: str
@@ -10,4 +10,9 @@ class Transaction(BaseModel):
     action: str  # created, transferred, updated, shipped, received, verified
     status: Optional[str] = None  # Product status at this transaction point
     note: Optional[str] = None
-    location: Optional[str] = None
\ No newline at end of file
+    location: Optional[str] = None
+    quantity: Optional[int] = None  # units moved by partial transfers, splits and merges
+
+class TransactionListResponse(BaseModel):
+    success: bool = True
+    transactions: List[Transaction]
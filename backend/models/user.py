@@ -8,4 +8,33 @@ class User(BaseModel):
     role: str  # Producer, Distributor, Retailer, Regulator, Consumer
     email: Optional[EmailStr] = None
     phone: Optional[str] = None
-    registered_at: Optional[datetime] = None
\ No newline at end of file
+    registered_at: Optional[datetime] = None
+
+class UserCreate(BaseModel):
+    username: str
+    password: str
+    role: str
+    email: Optional[str] = ""
+    phone: Optional[str] = ""
+
+class UserProfile(BaseModel):
+    user_id: str
+    username: str
+    role: str
+    email: Optional[str] = None
+    phone: Optional[str] = None
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class AuthResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int  # seconds
+    refresh_token: str
+    refresh_expires_in: int  # seconds
+    user: UserProfile
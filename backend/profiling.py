@@ -0,0 +1,269 @@
+"""Per-request timing breakdown and on-demand sampling profiles.
+
+ProfilingMiddleware puts a RequestTimings object in a context variable for
+each request. Code on the request path records time with span(category);
+MongoDB commands and JSON-RPC calls are recorded by a pymongo command
+listener and a web3 middleware. Categories can nest (auth includes the user
+lookup in Mongo, receipt_wait includes its polling RPC calls), so the
+breakdown is not a partition of the total.
+
+Requests slower than SLOW_REQUEST_MS are appended with their breakdown to
+SLOW_LOG_PATH. A request carrying `X-Profile: <PROFILE_TOKEN>`, or picked
+at PROFILE_SAMPLE_RATE, is also sampled by a stack profiler and the
+collapsed stacks (flamegraph.pl / speedscope input) are stored under
+PROFILE_DIR; the response names the file in an X-Profile-Id header. With
+both features off no context is created and spans return immediately.
+"""
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from dotenv import dotenv_values
+from pymongo import monitoring
+
+config = dotenv_values("../.env")
+SLOW_REQUEST_MS = float(config.get("SLOW_REQUEST_MS", "500"))  # 0 disables the slow log
+SLOW_LOG_PATH = config.get("SLOW_LOG_PATH", "slow-requests.ndjson")
+PROFILE_TOKEN = config.get("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(config.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(config.get("PROFILE_INTERVAL", "0.001"))
+PROFILE_DIR = config.get("PROFILE_DIR", "profiles")
+
+_current = contextvars.ContextVar("request_timings", default=None)
+_log_lock = threading.Lock()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        # (category, seconds, detail); list.append is safe across threads
+        self.records = []
+
+    def add(self, category, seconds, detail=None):
+        self.records.append((category, seconds, detail))
+
+    def breakdown(self):
+        summary = {}
+        rpc_calls = []
+        for category, seconds, detail in self.records:
+            entry = summary.setdefault(category, {"ms": 0.0, "count": 0})
+            entry["ms"] += seconds * 1000
+            entry["count"] += 1
+            if category == "rpc":
+                rpc_calls.append({"method": detail, "ms": round(seconds * 1000, 2)})
+            elif category == "mongo":
+                by_command = entry.setdefault("by_command", {})
+                by_command[detail] = round(by_command.get(detail, 0.0) + seconds * 1000, 2)
+        for entry in summary.values():
+            entry["ms"] = round(entry["ms"], 2)
+        if rpc_calls:
+            summary["rpc"]["calls"] = rpc_calls
+        return summary
+
+
+class _Span:
+    __slots__ = ("timings", "category", "started")
+
+    def __init__(self, timings, category):
+        self.timings = timings
+        self.category = category
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.category, time.perf_counter() - self.started)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(category):
+    timings = _current.get()
+    if timings is None:
+        return _NO_SPAN
+    return _Span(timings, category)
+
+
+def enabled():
+    return SLOW_REQUEST_MS > 0 or PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN)
+
+
+class MongoTimer(monitoring.CommandListener):
+    """Records each MongoDB command against the request that issued it.
+    Callbacks run on the thread that ran the command, so the context
+    variable is the caller's."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        timings = _current.get()
+        if timings is not None:
+            timings.add("mongo", event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+mongo_listener = MongoTimer()
+
+
+# web3 middleware recording every JSON-RPC call, and its AsyncWeb3 twin
+def web3_middleware(make_request, w3):
+    def middleware(method, params):
+        timings = _current.get()
+        if timings is None:
+            return make_request(method, params)
+        started = time.perf_counter()
+        try:
+            return make_request(method, params)
+        finally:
+            timings.add("rpc", time.perf_counter() - started, method)
+    return middleware
+
+
+async def async_web3_middleware(make_request, w3):
+    async def middleware(method, params):
+        timings = _current.get()
+        if timings is None:
+            return await make_request(method, params)
+        started = time.perf_counter()
+        try:
+            return await make_request(method, params)
+        finally:
+            timings.add("rpc", time.perf_counter() - started, method)
+    return middleware
+
+
+class StackSampler:
+    """Samples the event loop thread while the request's task is running
+    and counts collapsed stacks. Time the task spends suspended is not
+    sampled; it shows up in the span breakdown instead."""
+
+    def __init__(self, loop, task, interval=PROFILE_INTERVAL):
+        self.loop = loop
+        self.task = task
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            if asyncio.current_task(self.loop) is not self.task:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def token_matches(value):
+    return bool(PROFILE_TOKEN) and value is not None and hmac.compare_digest(value, PROFILE_TOKEN)
+
+
+def _profile_requested(scope):
+    if PROFILE_TOKEN:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile" and token_matches(value.decode()):
+                return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _write_slow_entry(entry):
+    with _log_lock, open(SLOW_LOG_PATH, "a") as log:
+        log.write(json.dumps(entry) + "\n")
+
+
+def profile_path(profile_id):
+    # Profile ids are generated here; reject anything that could escape PROFILE_DIR
+    if os.path.basename(profile_id) != profile_id or not profile_id.endswith(".folded"):
+        raise ValueError("Invalid profile id")
+    return os.path.join(PROFILE_DIR, profile_id)
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware, so streaming responses are not buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled():
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        sampler = None
+        profile_id = None
+        if _profile_requested(scope):
+            sampler = StackSampler(asyncio.get_running_loop(), asyncio.current_task())
+            profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{scope['method']}-{os.getpid()}.folded"
+            sampler.start()
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profile_id:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - timings.started) * 1000
+            _current.reset(token)
+
+            if sampler:
+                sampler.stop()
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                with open(os.path.join(PROFILE_DIR, profile_id), "w") as file:
+                    file.write(sampler.collapsed())
+
+            if SLOW_REQUEST_MS > 0 and elapsed_ms >= SLOW_REQUEST_MS:
+                _write_slow_entry({
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "total_ms": round(elapsed_ms, 2),
+                    "breakdown": timings.breakdown(),
+                    "profile_id": profile_id,
+                })
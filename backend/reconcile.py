@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Compare MongoDB product state with the SupplyChain contract.
+
+Usage:
+    python reconcile.py [--chunk 500] [--workers 32] [--report drift.ndjson]
+                        [--checkpoint reconcile.checkpoint.json] [--restart]
+                        [--repair] [--every SECONDS]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+
+from db import products_collection
+import blockchain
+import history
+
+
+# Read owner, status and history count for one product from the chain
+def fetch_chain_state(contract, product_id):
+    try:
+        product = contract.functions.getProduct(product_id).call()
+        history_count = contract.functions.getProductHistoryCount(product_id).call()
+    except Exception as e:
+        if "does not exist" in str(e):
+            return {"exists": False}
+        return {"error": str(e)}
+
+    return {
+        "exists": True,
+        "owner": product[3],
+        "status": product[4],
+        "history_count": history_count,
+    }
+
+
+def compare(product, chain_state, mongo_count):
+    product_id = product["productId"]
+    if "error" in chain_state:
+        return [{"productId": product_id, "type": "rpc_error", "detail": chain_state["error"]}]
+    if not chain_state["exists"]:
+        return [{"productId": product_id, "type": "missing_on_chain"}]
+
+    drift = []
+    if product.get("current_owner") != chain_state["owner"]:
+        drift.append({"productId": product_id, "type": "owner_mismatch",
+                      "mongo": product.get("current_owner"), "chain": chain_state["owner"]})
+    if product.get("status") != chain_state["status"]:
+        drift.append({"productId": product_id, "type": "status_mismatch",
+                      "mongo": product.get("status"), "chain": chain_state["status"]})
+    if mongo_count != chain_state["history_count"]:
+        drift.append({"productId": product_id, "type": "history_count_mismatch",
+                      "mongo": mongo_count, "chain": chain_state["history_count"]})
+    return drift
+
+
+# The chain is the source of truth for owner and status; products missing on
+# chain are registered again
+def repair(item, product):
+    if item["type"] == "owner_mismatch":
+        products_collection.update_one({"productId": item["productId"]},
+                                       {"$set": {"current_owner": item["chain"], "last_updated": datetime.utcnow()}})
+        return "mongo_owner_updated"
+    if item["type"] == "status_mismatch":
+        products_collection.update_one({"productId": item["productId"]},
+                                       {"$set": {"status": item["chain"], "last_updated": datetime.utcnow()}})
+        return "mongo_status_updated"
+    if item["type"] == "missing_on_chain":
+        tx_hash, error = blockchain.add_product(product["productId"], product.get("name", ""), product.get("current_owner", ""))
+        return f"registered_on_chain:{tx_hash}" if tx_hash else f"repair_failed:{error}"
+    return None
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"last_id": None, "scanned": 0, "drift": 0}
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def run(chunk_size=500, workers=32, report_path="drift.ndjson", checkpoint_path="reconcile.checkpoint.json",
+        restart=False, apply_repairs=False):
+    contract = blockchain.load_contract()
+    if not contract:
+        raise RuntimeError("Contract not loaded")
+
+    checkpoint = {"last_id": None, "scanned": 0, "drift": 0} if restart else load_checkpoint(checkpoint_path)
+    started = time.time()
+
+    with open(report_path, "w" if restart or not checkpoint["last_id"] else "a") as report, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            query = {}
+            if checkpoint["last_id"]:
+                query["_id"] = {"$gt": ObjectId(checkpoint["last_id"])}
+            chunk = list(products_collection.find(
+                query, {"productId": 1, "name": 1, "current_owner": 1, "status": 1}
+            ).sort("_id", 1).limit(chunk_size))
+            if not chunk:
+                break
+
+            product_ids = [p["productId"] for p in chunk]
+            chain_states = list(pool.map(lambda pid: fetch_chain_state(contract, pid), product_ids))
+            mongo_counts = history.history_counts(product_ids)
+
+            for product, chain_state in zip(chunk, chain_states):
+                for item in compare(product, chain_state, mongo_counts[product["productId"]]):
+                    if apply_repairs:
+                        item["repair"] = repair(item, product)
+                    report.write(json.dumps(item) + "\n")
+                    checkpoint["drift"] += 1
+
+            report.flush()
+            checkpoint["last_id"] = str(chunk[-1]["_id"])
+            checkpoint["scanned"] += len(chunk)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = time.time() - started
+            print(f"Scanned {checkpoint['scanned']} products, {checkpoint['drift']} drift items "
+                  f"({len(chunk) / max(elapsed, 1e-9):.0f}/s last chunk)")
+            started = time.time()
+
+    # A completed pass starts from the beginning next time
+    summary = dict(checkpoint)
+    save_checkpoint(checkpoint_path, {"last_id": None, "scanned": 0, "drift": 0})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB products with on-chain state")
+    parser.add_argument("--chunk", type=int, default=500, help="Products read from Mongo per batch")
+    parser.add_argument("--workers", type=int, default=32, help="Concurrent RPC reads")
+    parser.add_argument("--report", default="drift.ndjson", help="Drift report path")
+    parser.add_argument("--checkpoint", default="reconcile.checkpoint.json", help="Checkpoint path")
+    parser.add_argument("--restart", action="store_true", help="Ignore any saved checkpoint")
+    parser.add_argument("--repair", action="store_true", help="Apply repair actions for detected drift")
+    parser.add_argument("--every", type=int, default=0, help="Repeat every N seconds")
+    args = parser.parse_args()
+
+    while True:
+        summary = run(args.chunk, args.workers, args.report, args.checkpoint, args.restart, args.repair)
+        print(f"Reconciliation finished: {summary['scanned']} products, {summary['drift']} drift items")
+        if not args.every:
+            break
+        args.restart = False
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import orjson
+from bson import ObjectId
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+import profiling
+
+# MessagePack is optional; without it clients always get JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson. datetime is handled natively and
+    ObjectId is written as its hex string."""
+
+    def render(self, content):
+        with profiling.span("serialization"):
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content):
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def wants_msgpack(request: Request):
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+# Serialize a response model straight from pydantic-core, as MessagePack
+# when the client asks for it. Gzip is applied by the middleware.
+def negotiate(request: Request, model):
+    with profiling.span("serialization"):
+        if wants_msgpack(request):
+            return MsgPackResponse(model.model_dump(mode="json"))
+        return Response(content=model.model_dump_json(), media_type="application/json")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Pre-aggregated activity counters.
+
+Every write increments minute, hour and day counters per metric and
+dimension, plus gauges for the number of products in each status. Range
+queries combine the coarsest buckets that fit, so their cost depends on the
+length of the range and not on the number of events. Usage:
+    python rollups.py --backfill
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from db import products_collection, rollups_collection
+import history
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# History actions and the metric they are counted under
+ACTION_METRICS = {
+    "created": "products_created",
+    "transferred": "transfers",
+    "updated": "updates",
+}
+
+ALL = "*"
+
+
+def ensure_indexes():
+    rollups_collection.create_index([("metric", 1), ("dim", 1), ("granularity", 1), ("start", 1)], unique=True)
+
+
+def floor(ts, granularity):
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _counter_ops(metric, dims, ts, amount=1):
+    return [
+        UpdateOne(
+            {"metric": metric, "dim": dim, "granularity": granularity, "start": floor(ts, granularity)},
+            {"$inc": {"count": amount}},
+            upsert=True
+        )
+        for granularity in GRANULARITIES
+        for dim in dims
+    ]
+
+
+def _gauge_op(status, amount):
+    return UpdateOne(
+        {"metric": "status", "dim": f"status:{status}", "granularity": "current", "start": None},
+        {"$inc": {"count": amount}},
+        upsert=True
+    )
+
+
+def event_ops(event, old_status=None, new_status=None):
+    ops = []
+    metric = ACTION_METRICS.get(event.get("action"))
+    if metric:
+        # Transfers are attributed to the sender, everything else to the actor
+        user = event.get("from_user")
+        ops += _counter_ops(metric, [ALL, f"user:{user}"], event["timestamp"])
+    if new_status and new_status != old_status:
+        if old_status:
+            ops.append(_gauge_op(old_status, -1))
+        ops.append(_gauge_op(new_status, 1))
+    return ops
+
+
+# Count a history event and an optional status change in one round trip
+def record(event, old_status=None, new_status=None):
+    ops = event_ops(event, old_status, new_status)
+    if ops:
+        rollups_collection.bulk_write(ops, ordered=False)
+
+
+# Split [start, end) into the fewest aligned minute/hour/day buckets
+def decompose(start, end):
+    pieces = []
+    t = floor(start, "minute")
+    while t < end:
+        for granularity in ("day", "hour", "minute"):
+            step = GRANULARITIES[granularity]
+            if floor(t, granularity) == t and (t + step <= end or granularity == "minute"):
+                pieces.append((granularity, t))
+                t += step
+                break
+    return pieces
+
+
+def total(metric, start, end, dim=ALL):
+    pieces = decompose(start, end)
+    if not pieces:
+        return 0
+
+    by_granularity = {}
+    for granularity, bucket_start in pieces:
+        by_granularity.setdefault(granularity, []).append(bucket_start)
+
+    rows = rollups_collection.aggregate([
+        {"$match": {
+            "metric": metric,
+            "dim": dim,
+            "$or": [{"granularity": g, "start": {"$in": starts}} for g, starts in by_granularity.items()],
+        }},
+        {"$group": {"_id": None, "count": {"$sum": "$count"}}},
+    ])
+    row = next(rows, None)
+    return row["count"] if row else 0
+
+
+def series(metric, start, end, granularity, dim=ALL):
+    cursor = rollups_collection.find(
+        {"metric": metric, "dim": dim, "granularity": granularity,
+         "start": {"$gte": floor(start, granularity), "$lt": end}},
+        {"_id": 0, "start": 1, "count": 1}
+    ).sort("start", 1)
+    return [{"start": row["start"], "count": row["count"]} for row in cursor]
+
+
+def status_counts():
+    return {
+        row["dim"].split(":", 1)[1]: row["count"]
+        for row in rollups_collection.find({"metric": "status", "granularity": "current"}, {"_id": 0})
+        if row["count"]
+    }
+
+
+# Rebuild all counters from the stored history and current product statuses
+def backfill(batch_size=1000):
+    rollups_collection.delete_many({})
+
+    ops = []
+    for event in history.iter_events():
+        ops += event_ops(event)
+        if len(ops) >= batch_size:
+            rollups_collection.bulk_write(ops, ordered=False)
+            ops = []
+
+    for row in products_collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        if row["_id"]:
+            ops.append(_gauge_op(row["_id"], row["count"]))
+
+    if ops:
+        rollups_collection.bulk_write(ops, ordered=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Activity rollup maintenance")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild counters from existing history")
+    args = parser.parse_args()
+
+    if args.backfill:
+        ensure_indexes()
+        started = datetime.utcnow()
+        backfill()
+        print(f"Backfill completed in {(datetime.utcnow() - started).total_seconds():.1f}s")
+    else:
+        parser.print_help()
@@ -0,0 +1,148 @@
+import base64
+import json
+
+from db import products_collection
+
+# Fields returned for each search hit
+RESULT_FIELDS = {
+    "_id": 0,
+    "productId": 1,
+    "name": 1,
+    "category": 1,
+    "location": 1,
+    "status": 1,
+    "current_owner": 1,
+    "date_created": 1,
+    "batch_id": 1,
+}
+
+FACET_FIELDS = ["category", "status", "location"]
+
+# Number of values returned per facet
+FACET_LIMIT = 20
+
+MAX_LIMIT = 100
+
+
+# Create the text and compound indexes the search relies on
+def ensure_indexes():
+    products_collection.create_index(
+        [("name", "text"), ("category", "text"), ("location", "text"), ("description", "text")],
+        weights={"name": 10, "category": 5, "location": 3, "description": 1},
+        name="product_text",
+    )
+    products_collection.create_index([("category", 1), ("status", 1), ("date_created", -1), ("productId", 1)])
+    products_collection.create_index([("status", 1), ("date_created", -1), ("productId", 1)])
+    products_collection.create_index([("location", 1), ("date_created", -1), ("productId", 1)])
+    products_collection.create_index([("date_created", -1), ("productId", 1)])
+    # Searches of producers, distributors and retailers are scoped to their products
+    products_collection.create_index([("current_owner", 1), ("date_created", -1), ("productId", 1)])
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def build_filter(q=None, category=None, status=None, location=None, date_from=None, date_to=None):
+    match = {}
+    if q:
+        match["$text"] = {"$search": q}
+    if category:
+        match["category"] = category
+    if status:
+        match["status"] = status
+    if location:
+        match["location"] = location
+    if date_from or date_to:
+        # date_created is stored as YYYY-MM-DD so string comparison is ordered
+        match["date_created"] = {}
+        if date_from:
+            match["date_created"]["$gte"] = date_from
+        if date_to:
+            match["date_created"]["$lte"] = date_to
+    return match
+
+
+# Keyset condition continuing after the last hit of the previous page
+def _after(cursor, ranked):
+    if ranked:
+        score, product_id = cursor
+        return {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "productId": {"$gt": product_id}},
+        ]}
+    date_created, product_id = cursor
+    # Products without date_created sort after every dated one; a range
+    # query on the field never matches them, so they are added explicitly
+    if date_created is None:
+        return {"date_created": None, "productId": {"$gt": product_id}}
+    return {"$or": [
+        {"date_created": {"$lt": date_created}},
+        {"date_created": date_created, "productId": {"$gt": product_id}},
+        {"date_created": None},
+    ]}
+
+
+# scope restricts hits and facets to the products the caller may see
+def search_products(q=None, category=None, status=None, location=None, date_from=None, date_to=None,
+                    limit=20, cursor=None, facets=False, scope=None):
+    limit = max(1, min(limit, MAX_LIMIT))
+    match = {**(scope or {}), **build_filter(q, category, status, location, date_from, date_to)}
+    ranked = bool(q)
+
+    pipeline = [{"$match": match}]
+    if ranked:
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    if cursor:
+        pipeline.append({"$match": _after(decode_cursor(cursor), ranked)})
+    if ranked:
+        pipeline.append({"$sort": {"score": -1, "productId": 1}})
+    else:
+        pipeline.append({"$sort": {"date_created": -1, "productId": 1}})
+    # Fetch one extra hit to know whether another page exists
+    pipeline.append({"$limit": limit + 1})
+    projection = dict(RESULT_FIELDS)
+    if ranked:
+        projection["score"] = 1
+    pipeline.append({"$project": projection})
+
+    hits = list(products_collection.aggregate(pipeline))
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last = hits[-1]
+        if ranked:
+            next_cursor = encode_cursor([last["score"], last["productId"]])
+        else:
+            next_cursor = encode_cursor([last.get("date_created"), last["productId"]])
+
+    result = {"results": hits, "next_cursor": next_cursor}
+    # Facets cover every match, so they cost a scan of the whole result set;
+    # they are opt-in and only computed for the first page
+    if facets and not cursor:
+        result["facets"] = facet_counts(match)
+    return result
+
+
+def facet_counts(match):
+    facet_stages = {
+        field: [{"$sortByCount": f"${field}"}, {"$limit": FACET_LIMIT}]
+        for field in FACET_FIELDS
+    }
+    facet_stages["total"] = [{"$count": "count"}]
+
+    doc = next(products_collection.aggregate([{"$match": match}, {"$facet": facet_stages}]), {})
+    counts = {
+        field: [{"value": f["_id"], "count": f["count"]} for f in doc.get(field, [])]
+        for field in FACET_FIELDS
+    }
+    total = doc.get("total", [])
+    counts["total"] = total[0]["count"] if total else 0
+    return counts
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Production serving mode: a coordinator process plus N uvicorn workers.
+
+Usage:
+    python serve.py [--workers 4] [--host 127.0.0.1] [--port 8000]
+                    [--coordinator /tmp/supplychain-coordinator.sock]
+"""
+import argparse
+import os
+import secrets
+
+import uvicorn
+
+import coordinator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with multiple worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--coordinator", default=f"/tmp/supplychain-coordinator-{os.getpid()}.sock",
+                        help="Unix socket path or host:port for the coordinator")
+    args = parser.parse_args()
+
+    # Workers inherit the coordinator address and key through the environment
+    manager = coordinator.start(args.coordinator, secrets.token_hex(16), workers=args.workers)
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""Point-in-time snapshots of the product read model.
+
+A snapshot is a directory holding, per collection, a data file of
+zlib-compressed blocks of BSON documents, memory-mapped for reading, and
+a fixed-width block index that is parsed once per reader. Documents are written in key order
+(productId for most collections) and each index entry carries the first
+and last key of its block, so a single product can be read from a
+snapshot by decompressing one block. The manifest records the chain block
+number and hash the snapshot corresponds to.
+
+A new instance is bootstrapped by restoring a snapshot and then catching
+up from its block: contract transactions in later blocks are decoded and
+applied to the read model, skipping those whose tx hash is already in a
+product's history. Usage:
+    python snapshot.py --export [--dir snapshots]
+    python snapshot.py --restore snapshots/<name> [--drop] [--force] [--margin 128]
+    python snapshot.py --catch-up
+    python snapshot.py --info snapshots/<name>
+"""
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import zlib
+from bisect import bisect_left
+from datetime import datetime
+
+import bson
+from pymongo.errors import OperationFailure
+
+from db import DB_NAME, db, get_client, history_collection, products_collection
+import bloom
+import blockchain
+import changes
+import geo
+import history
+import ledger
+import lineage
+import rollups
+import tiering
+
+FORMAT_VERSION = 1
+SNAPSHOT_DIR = "snapshots"
+BLOCK_DOCS = 1000
+COMPRESSION_LEVEL = 6
+
+# Catch-up after a restore starts this many blocks before the snapshot's
+# head: a transaction mined before the head whose database write landed
+# after the collections were read is in neither otherwise. Transactions
+# replayed twice are skipped by their tx hash.
+CATCH_UP_MARGIN_BLOCKS = 128
+
+# Collection -> field the documents are ordered and indexed by (None: unordered)
+COLLECTIONS = {
+    "products": "productId",
+    "history_buckets": "productId",
+    "transactions": "productId",
+    "products_archive": "_id",
+    "location_history": "productId",
+    "lineage_edges": "src",
+    "ledger": "productId",
+    "balances": "productId",
+    "stats_rollups": None,
+    # Restored with the feed so clients' change tokens stay valid
+    "changes": None,
+    "counters": None,
+}
+
+# Index entry: offset, compressed length, document count, first key, last key
+KEY_BYTES = 48
+INDEX_ENTRY = struct.Struct(f"<QII{KEY_BYTES}s{KEY_BYTES}s")
+
+# Where this instance's read model is relative to the chain
+SYNC_STATE_ID = "snapshot_sync"
+
+
+def _key(value):
+    # Truncation and NUL padding keep the byte order of string keys
+    return str(value).encode()[:KEY_BYTES].ljust(KEY_BYTES, b"\0") if value is not None else b"\0" * KEY_BYTES
+
+
+def chain_head():
+    block = blockchain.get_chain().w3.eth.get_block("latest")
+    return {"block_number": block.number, "block_hash": block.hash.hex(), "block_timestamp": block.timestamp}
+
+
+# ------------------ Export ------------------
+
+def _write_collection(path, name, key_field, session):
+    cursor = db[name].find({}, session=session)
+    if key_field:
+        cursor = cursor.sort(key_field, 1)
+
+    blocks = docs = 0
+    with open(os.path.join(path, f"{name}.dat"), "wb") as data, open(os.path.join(path, f"{name}.idx"), "wb") as index:
+        pending = []
+
+        def flush():
+            nonlocal blocks
+            payload = zlib.compress(b"".join(bson.encode(doc) for doc in pending), COMPRESSION_LEVEL)
+            first = _key(pending[0].get(key_field)) if key_field else _key(None)
+            last = _key(pending[-1].get(key_field)) if key_field else _key(None)
+            index.write(INDEX_ENTRY.pack(data.tell(), len(payload), len(pending), first, last))
+            data.write(payload)
+            blocks += 1
+            pending.clear()
+
+        for doc in cursor:
+            pending.append(doc)
+            docs += 1
+            if len(pending) >= BLOCK_DOCS:
+                flush()
+        if pending:
+            flush()
+    return {"key": key_field, "blocks": blocks, "docs": docs}
+
+
+# Write a snapshot of the read model tagged with the chain head. All
+# collections are read in one snapshot session, so they are mutually
+# consistent; servers without snapshot reads (standalone mongod) are read
+# without one. The head is taken first: writes still in flight are in the
+# snapshot and are recognised as applied during catch-up, which starts
+# CATCH_UP_MARGIN_BLOCKS before the head to pick up writes that landed late.
+def export(out_dir=SNAPSHOT_DIR):
+    head = chain_head()
+    name = f"{head['block_number']:012d}-{head['block_hash'][2:10]}"
+    final_path = os.path.join(out_dir, name)
+    tmp_path = final_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        **head,
+        "database": DB_NAME,
+        "created_at": datetime.utcnow().isoformat(),
+        "collections": {},
+    }
+    try:
+        with get_client().start_session(snapshot=True) as session:
+            for collection, key_field in COLLECTIONS.items():
+                manifest["collections"][collection] = _write_collection(tmp_path, collection, key_field, session)
+    except OperationFailure as e:
+        print(f"Warning: snapshot reads not available ({e}), exporting without a read snapshot")
+        manifest["consistent"] = False
+        for collection, key_field in COLLECTIONS.items():
+            manifest["collections"][collection] = _write_collection(tmp_path, collection, key_field, None)
+
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, final_path)
+    return final_path, manifest
+
+
+# ------------------ Reading ------------------
+
+class Snapshot:
+    """Read access to an exported snapshot. Data files are memory-mapped and
+    blocks are decompressed on demand; each index is parsed once, on first
+    use, and kept."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as file:
+            self.manifest = json.load(file)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {self.manifest.get('format')}")
+        self._maps = {}
+        self._indexes = {}
+
+    def _mapped(self, filename):
+        if filename not in self._maps:
+            file = open(os.path.join(self.path, filename), "rb")
+            # mmap rejects empty files
+            if os.fstat(file.fileno()).st_size == 0:
+                self._maps[filename] = b""
+            else:
+                self._maps[filename] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            file.close()
+        return self._maps[filename]
+
+    # (index entries, last keys) of a collection
+    def _index(self, collection):
+        if collection not in self._indexes:
+            with open(os.path.join(self.path, f"{collection}.idx"), "rb") as file:
+                index = file.read()
+            entries = [INDEX_ENTRY.unpack_from(index, i) for i in range(0, len(index), INDEX_ENTRY.size)]
+            self._indexes[collection] = (entries, [entry[4] for entry in entries])
+        return self._indexes[collection]
+
+    def _entries(self, collection):
+        return self._index(collection)[0]
+
+    def _block(self, collection, entry):
+        offset, length = entry[0], entry[1]
+        data = self._mapped(f"{collection}.dat")
+        return bson.decode_all(zlib.decompress(data[offset:offset + length]))
+
+    def iter_blocks(self, collection):
+        for entry in self._entries(collection):
+            yield self._block(collection, entry)
+
+    # Documents of an ordered collection whose key equals value
+    def find(self, collection, value):
+        key_field = self.manifest["collections"][collection]["key"]
+        if not key_field:
+            raise ValueError(f"{collection} is not ordered by a key")
+        entries, last_keys = self._index(collection)
+        key = _key(value)
+        start = bisect_left(last_keys, key)
+        found = []
+        for entry in entries[start:]:
+            if entry[3] > key:
+                break
+            found += [doc for doc in self._block(collection, entry) if doc.get(key_field) == value]
+        return found
+
+    def close(self):
+        for mapped in self._maps.values():
+            if mapped:
+                mapped.close()
+        self._maps.clear()
+        self._indexes.clear()
+
+
+# ------------------ Restore and catch-up ------------------
+
+def sync_state():
+    return db["migrations"].find_one({"_id": SYNC_STATE_ID})
+
+
+def _save_sync_state(block_number, block_hash):
+    db["migrations"].update_one({"_id": SYNC_STATE_ID},
+                                {"$set": {"block_number": block_number, "block_hash": block_hash,
+                                          "updated_at": datetime.utcnow()}},
+                                upsert=True)
+
+
+def ensure_indexes():
+    from db import ensure_indexes as db_indexes
+    import search
+
+    db_indexes()
+    search.ensure_indexes()
+    history.ensure_indexes()
+    rollups.ensure_indexes()
+    tiering.ensure_indexes()
+    geo.ensure_indexes()
+    changes.ensure_indexes()
+    ledger.ensure_indexes()
+
+
+# Load a snapshot into this instance's database and catch up from its
+# block. Refuses to overwrite a non-empty read model unless drop is set, and
+# to load a snapshot whose block is not on this chain unless force is set.
+def restore(path, drop=False, force=False, catch_up_after=True, margin=CATCH_UP_MARGIN_BLOCKS):
+    snapshot = Snapshot(path)
+    manifest = snapshot.manifest
+
+    chain = blockchain.get_chain()
+    try:
+        block = chain.w3.eth.get_block(manifest["block_number"])
+        on_chain = block.hash.hex() == manifest["block_hash"]
+    except Exception:
+        on_chain = False
+    if not on_chain and not force:
+        raise RuntimeError(f"Block {manifest['block_number']} {manifest['block_hash']} is not on this chain")
+
+    for collection in COLLECTIONS:
+        if db[collection].estimated_document_count():
+            if not drop:
+                raise RuntimeError(f"{collection} is not empty, pass drop to replace it")
+            db[collection].drop()
+
+    try:
+        for collection in manifest["collections"]:
+            for docs in snapshot.iter_blocks(collection):
+                db[collection].insert_many(docs, ordered=False)
+            print(f"Restored {manifest['collections'][collection]['docs']} {collection} documents")
+    finally:
+        snapshot.close()
+
+    ensure_indexes()
+    start = max(0, manifest["block_number"] - margin)
+    start_hash = manifest["block_hash"]
+    if start != manifest["block_number"]:
+        try:
+            start_hash = chain.w3.eth.get_block(start).hash.hex()
+        except Exception:
+            print(f"Warning: could not read block {start}, catching up from the snapshot block")
+            start = manifest["block_number"]
+    _save_sync_state(start, start_hash)
+    if catch_up_after:
+        return catch_up()
+    return 0
+
+
+def _already_applied(product_id, tx_hash):
+    return history_collection.find_one({"productId": product_id, "events.tx_hashes": tx_hash}, {"_id": 1}) is not None
+
+
+# Read-model changes for one decoded contract call, in the same shape the
+# API writes them. Returns (product $set fields, history event).
+def _changes(fn_name, args, product, timestamp):
+    owner = product.get("current_owner")
+    note = args.get("_note", "")
+    fields = {}
+    action = "updated"
+
+    if fn_name == "transferProduct":
+        fields = {"current_owner": args["_newOwner"], "status": args["_newStatus"]}
+        action = "transferred"
+    elif fn_name == "updateProductStatus":
+        fields = {"status": args["_newStatus"]}
+    elif fn_name in ("updateProductLocation", "updateProductLocationGeo"):
+        fields = {"location": args["_newLocation"]}
+    elif fn_name == "updateProductAvailability":
+        fields = {"status": args["_availability"], "price": args["_price"]}
+    elif fn_name == "updateProductDetails":
+        fields = {key.lstrip("_"): value for key, value in args.items() if key != "_productId"}
+    elif fn_name == "updateProduct":
+        mask = args["_mask"]
+        if mask & blockchain.UPDATE_OWNER:
+            fields["current_owner"] = args["_newOwner"]
+            action = "transferred"
+        if mask & blockchain.UPDATE_STATUS:
+            fields["status"] = args["_newStatus"]
+        if mask & blockchain.UPDATE_LOCATION:
+            fields["location"] = args["_newLocation"]
+        if mask & blockchain.UPDATE_QUANTITY:
+            fields["quantity"] = args["_quantity"]
+    else:
+        return None, None
+
+    event = {
+        "productId": product["productId"],
+        "from_user": owner,
+        "to_user": fields.get("current_owner", owner),
+        "timestamp": timestamp,
+        "action": action,
+        "note": note,
+    }
+    if "location" in fields:
+        event["location"] = fields["location"]
+    return fields, event
+
+
+def _position(fn_name, args):
+    if fn_name == "updateProductLocationGeo" or (fn_name == "updateProduct" and args["_mask"] & blockchain.UPDATE_POSITION):
+        return args["_latE6"] / 1e6, args["_lonE6"] / 1e6
+    return None
+
+
+# Splits and merges create a product, so one whose product is already in
+# the read model was applied by the API
+def _apply_derivation(fn_name, args, tx_hash, timestamp):
+    child_id = args["_childId"]
+    if products_collection.find_one({"productId": child_id}, {"_id": 1}) or tiering.find_archived(child_id):
+        return False
+
+    parents = []
+    for parent_id in ([args["_parentId"]] if fn_name == "splitProduct" else args["_parentIds"]):
+        parent = products_collection.find_one({"productId": parent_id}) or tiering.restore(parent_id)
+        if not parent:
+            print(f"Warning: {fn_name} of unknown product {parent_id} in {tx_hash}")
+            return False
+        ledger.ensure_seeded(parent, timestamp)
+        parents.append(parent)
+
+    holder = args["_holder"]
+    if fn_name == "splitProduct":
+        ledger.record_derivation("split", [(parents[0], args["_amount"])], child_id, holder, args["_status"],
+                                 args["_note"], timestamp, tx_hash, debited=False)
+    else:
+        # The contract merges everything the holder had of each product
+        parts = [(parent, ledger.take_all(parent["productId"], holder)) for parent in parents]
+        ledger.record_derivation("merge", parts, child_id, holder, args["_status"], args["_note"],
+                                 timestamp, tx_hash, debited=True)
+    return True
+
+
+def apply_transaction(fn_name, args, tx_hash, timestamp):
+    if fn_name in ("splitProduct", "mergeProducts"):
+        return _apply_derivation(fn_name, args, tx_hash, timestamp)
+    product_id = args.get("_productId")
+    if product_id is None:
+        return False
+
+    if fn_name in ("addProduct", "addProductLot"):
+        # Products already in the read model were added by the API, which
+        # records the same fields
+        if products_collection.find_one({"productId": product_id}, {"_id": 1}) or tiering.find_archived(product_id):
+            return False
+        quantity = args.get("_quantity", 1)
+        product = {
+            "productId": product_id,
+            "name": args["_name"],
+            "quantity": quantity,
+            "current_owner": args["_owner"],
+            "status": "Produced",
+            "location": "",
+            "last_updated": timestamp,
+            "auth_digest": bloom.authenticity_digest(product_id, args["_name"], args["_owner"], "Produced"),
+            "ledger": True,
+        }
+        event = {"from_user": args["_owner"], "to_user": args["_owner"], "timestamp": timestamp,
+                 "action": "created", "note": "Product created and registered", "tx_hashes": [tx_hash]}
+        history.record(product_id, event, product_insert=product,
+                       change=changes.build("product.created", product_id, product, event))
+        ledger.post([ledger.entry(product_id, "mint", None, args["_owner"], quantity, timestamp, tx_hash=tx_hash)])
+        rollups.record(event, new_status="Produced")
+        lineage.record_handler(product_id, args["_owner"])
+        return True
+
+    # An archived product's history is only searchable once restored
+    product = products_collection.find_one({"productId": product_id}) or tiering.restore(product_id)
+    if not product:
+        print(f"Warning: {fn_name} for unknown product {product_id} in {tx_hash}")
+        return False
+    if _already_applied(product_id, tx_hash):
+        return False
+
+    if fn_name == "transferQuantity":
+        ledger.ensure_seeded(product, timestamp)
+        ledger.record_transfer(product, args["_from"], args["_to"], args["_amount"], args["_note"],
+                               timestamp, tx_hash, debited=False)
+        return True
+
+    fields, event = _changes(fn_name, args, product, timestamp)
+    if event is None:
+        return False
+    event["tx_hashes"] = [tx_hash]
+    fields["last_updated"] = timestamp
+    if "status" in fields or "current_owner" in fields:
+        fields["auth_digest"] = bloom.authenticity_digest(
+            product_id, product.get("name"), fields.get("current_owner", product.get("current_owner")),
+            fields.get("status", product.get("status"))
+        )
+    coords = _position(fn_name, args)
+    if coords:
+        fields["position"] = geo.point(*coords)
+
+    change = changes.build("product." + event["action"], product_id, fields, event)
+    history.record(product_id, event, product_update={"$set": fields}, change=change)
+    ledger.record_update(product, fields, timestamp, tx_hash)
+    rollups.record(event, old_status=product.get("status"), new_status=fields.get("status"))
+    lineage.record_handler(product_id, event["to_user"])
+    if coords:
+        geo.record_fix(product_id, *coords, location=fields.get("location", product.get("location")),
+                       owner=event["to_user"], ts=timestamp)
+    return True
+
+
+# Apply contract transactions from the blocks after the last synced one up
+# to the current head. Progress is saved per block, so it can be resumed.
+def catch_up(to_block=None):
+    state = sync_state()
+    if not state:
+        raise RuntimeError("No snapshot has been restored into this database")
+
+    chain = blockchain.get_chain()
+    w3, contract = chain.w3, chain.contract
+    head = to_block if to_block is not None else w3.eth.block_number
+
+    applied = 0
+    for number in range(state["block_number"] + 1, head + 1):
+        block = w3.eth.get_block(number, full_transactions=True)
+        timestamp = datetime.utcfromtimestamp(block.timestamp)
+        for tx in block.transactions:
+            if tx["to"] != contract.address:
+                continue
+            # Reverted transactions changed nothing
+            if w3.eth.get_transaction_receipt(tx["hash"]).status != 1:
+                continue
+            # eth-tester names the call data "data" rather than "input"
+            try:
+                fn, args = contract.decode_function_input(tx.get("input", tx.get("data")))
+            except ValueError:
+                continue
+            if apply_transaction(fn.fn_name, args, tx["hash"].hex(), timestamp):
+                applied += 1
+        _save_sync_state(number, block.hash.hex())
+        if number % 1000 == 0:
+            print(f"Caught up to block {number}/{head}, {applied} transactions applied")
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-model snapshots")
+    parser.add_argument("--export", action="store_true", help="Write a snapshot of the read model")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="Directory snapshots are written to")
+    parser.add_argument("--restore", metavar="PATH", help="Load a snapshot and catch up from its block")
+    parser.add_argument("--drop", action="store_true", help="Replace a non-empty read model on restore")
+    parser.add_argument("--margin", type=int, default=CATCH_UP_MARGIN_BLOCKS,
+                        help="Blocks before the snapshot block to start catching up from")
+    parser.add_argument("--force", action="store_true", help="Restore even if the snapshot block is not on this chain")
+    parser.add_argument("--catch-up", action="store_true", help="Apply transactions since the last synced block")
+    parser.add_argument("--info", metavar="PATH", help="Print a snapshot manifest")
+    args = parser.parse_args()
+
+    if args.export:
+        path, manifest = export(args.dir)
+        docs = sum(entry["docs"] for entry in manifest["collections"].values())
+        print(f"Wrote {docs} documents at block {manifest['block_number']} to {path}")
+    elif args.restore:
+        print(f"Applied {restore(args.restore, drop=args.drop, force=args.force, margin=args.margin)} transactions after the snapshot")
+    elif args.catch_up:
+        print(f"Applied {catch_up()} transactions")
+    elif args.info:
+        print(json.dumps(Snapshot(args.info).manifest, indent=2))
+    else:
+        parser.print_help()
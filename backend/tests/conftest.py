@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# In-memory MongoDB for modules that go through db's lazy collections
+@pytest.fixture
+def mongo(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    import db
+    import history
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(db, "_client", client)
+    monkeypatch.setattr(history, "_client_bulk_write", None)
+    monkeypatch.setattr(history, "_migrated", False)
+    monkeypatch.setattr(history, "_migration_checked_at", 0.0)
+    return client[db.DB_NAME]
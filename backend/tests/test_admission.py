@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+import admission
+
+
+def test_bucket_charges_full_cost_above_capacity():
+    bucket = admission.TokenBucket(rate=1, capacity=10)
+    assert bucket.take(25) == 0
+    assert bucket.tokens == pytest.approx(-15, abs=0.01)
+    # The debt has to be refilled before anything else gets through
+    assert bucket.take(1) == pytest.approx(16, abs=0.01)
+
+
+def test_bucket_large_cost_waits_for_full_bucket():
+    bucket = admission.TokenBucket(rate=2, capacity=10)
+    bucket.take(4)
+    assert bucket.take(25) == pytest.approx(2, abs=0.01)
+
+
+def test_give_back_is_capped_at_capacity():
+    bucket = admission.TokenBucket(rate=1, capacity=10)
+    bucket.take(25)
+    bucket.give_back(40)
+    assert bucket.tokens == 10
+
+
+def test_check_rejects_with_retry_after():
+    controller = admission.AdmissionController(user_rate=1, user_burst=2)
+    controller.check("alice", cost=2)
+    with pytest.raises(HTTPException) as excinfo:
+        controller.check("alice")
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+    # Other users have their own bucket
+    controller.check("bob")
+
+
+def test_batch_cost_counts_against_global_bucket():
+    controller = admission.AdmissionController(global_rate=1, global_burst=10, user_burst=1000)
+    controller.check("alice", cost=40)
+    with pytest.raises(HTTPException) as excinfo:
+        controller.check("bob")
+    assert excinfo.value.status_code == 429
+
+
+def test_refund_returns_unused_tokens():
+    controller = admission.AdmissionController(user_rate=0.001, user_burst=5)
+    controller.check("alice", cost=5)
+    controller.refund("alice", 3)
+    controller.check("alice", cost=3)
+
+
+def test_slots_bound_in_flight_writes():
+    controller = admission.AdmissionController(max_in_flight=1, max_queued=0)
+
+    async def scenario():
+        await controller.acquire_slot()
+        with pytest.raises(HTTPException) as excinfo:
+            await controller.acquire_slot()
+        assert excinfo.value.status_code == 503
+        controller.release()
+        await controller.acquire_slot()
+        controller.release()
+
+    asyncio.run(scenario())
+    assert controller.stats()["in_flight"] == 0
+    assert controller.stats()["admitted"] == 2
+
+
+def test_rejected_slot_refunds_tokens():
+    controller = admission.AdmissionController(user_rate=0.001, user_burst=1, max_in_flight=1, max_queued=0)
+
+    async def scenario():
+        await controller.acquire_slot()
+        with pytest.raises(HTTPException):
+            await controller.acquire("alice")
+        controller.release()
+        await controller.acquire("alice")
+        controller.release()
+
+    asyncio.run(scenario())
+
+
+def test_only_waited_writes_feed_confirmation_latency():
+    controller = admission.AdmissionController()
+
+    async def write(wait=True):
+        await asyncio.sleep(0.001)
+        return "0xabc", None
+
+    asyncio.run(controller.run(write, wait=False))
+    assert controller.latency_ewma == 0
+    assert controller.submit_latency_ewma > 0
+    asyncio.run(controller.run(write))
+    assert controller.latency_ewma > 0
@@ -0,0 +1,30 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("eth_tester")
+
+import blockchain
+
+
+def test_embedded_concurrent_writes_keep_journal_replayable(tmp_path):
+    chain = blockchain.EmbeddedChain(data_dir=str(tmp_path))
+
+    def write(worker):
+        for i in range(5):
+            chain.transact("addProduct", f"PROD-{worker}-{i}", "Tomatoes", "alice")
+            chain.call("getProduct", f"PROD-{worker}-{i}")
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(tmp_path / "embedded-journal.ndjson") as journal:
+        entries = [json.loads(line) for line in journal]
+    assert len(entries) == 30
+
+    replayed = blockchain.EmbeddedChain(data_dir=str(tmp_path))
+    assert replayed.call("getProduct", "PROD-5-4")[0] == "PROD-5-4"
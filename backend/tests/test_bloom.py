@@ -0,0 +1,30 @@
+import bloom
+
+
+def test_added_items_are_always_found():
+    bloom_filter = bloom.BloomFilter(capacity=1000)
+    for i in range(1000):
+        bloom_filter.add(f"PROD-{i}")
+    assert all(f"PROD-{i}" in bloom_filter for i in range(1000))
+    assert bloom_filter.stats()["items_added"] == 1000
+
+
+def test_false_positive_rate_is_near_the_target():
+    bloom_filter = bloom.BloomFilter(capacity=2000, error_rate=0.01)
+    for i in range(2000):
+        bloom_filter.add(f"PROD-{i}")
+    false_positives = sum(f"OTHER-{i}" in bloom_filter for i in range(10000))
+    assert false_positives < 10000 * 0.01 * 2
+
+
+def test_empty_filter_contains_nothing():
+    assert "PROD-1" not in bloom.BloomFilter(capacity=10)
+
+
+def test_digest_changes_with_every_field():
+    digest = bloom.authenticity_digest("PROD-1", "Tomatoes", "alice", "Produced")
+    assert digest == bloom.authenticity_digest("PROD-1", "Tomatoes", "alice", "Produced")
+    assert digest != bloom.authenticity_digest("PROD-1", "Tomatoes", "bob", "Produced")
+    assert digest != bloom.authenticity_digest("PROD-1", "Tomatoes", "alice", "Shipped")
+    # Fields are separated, so moving characters between them changes it
+    assert bloom.authenticity_digest("PROD-1", "ab", "c", "") != bloom.authenticity_digest("PROD-1", "a", "bc", "")
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+import breaker
+
+
+def _opened(cb):
+    cb.opened_at -= cb.open_seconds + 1
+
+
+def test_consecutive_failures_open_the_breaker():
+    cb = breaker.CircuitBreaker(failure_threshold=3)
+    for _ in range(2):
+        cb.before_call()
+        cb.record_failure(ConnectionError("refused"))
+    assert cb.state == breaker.CLOSED
+    cb.before_call()
+    cb.record_failure(ConnectionError("refused"))
+    assert cb.is_open()
+    with pytest.raises(breaker.BreakerOpen) as excinfo:
+        cb.before_call()
+    assert excinfo.value.retry_after > 0
+    assert cb.stats()["short_circuited"] == 1
+
+
+def test_success_resets_the_failure_count():
+    cb = breaker.CircuitBreaker(failure_threshold=2)
+    cb.record_failure(ConnectionError("refused"))
+    cb.record_success(0.01)
+    cb.record_failure(ConnectionError("refused"))
+    assert cb.state == breaker.CLOSED
+
+
+def test_slow_reads_open_the_breaker():
+    cb = breaker.CircuitBreaker(slow_ms=100, slow_calls=2)
+    cb.record_success(0.5)
+    assert cb.state == breaker.CLOSED
+    cb.record_success(0.5)
+    assert cb.state == breaker.OPEN
+
+
+def test_latency_is_ignored_when_not_checked():
+    cb = breaker.CircuitBreaker(slow_ms=100, slow_calls=1)
+    cb.record_success(5.0, check_latency=False)
+    assert cb.state == breaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    cb = breaker.CircuitBreaker(failure_threshold=1)
+    cb.record_failure(ConnectionError("refused"))
+    _opened(cb)
+    cb.before_call()
+    assert cb.state == breaker.HALF_OPEN
+    with pytest.raises(breaker.BreakerOpen):
+        cb.before_call()
+    cb.record_success(0.01)
+    assert cb.state == breaker.CLOSED
+    cb.before_call()
+
+
+def test_failed_probe_opens_again():
+    cb = breaker.CircuitBreaker(failure_threshold=3)
+    for _ in range(3):
+        cb.record_failure(ConnectionError("refused"))
+    _opened(cb)
+    cb.before_call()
+    cb.record_failure(TimeoutError())
+    assert cb.is_open()
+    assert cb.stats()["times_opened"] == 2
+
+
+def test_slow_probe_opens_again():
+    cb = breaker.CircuitBreaker(failure_threshold=1, slow_ms=100, slow_calls=5)
+    cb.record_failure(ConnectionError("refused"))
+    _opened(cb)
+    cb.before_call()
+    cb.record_success(0.5)
+    assert cb.state == breaker.OPEN
+
+
+def test_cancelled_probe_frees_the_probe_slot():
+    cb = breaker.CircuitBreaker(failure_threshold=1)
+    cb.record_failure(ConnectionError("refused"))
+    _opened(cb)
+    cb.before_call()
+    cb.record_cancelled()
+    cb.before_call()
+    assert cb.state == breaker.HALF_OPEN
+
+
+def test_late_success_does_not_close_an_open_breaker():
+    cb = breaker.CircuitBreaker(failure_threshold=1)
+    cb.record_failure(ConnectionError("refused"))
+    cb.record_success(0.01)
+    assert cb.is_open()
+
+
+class FakeChain:
+    def __init__(self, error=None, delay=0):
+        self.error = error
+        self.delay = delay
+
+    async def call(self, fn_name, *args):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [fn_name, *args]
+
+
+def test_guarded_chain_counts_timeouts_but_not_reverts():
+    cb = breaker.CircuitBreaker(failure_threshold=1)
+
+    async def scenario():
+        reverting = breaker.GuardedChain(FakeChain(error=ValueError("revert")), cb)
+        with pytest.raises(ValueError):
+            await reverting.call("getProduct", "PROD-1")
+        assert cb.state == breaker.CLOSED
+
+        hanging = breaker.GuardedChain(FakeChain(delay=1), cb, read_timeout=0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await hanging.call("getProduct", "PROD-1")
+        assert cb.is_open()
+
+        with pytest.raises(breaker.BreakerOpen):
+            await breaker.GuardedChain(FakeChain(), cb).call("getProduct", "PROD-1")
+
+    asyncio.run(scenario())
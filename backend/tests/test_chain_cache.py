@@ -0,0 +1,158 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from chain_cache import AsyncViewCache
+
+ADDRESS = "0x00000000000000000000000000000000000000AA"
+
+
+class FakeContract:
+    address = ADDRESS
+
+    def decode_function_input(self, data):
+        if data is None:
+            raise ValueError("no call data")
+        return None, data
+
+
+class FakeChain:
+    def __init__(self):
+        self.contract = FakeContract()
+        self.head = 1
+        self.blocks = {}
+        self.state = {}
+        self.calls = 0
+
+    async def block_number(self):
+        return self.head
+
+    async def get_block(self, number, full_transactions=False):
+        return SimpleNamespace(transactions=self.blocks.get(number, []))
+
+    async def call(self, fn_name, *args):
+        self.calls += 1
+        await asyncio.sleep(0.001)
+        return self.state.get(args[0])
+
+    def write(self, params, **tx):
+        self.head += 1
+        self.blocks[self.head] = [{"to": ADDRESS, "input": params, **tx}]
+
+
+@pytest.fixture
+def chain():
+    chain = FakeChain()
+    chain.state = {"PROD-1": "Produced", "PROD-2": "Produced"}
+    return chain
+
+
+def _run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_reads_between_blocks_are_served_from_cache(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        assert await cache.call("getProduct", "PROD-1") == "Produced"
+        assert await cache.call("getProduct", "PROD-1") == "Produced"
+
+    _run(scenario)
+    assert chain.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_concurrent_misses_share_one_call(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.call("getProduct", "PROD-1") for _ in range(5)))
+
+    assert _run(scenario) == ["Produced"] * 5
+    assert chain.calls == 1
+    assert cache.coalesced == 4
+
+
+def test_write_on_chain_invalidates_only_that_product(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        await cache.call("getProduct", "PROD-1")
+        await cache.call("getProduct", "PROD-2")
+        chain.state["PROD-1"] = "Shipped"
+        chain.write({"_productId": "PROD-1"})
+        assert await cache.call("getProduct", "PROD-1") == "Shipped"
+        await cache.call("getProduct", "PROD-2")
+
+    _run(scenario)
+    assert chain.calls == 3
+
+
+def test_split_invalidates_parent_and_child(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        await cache.call("getProduct", "PROD-1")
+        await cache.call("getProduct", "PROD-3")
+        chain.write({"_parentId": "PROD-1", "_childId": "PROD-3"})
+        await cache.call("getProduct", "PROD-2")
+
+    _run(scenario)
+    assert cache.stats()["entries"] == 1
+
+
+def test_embedded_chain_call_data_is_decoded(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        await cache.call("getProduct", "PROD-1")
+        await cache.call("getProduct", "PROD-2")
+        chain.head += 1
+        chain.blocks[chain.head] = [{"to": ADDRESS, "data": {"_productId": "PROD-1"}}]
+        await cache.call("getProduct", "PROD-2")
+
+    _run(scenario)
+    # Only PROD-1 was dropped, not the whole cache
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_undecodable_block_clears_everything(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        await cache.call("getProduct", "PROD-1")
+        chain.head += 1
+        chain.blocks[chain.head] = [{"to": ADDRESS}]
+        await cache.call("getProduct", "PROD-2")
+
+    _run(scenario)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_read_racing_an_invalidation_is_not_stored(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        read = asyncio.ensure_future(cache.call("getProduct", "PROD-1"))
+        await asyncio.sleep(0)
+        cache.invalidate("PROD-1")
+        await read
+
+    _run(scenario)
+    assert cache.stats()["entries"] == 0
+
+
+def test_reorg_clears_the_cache(chain):
+    cache = AsyncViewCache(chain, poll_interval=0)
+
+    async def scenario():
+        await cache.call("getProduct", "PROD-1")
+        chain.head = 0
+        await cache.call("getProduct", "PROD-2")
+
+    _run(scenario)
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import changes
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self.docs, key=lambda d: d[key], reverse=direction < 0))
+
+    def limit(self, n):
+        return FakeCursor(self.docs[:n])
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            if "$gt" in cond and not value > cond["$gt"]:
+                return False
+            if "$lte" in cond and not value <= cond["$lte"]:
+                return False
+        elif isinstance(value, list):
+            if cond not in value:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([d for d in self.docs if _matches(d, query or {})])
+
+    def find_one(self, query=None, projection=None, sort=None):
+        docs = self.find(query)
+        if sort:
+            docs = docs.sort(*sort[0])
+        return next(iter(docs), None)
+
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    collection = FakeCollection()
+    counters = FakeCollection([{"_id": changes.COUNTER_ID, "seq": 0}])
+    monkeypatch.setattr(changes, "changes_collection", collection)
+    monkeypatch.setattr(changes, "counters_collection", counters)
+
+    def write(seq, age=60, users=("alice",)):
+        collection.docs.append({"_id": seq, "ts": NOW - timedelta(seconds=age), "users": list(users)})
+        counters.docs[0]["seq"] = max(counters.docs[0]["seq"], seq)
+
+    def allocate(seq):
+        counters.docs[0]["seq"] = max(counters.docs[0]["seq"], seq)
+
+    write.allocate = allocate
+    write.collection = collection
+    return write
+
+
+def _ids(found):
+    return [doc["_id"] for doc in found]
+
+
+def test_reads_changes_after_token(feed):
+    for seq in range(1, 6):
+        feed(seq)
+    found, token, has_more = changes.read("2", now=NOW)
+    assert _ids(found) == [3, 4, 5]
+    assert token == "5"
+    assert not has_more
+
+
+def test_stops_at_recent_gap(feed):
+    feed(1)
+    feed(3, age=1)
+    found, token, _ = changes.read(None, now=NOW)
+    assert _ids(found) == [1]
+    assert token == "1"
+
+
+def test_skips_gap_older_than_wait(feed):
+    feed(1)
+    feed(3, age=changes.GAP_WAIT_SECONDS + 10)
+    found, token, _ = changes.read(None, now=NOW)
+    assert _ids(found) == [1, 3]
+    assert token == "3"
+
+
+def test_scope_filters_changes_but_advances_token(feed):
+    feed(1, users=("bob",))
+    feed(2, users=("alice",))
+    found, token, _ = changes.read(None, query={"users": "alice"}, now=NOW)
+    assert _ids(found) == [2]
+    assert token == "2"
+
+
+def test_limit_reports_more(feed):
+    for seq in range(1, 6):
+        feed(seq)
+    found, token, has_more = changes.read(None, limit=2, now=NOW)
+    assert _ids(found) == [1, 2]
+    assert token == "2"
+    assert has_more
+
+
+def test_token_before_oldest_change_expired(feed):
+    feed(5)
+    feed(6)
+    with pytest.raises(changes.TokenExpired):
+        changes.read("3", now=NOW)
+
+
+def test_token_expired_when_every_change_expired(feed):
+    feed.allocate(10)
+    with pytest.raises(changes.TokenExpired):
+        changes.read("4", now=NOW)
+
+
+def test_token_at_head_of_empty_feed_is_current(feed):
+    feed.allocate(10)
+    found, token, has_more = changes.read("10", now=NOW)
+    assert found == [] and token == "10" and not has_more
+
+
+def test_token_from_another_feed(feed):
+    feed(1)
+    with pytest.raises(changes.TokenExpired):
+        changes.read("99", now=NOW)
+
+
+def test_invalid_token():
+    with pytest.raises(ValueError):
+        changes.decode_token("-1")
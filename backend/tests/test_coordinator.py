@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("web3")
+
+import blockchain
+import coordinator
+
+
+def _function(name, *inputs):
+    return {"type": "function", "name": name, "inputs": [{"name": i} for i in inputs]}
+
+
+class FakeContract:
+    abi = [
+        _function("transferProduct", "_productId", "_newOwner", "_newStatus"),
+        _function("splitProduct", "_parentId", "_childId", "_holder", "_amount", "_status", "_note"),
+        _function("mergeProducts", "_parentIds", "_childId", "_holder", "_status", "_note"),
+    ]
+
+
+class FakeChain:
+    private_key = None
+    contract = FakeContract()
+
+    def transact(self, fn_name, *args, wait=True):
+        return "0xabc", None
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(blockchain, "get_chain", lambda: FakeChain())
+    return coordinator.ChainWriter(coordinator.NonceAllocator(), coordinator.InvalidationBus())
+
+
+def test_merge_publishes_every_product(writer):
+    writer.transact("mergeProducts", (["PROD-1", "PROD-2"], "PROD-3", "alice", "Produced", ""), wait=False)
+    _, product_ids = writer.bus.poll(0)
+    assert sorted(product_ids) == ["PROD-1", "PROD-2", "PROD-3"]
+    assert all(isinstance(product_id, str) for product_id in product_ids)
+
+
+def test_split_publishes_parent_and_child(writer):
+    writer.transact("splitProduct", ("PROD-1", "PROD-2", "alice", 10, "Produced", ""), wait=False)
+    assert sorted(writer.bus.poll(0)[1]) == ["PROD-1", "PROD-2"]
+
+
+def test_transfer_publishes_product(writer):
+    writer.transact("transferProduct", ("PROD-1", "bob", "Transferred"), wait=False)
+    assert writer.bus.poll(0)[1] == ["PROD-1"]
+
+
+def test_worker_count_comes_from_coordinator_environment(monkeypatch):
+    monkeypatch.delenv(coordinator.COORDINATOR_ADDRESS_ENV, raising=False)
+    monkeypatch.setenv(coordinator.COORDINATOR_WORKERS_ENV, "4")
+    assert coordinator.worker_count() == 1
+    monkeypatch.setenv(coordinator.COORDINATOR_ADDRESS_ENV, "/tmp/coordinator.sock")
+    assert coordinator.worker_count() == 4
@@ -0,0 +1,42 @@
+import pytest
+
+import geo
+
+
+class FakePlaces:
+    def __init__(self):
+        self.places = {}
+        self.lookups = 0
+
+    def find_one(self, query, projection=None):
+        self.lookups += 1
+        return self.places.get(query["name"])
+
+
+@pytest.fixture
+def places(monkeypatch):
+    fake = FakePlaces()
+    monkeypatch.setattr(geo, "places_collection", fake)
+    monkeypatch.setattr(geo, "_geocode_cache", geo.OrderedDict())
+    return fake
+
+
+def test_hits_are_cached(places):
+    places.places["rotterdam port"] = {"position": geo.point(51.95, 4.14)}
+    assert geo.geocode("Rotterdam  Port") == (51.95, 4.14)
+    assert geo.geocode("rotterdam port") == (51.95, 4.14)
+    assert places.lookups == 1
+
+
+def test_misses_are_retried(places):
+    assert geo.geocode("Depot 7") is None
+    places.places["depot 7"] = {"position": geo.point(10.0, 20.0)}
+    assert geo.geocode("Depot 7") == (10.0, 20.0)
+
+
+def test_cache_is_bounded(places, monkeypatch):
+    monkeypatch.setattr(geo, "GEOCODE_CACHE_SIZE", 2)
+    for i in range(3):
+        places.places[f"p{i}"] = {"position": geo.point(i, i)}
+        geo.geocode(f"p{i}")
+    assert list(geo._geocode_cache) == ["p1", "p2"]
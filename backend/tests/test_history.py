@@ -0,0 +1,81 @@
+import pytest
+from pymongo.errors import InvalidOperation
+
+import history
+
+
+class FakeClient:
+    def __init__(self, version, fail=False):
+        self.version = version
+        self.fail = fail
+        self.server_info_calls = 0
+        self.bulk_writes = []
+
+    def server_info(self):
+        self.server_info_calls += 1
+        return {"versionArray": self.version}
+
+    def bulk_write(self, ops, ordered=True):
+        if self.fail:
+            raise InvalidOperation("client bulk write not supported")
+        self.bulk_writes.append(ops)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.writes = []
+
+    def insert_one(self, doc):
+        self.writes.append(("insert", doc))
+
+    def update_one(self, query, update, upsert=False):
+        self.writes.append(("update", query))
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    fakes = {name: FakeCollection() for name in ("products_collection", "history_collection", "changes_collection")}
+    for name, fake in fakes.items():
+        monkeypatch.setattr(history, name, fake)
+    monkeypatch.setattr(history, "_client_bulk_write", None)
+    return fakes
+
+
+def _use_client(monkeypatch, client):
+    monkeypatch.setattr(history, "get_client", lambda: client)
+    return client
+
+
+def test_probes_server_once(monkeypatch, collections):
+    client = _use_client(monkeypatch, FakeClient([8, 0, 1, 0]))
+    history.record("PROD-1", {"timestamp": 1}, product_update={"$set": {"status": "Shipped"}})
+    history.record("PROD-1", {"timestamp": 2}, change={"_id": 1})
+    assert client.server_info_calls == 1
+    assert len(client.bulk_writes) == 2
+    assert collections["history_collection"].writes == []
+
+
+def test_older_server_uses_separate_writes(monkeypatch, collections):
+    client = _use_client(monkeypatch, FakeClient([7, 0, 12, 0]))
+    history.record("PROD-1", {"timestamp": 1}, product_insert={"productId": "PROD-1"}, change={"_id": 1})
+    assert client.bulk_writes == []
+    assert collections["products_collection"].writes == [("insert", {"productId": "PROD-1"})]
+    assert collections["history_collection"].writes == [("update", {"productId": "PROD-1", "count": {"$lt": history.BUCKET_SIZE}})]
+    assert collections["changes_collection"].writes == [("insert", {"_id": 1})]
+
+
+def test_rejected_bulk_write_falls_back_for_good(monkeypatch, collections):
+    client = _use_client(monkeypatch, FakeClient([8, 0, 0, 0], fail=True))
+    history.record("PROD-1", {"timestamp": 1})
+    assert len(collections["history_collection"].writes) == 1
+    assert history.supports_client_bulk_write() is False
+
+
+def test_bugs_in_ops_are_not_swallowed(monkeypatch, collections):
+    class BrokenClient(FakeClient):
+        def bulk_write(self, ops, ordered=True):
+            raise TypeError("bad op")
+
+    _use_client(monkeypatch, BrokenClient([8, 0, 0, 0]))
+    with pytest.raises(TypeError):
+        history.record("PROD-1", {"timestamp": 1})
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import ids
+
+
+class FakeClockAllocator(ids.IdAllocator):
+    def __init__(self, node_id=0, now=100):
+        super().__init__(node_id)
+        self.now = now
+
+    def _now_ms(self):
+        return self.now
+
+
+def test_ids_increase_within_one_millisecond():
+    allocator = FakeClockAllocator(node_id=3)
+    values = [allocator.next_int() for _ in range(5)]
+    assert values == sorted(values)
+    assert values[-1] - values[0] == 4
+    assert all((value >> ids.SEQUENCE_BITS) & ids.MAX_NODE_ID == 3 for value in values)
+
+
+def test_sequence_rollover_moves_to_the_next_millisecond():
+    allocator = FakeClockAllocator(now=100)
+    values = allocator.allocate_ints(ids.SEQUENCE_MASK + 3)
+    assert len(set(values)) == len(values)
+    assert values == sorted(values)
+    assert values[-1] >> ids.TIMESTAMP_SHIFT == 101
+    assert values[-1] & ids.SEQUENCE_MASK == 1
+
+
+def test_clock_going_backwards_never_repeats_an_id():
+    allocator = FakeClockAllocator(now=100)
+    first = allocator.next_int()
+    allocator.now = 50
+    second = allocator.next_int()
+    assert second > first
+    assert second >> ids.TIMESTAMP_SHIFT == 100
+
+
+def test_string_order_matches_allocation_order():
+    allocator = FakeClockAllocator(now=100)
+    product_ids = allocator.allocate(3)
+    allocator.now = 2 ** 20
+    product_ids.append(allocator.next_id())
+    assert product_ids == sorted(product_ids)
+    assert [ids.parse_id(p) for p in product_ids] == sorted(ids.parse_id(p) for p in product_ids)
+
+
+def test_lower_bound_and_timestamp_round_trip():
+    moment = datetime(2026, 3, 1, 9, 30, tzinfo=timezone.utc)
+    bound = ids.lower_bound(moment)
+    assert ids.timestamp_of(bound) == moment
+    allocator = FakeClockAllocator(now=int(moment.timestamp() * 1000) - ids.EPOCH_MS)
+    assert allocator.next_id() >= bound
+
+
+def test_invalid_ids_and_node_ids_are_rejected():
+    with pytest.raises(ValueError):
+        ids.parse_id("PROD-123")
+    with pytest.raises(ValueError):
+        ids.IdAllocator(node_id=ids.MAX_NODE_ID + 1)
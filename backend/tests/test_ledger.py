@@ -0,0 +1,128 @@
+from datetime import datetime
+
+import pytest
+
+import ledger
+
+TS = datetime(2026, 3, 1, 9, 30)
+
+
+@pytest.fixture
+def product(mongo):
+    doc = {"productId": "PROD-1", "name": "Tomatoes", "current_owner": "alice", "quantity": 10,
+           "status": "Produced", "batch_id": "B-1", "ledger": True}
+    mongo["products"].insert_one(dict(doc))
+    ledger.post([ledger.entry("PROD-1", "mint", None, "alice", 10, TS)])
+    return doc
+
+
+def _balances(mongo, product_id):
+    return {b["holder"]: b["quantity"] for b in mongo["balances"].find({"productId": product_id})}
+
+
+# What ledger.check verifies; its aggregation needs a real server
+def _consistent(mongo):
+    replayed = {}
+    for e in mongo["ledger"].find():
+        if e["from"] is not None:
+            replayed[(e["productId"], e["from"])] = replayed.get((e["productId"], e["from"]), 0) - e["amount"]
+        if e["to"] is not None:
+            replayed[(e["productId"], e["to"])] = replayed.get((e["productId"], e["to"]), 0) + e["amount"]
+    balances = {(b["productId"], b["holder"]): b["quantity"] for b in mongo["balances"].find()}
+    if any(replayed.get(key, 0) != balances.get(key, 0) for key in replayed.keys() | balances.keys()):
+        return False
+    for product in mongo["products"].find({"ledger": True}):
+        held = sum(q for (pid, _), q in balances.items() if pid == product["productId"])
+        if held != product["quantity"]:
+            return False
+    return True
+
+
+def test_mint_credits_the_owner(mongo, product):
+    assert ledger.balance("PROD-1", "alice") == 10
+    assert ledger.holders("PROD-1") == [{"holder": "alice", "quantity": 10}]
+
+
+def test_partial_transfer_moves_only_the_reserved_units(mongo, product):
+    assert ledger.reserve("PROD-1", "alice", 4)
+    ledger.post([ledger.entry("PROD-1", "transfer", "alice", "bob", 4, TS)], debited=True)
+    assert _balances(mongo, "PROD-1") == {"alice": 6, "bob": 4}
+    assert ledger.holdings("bob") == [{"productId": "PROD-1", "quantity": 4}]
+    assert _consistent(mongo)
+
+
+def test_reserve_refuses_more_than_held(mongo, product):
+    assert not ledger.reserve("PROD-1", "alice", 11)
+    assert not ledger.reserve("PROD-1", "bob", 1)
+    assert ledger.balance("PROD-1", "alice") == 10
+
+
+def test_refund_returns_reserved_units(mongo, product):
+    assert ledger.reserve("PROD-1", "alice", 3)
+    ledger.refund("PROD-1", "alice", 3)
+    assert ledger.balance("PROD-1", "alice") == 10
+
+
+def test_take_all_empties_the_holder_once(mongo, product):
+    assert ledger.take_all("PROD-1", "alice") == 10
+    assert ledger.take_all("PROD-1", "alice") == 0
+    assert ledger.balance("PROD-1", "alice") == 0
+
+
+def test_quantity_update_adjusts_the_owner(mongo, product):
+    ledger.record_update(product, {"quantity": 13}, TS)
+    assert ledger.balance("PROD-1", "alice") == 13
+    ledger.record_update({**product, "quantity": 13}, {"quantity": 8}, TS)
+    assert ledger.balance("PROD-1", "alice") == 8
+
+
+def test_ownership_transfer_moves_only_the_owners_units(mongo, product):
+    ledger.reserve("PROD-1", "alice", 3)
+    ledger.post([ledger.entry("PROD-1", "transfer", "alice", "bob", 3, TS)], debited=True)
+    ledger.record_update(product, {"current_owner": "carol"}, TS)
+    assert _balances(mongo, "PROD-1") == {"alice": 0, "bob": 3, "carol": 7}
+
+
+def test_quantity_cannot_drop_below_units_held_by_others(mongo, product):
+    ledger.reserve("PROD-1", "alice", 4)
+    ledger.post([ledger.entry("PROD-1", "transfer", "alice", "bob", 4, TS)], debited=True)
+    with pytest.raises(ledger.InsufficientUnits):
+        ledger.check_quantity(product, 3)
+    ledger.check_quantity(product, 4)
+
+
+def test_split_creates_child_with_the_split_units(mongo, product):
+    assert ledger.reserve("PROD-1", "alice", 4)
+    child = ledger.record_derivation("split", [(product, 4)], "PROD-2", "alice", "Packed", ts=TS)
+
+    assert child["quantity"] == 4
+    assert child["status"] == "Packed"
+    assert child["batch_id"] == "B-1"
+    assert mongo["products"].find_one({"productId": "PROD-1"})["quantity"] == 6
+    assert _balances(mongo, "PROD-1") == {"alice": 6}
+    assert _balances(mongo, "PROD-2") == {"alice": 4}
+    assert _consistent(mongo)
+
+
+def test_merge_combines_every_parent(mongo, product):
+    other = {"productId": "PROD-3", "name": "Tomatoes", "current_owner": "alice", "quantity": 5, "ledger": True}
+    mongo["products"].insert_one(dict(other))
+    ledger.post([ledger.entry("PROD-3", "mint", None, "alice", 5, TS)])
+
+    parts = [(product, ledger.take_all("PROD-1", "alice")), (other, ledger.take_all("PROD-3", "alice"))]
+    child = ledger.record_derivation("merge", parts, "PROD-4", "alice", "Produced", ts=TS)
+
+    assert child["quantity"] == 15
+    assert ledger.balance("PROD-4", "alice") == 15
+    assert [p["quantity"] for p in mongo["products"].find({"productId": {"$in": ["PROD-1", "PROD-3"]}})] == [0, 0]
+    assert _consistent(mongo)
+
+
+def test_products_created_before_the_ledger_are_seeded_once(mongo):
+    old = {"productId": "PROD-9", "current_owner": "alice", "quantity": 7}
+    mongo["products"].insert_one(dict(old))
+    ledger.ensure_seeded(dict(old), TS)
+    ledger.ensure_seeded(dict(old), TS)
+    assert ledger.balance("PROD-9", "alice") == 7
+    assert mongo["products"].find_one({"productId": "PROD-9"})["ledger"] is True
+
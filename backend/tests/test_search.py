@@ -0,0 +1,34 @@
+import search
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter([])
+
+
+def test_scope_limits_hits_and_facets(monkeypatch):
+    collection = RecordingCollection()
+    monkeypatch.setattr(search, "products_collection", collection)
+
+    search.search_products(status="Shipped", facets=True, scope={"current_owner": "alice"})
+
+    hits_match, facets_match = (pipeline[0]["$match"] for pipeline in collection.pipelines)
+    assert hits_match == {"current_owner": "alice", "status": "Shipped"}
+    assert facets_match == hits_match
+
+
+def test_unscoped_search_matches_every_product(monkeypatch):
+    collection = RecordingCollection()
+    monkeypatch.setattr(search, "products_collection", collection)
+
+    search.search_products()
+
+    assert collection.pipelines[0][0] == {"$match": {}}
+
+
+def test_cursor_after_undated_product_stays_undated():
+    assert search._after([None, "PROD-9"], ranked=False) == {"date_created": None, "productId": {"$gt": "PROD-9"}}
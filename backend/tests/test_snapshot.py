@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("eth_tester")
+
+from pymongo.errors import OperationFailure
+
+import blockchain
+import db
+import snapshot
+
+TS = datetime(2026, 3, 1, 9, 30)
+
+
+# mongomock has no snapshot sessions, like a standalone mongod
+class StandaloneClient:
+    def __init__(self, client):
+        self.client = client
+
+    def start_session(self, **kwargs):
+        raise OperationFailure("snapshot reads are not supported")
+
+
+@pytest.fixture
+def chain(tmp_path, monkeypatch):
+    chain = blockchain.EmbeddedChain(data_dir=str(tmp_path / "chain"))
+    monkeypatch.setattr(blockchain, "_chain", chain)
+    monkeypatch.setattr(snapshot, "get_client", lambda: StandaloneClient(db._client))
+    return chain
+
+
+def _add(chain, product_id, name, owner):
+    tx_hash, _ = chain.transact("addProduct", product_id, name, owner)
+    args = {"_productId": product_id, "_name": name, "_owner": owner}
+    return snapshot.apply_transaction("addProduct", args, tx_hash, TS)
+
+
+def test_snapshot_finds_documents_across_blocks(tmp_path, mongo, chain, monkeypatch):
+    monkeypatch.setattr(snapshot, "BLOCK_DOCS", 3)
+    mongo["products"].insert_many([{"productId": f"PROD-{i:02d}", "quantity": i} for i in range(10)])
+
+    path, manifest = snapshot.export(str(tmp_path / "snapshots"))
+    assert manifest["consistent"] is False
+    assert manifest["collections"]["products"] == {"key": "productId", "blocks": 4, "docs": 10}
+
+    restored = snapshot.Snapshot(path)
+    try:
+        assert [doc["quantity"] for doc in restored.find("products", "PROD-07")] == [7]
+        assert restored.find("products", "PROD-99") == []
+        with pytest.raises(ValueError):
+            restored.find("counters", "x")
+    finally:
+        restored.close()
+
+
+def test_export_restore_catch_up(tmp_path, mongo, chain, monkeypatch):
+    import mongomock
+
+    assert _add(chain, "PROD-A", "Tomatoes", "alice")
+    path, manifest = snapshot.export(str(tmp_path / "snapshots"))
+    assert manifest["block_number"] == chain.w3.eth.block_number
+
+    # Written to the chain after the snapshot was taken
+    chain.transact("updateProductStatus", "PROD-A", "Shipped")
+    chain.transact("addProduct", "PROD-B", "Basil", "bob")
+
+    fresh = mongomock.MongoClient()
+    monkeypatch.setattr(db, "_client", fresh)
+    applied = snapshot.restore(path)
+
+    products = {p["productId"]: p for p in fresh[db.DB_NAME]["products"].find()}
+    assert applied == 2
+    assert products["PROD-A"]["status"] == "Shipped"
+    assert products["PROD-B"]["current_owner"] == "bob"
+    assert snapshot.sync_state()["block_number"] == chain.w3.eth.block_number
+
+    # Catching up again applies nothing twice
+    assert snapshot.catch_up() == 0
+
+
+def test_restore_refuses_a_non_empty_read_model(tmp_path, mongo, chain):
+    assert _add(chain, "PROD-A", "Tomatoes", "alice")
+    path, _ = snapshot.export(str(tmp_path / "snapshots"))
+    with pytest.raises(RuntimeError):
+        snapshot.restore(path)
+    assert snapshot.restore(path, drop=True) == 0
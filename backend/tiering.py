@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Hot/cold tiering of completed product lifecycles.
+
+Products in a terminal status that have not been touched for
+ARCHIVE_AFTER_DAYS are moved, together with their history, into one
+zlib-compressed document each in the products_archive collection. The
+archive document keeps a few summary fields uncompressed for verification
+and recall queries. Reads of an archived product restore it to the hot
+collections. Usage:
+    python tiering.py --archive [--days 30] [--limit 10000] [--dry-run]
+    python tiering.py --restore PROD-...
+"""
+import argparse
+import zlib
+from datetime import datetime, timedelta
+
+import bson
+from bson import Binary
+from dotenv import dotenv_values
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from db import archive_collection, history_collection, products_collection, transactions_collection
+import history
+
+config = dotenv_values("../.env")
+
+TERMINAL_STATUSES = ["Delivered", "Sold"]
+ARCHIVE_AFTER_DAYS = int(config.get("ARCHIVE_AFTER_DAYS", "30"))
+
+# Uncompressed fields of an archive document
+SUMMARY_FIELDS = ["productId", "name", "current_owner", "status", "location", "batch_id", "auth_digest", "last_updated"]
+
+
+def ensure_indexes():
+    # Serves the policy query; the archive is keyed by productId
+    products_collection.create_index([("status", 1), ("last_updated", 1)])
+    archive_collection.create_index("batch_id")
+
+
+def policy_filter(days=ARCHIVE_AFTER_DAYS, now=None):
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    return {
+        "status": {"$in": TERMINAL_STATUSES},
+        "last_updated": {"$lt": cutoff},
+        # Products restored on access stay hot for another full period
+        "$or": [{"restored_at": {"$exists": False}}, {"restored_at": {"$lt": cutoff}}],
+    }
+
+
+def _pack(product, buckets, legacy):
+    payload = {"product": product, "buckets": buckets, "legacy_transactions": legacy}
+    return Binary(zlib.compress(bson.encode(payload), 6))
+
+
+def _unpack(blob):
+    return bson.decode(zlib.decompress(blob))
+
+
+# Move one product and its history to the archive. The archive document is
+# written first, so a crash at any point leaves the data readable. Returns
+# False if the product changed while it was being archived.
+def archive_product(product):
+    product_id = product["productId"]
+    buckets = list(history_collection.find({"productId": product_id}))
+    legacy = [] if history.legacy_migrated() else list(transactions_collection.find({"productId": product_id}))
+
+    archive_collection.replace_one({"_id": product_id}, {
+        "_id": product_id,
+        **{field: product.get(field) for field in SUMMARY_FIELDS},
+        "archived_at": datetime.utcnow(),
+        "blob": _pack(product, buckets, legacy),
+    }, upsert=True)
+
+    # Only drop the hot copy if nobody wrote to it in the meantime
+    deleted = products_collection.delete_one({"_id": product["_id"], "last_updated": product.get("last_updated")})
+    if not deleted.deleted_count:
+        archive_collection.delete_one({"_id": product_id})
+        return False
+
+    # A bucket that gained an event after it was read stays hot; restore
+    # merges it back with the archived ones
+    for bucket in buckets:
+        history_collection.delete_one({"_id": bucket["_id"], "count": bucket["count"]})
+    if legacy:
+        transactions_collection.delete_many({"_id": {"$in": [txn["_id"] for txn in legacy]}})
+    return True
+
+
+def archive(days=ARCHIVE_AFTER_DAYS, limit=None, dry_run=False):
+    cursor = products_collection.find(policy_filter(days)).sort("last_updated", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    archived = skipped = 0
+    for product in cursor:
+        if dry_run:
+            archived += 1
+        elif archive_product(product):
+            archived += 1
+        else:
+            skipped += 1
+    return archived, skipped
+
+
+# Bring an archived product back into the hot collections. Returns the
+# product without _id, or None if it is not archived either.
+def restore(product_id):
+    doc = archive_collection.find_one({"_id": product_id})
+    if doc is None:
+        # Possibly restored by a concurrent request a moment ago
+        return products_collection.find_one({"productId": product_id}, {"_id": 0})
+
+    payload = _unpack(doc["blob"])
+    product = payload["product"]
+    product["restored_at"] = datetime.utcnow()
+
+    # Restores racing each other insert the same _ids; the first one wins
+    try:
+        products_collection.insert_one(product)
+    except DuplicateKeyError:
+        pass
+    for collection, documents in ((history_collection, payload["buckets"]),
+                                  (transactions_collection, payload["legacy_transactions"])):
+        if documents:
+            try:
+                collection.insert_many(documents, ordered=False)
+            except BulkWriteError:
+                pass
+
+    archive_collection.delete_one({"_id": product_id})
+    product.pop("_id", None)
+    return product
+
+
+# Summary of an archived product without restoring it, e.g. for /verify
+def find_archived(product_id):
+    return archive_collection.find_one({"_id": product_id}, {field: 1 for field in SUMMARY_FIELDS} | {"_id": 0})
+
+
+def iter_archived_ids():
+    for doc in archive_collection.find({}, {"_id": 1}).batch_size(10000):
+        yield doc["_id"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive completed products or restore them")
+    parser.add_argument("--archive", action="store_true", help="Archive products matching the policy")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="Days since the last update")
+    parser.add_argument("--limit", type=int, default=None, help="Archive at most this many products")
+    parser.add_argument("--dry-run", action="store_true", help="Only count matching products")
+    parser.add_argument("--restore", metavar="PRODUCT_ID", help="Restore one archived product")
+    args = parser.parse_args()
+
+    if args.archive:
+        ensure_indexes()
+        archived, skipped = archive(args.days, args.limit, args.dry_run)
+        verb = "Would archive" if args.dry_run else "Archived"
+        print(f"{verb} {archived} products, skipped {skipped} that changed meanwhile")
+    elif args.restore:
+        print("Restored" if restore(args.restore) else "Not archived")
+    else:
+        parser.print_help()
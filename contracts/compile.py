@@ -5,8 +5,19 @@ import sys
 from web3 import Web3
 from solcx import compile_standard, install_solc
 
+# Same compiler and optimizer settings as truffle-config.js
+SOLC_VERSION = "0.8.17"
+
+# Artifacts read by the backend, by deploy.py and by Truffle; each is
+# rewritten with the new ABI and bytecode, keeping its deployed networks
+ARTIFACT_PATHS = [
+    "SupplyChain.json",
+    os.path.join("contracts", "SupplyChain.json"),
+    os.path.join("build", "contracts", "SupplyChain.json"),
+]
+
 # Install specific solc version
-install_solc("0.8.0")
+install_solc(SOLC_VERSION)
 
 def compile_contract():
     # Read the Solidity contract
@@ -19,24 +30,51 @@ def compile_contract():
             "language": "Solidity",
             "sources": {"SupplyChain.sol": {"content": supply_chain_file}},
             "settings": {
+                "optimizer": {"enabled": True, "runs": 200},
                 "outputSelection": {
-                    "*": {"*": ["abi", "metadata", "evm.bytecode", "evm.sourceMap"]}
+                    "*": {"*": ["abi", "metadata", "evm.bytecode", "evm.deployedBytecode", "evm.sourceMap"]}
                 }
             },
         },
-        solc_version="0.8.0",
+        solc_version=SOLC_VERSION,
     )
 
-    # Save the compiled contract
-    with open("SupplyChain.json", "w") as file:
-        json.dump(compiled_sol, file)
+    compiled = compiled_sol["contracts"]["SupplyChain.sol"]["SupplyChain"]
+    for path in ARTIFACT_PATHS:
+        write_artifact(path, compiled, supply_chain_file)
     
     return compiled_sol
 
 
+# Save the compiled contract in the Truffle artifact layout. The source is
+# kept so the backend can tell when an artifact is older than the contract.
+def write_artifact(path, compiled, source):
+    artifact = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            artifact = json.load(file)
+    artifact.update({
+        "contractName": "SupplyChain",
+        "abi": compiled["abi"],
+        "metadata": compiled["metadata"],
+        "bytecode": "0x" + compiled["evm"]["bytecode"]["object"],
+        "deployedBytecode": "0x" + compiled["evm"]["deployedBytecode"]["object"],
+        "sourceMap": compiled["evm"]["bytecode"]["sourceMap"],
+        "source": source,
+        "compiler": {"name": "solc", "version": SOLC_VERSION},
+    })
+    artifact.setdefault("networks", {})
+    with open(path, "w") as file:
+        json.dump(artifact, file, indent=2)
+
+
 # Deply contract
 from dotenv import load_dotenv
 
 # Load .env from the root directory
 load_dotenv(dotenv_path=".env")
 
+
+if __name__ == "__main__":
+    compile_contract()
+    print(f"Wrote {', '.join(ARTIFACT_PATHS)}")
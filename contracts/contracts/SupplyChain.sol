@@ -41,18 +41,39 @@ contract SupplyChain {
         bool canViewAllProducts; // Can view all products regardless of ownership
     }
     
+    // Position structure, coordinates in microdegrees
+    struct Position {
+        int32 latE6;           // Latitude * 1e6
+        int32 lonE6;           // Longitude * 1e6
+        uint256 recordedAt;    // Block timestamp of the fix
+    }
+    
     // State variables
     address public owner;                                  // Contract owner/deployer
     mapping(string => Product) public products;            // Maps productId to Product
     mapping(string => ProductTransaction[]) public productHistory; // Maps productId to its history
     mapping(string => Role) public roles;                  // Maps role name to Role
     mapping(string => string) public userRoles;            // Maps username to role name
+    mapping(string => Position) public productPositions;   // Maps productId to its latest position
+    mapping(string => mapping(string => uint256)) public balances; // Maps productId and holder to units held
+    mapping(string => bool) public ledgerSeeded;           // Whether a product's balances are tracked yet
+    
+    // Field mask bits for updateProduct
+    uint8 public constant UPDATE_OWNER = 1;
+    uint8 public constant UPDATE_STATUS = 2;
+    uint8 public constant UPDATE_LOCATION = 4;
+    uint8 public constant UPDATE_QUANTITY = 8;
+    uint8 public constant UPDATE_POSITION = 16;
     
     // Events for logging
     event ProductAdded(string productId, string name, string owner, uint256 timestamp);
     event ProductTransferred(string productId, string fromOwner, string toOwner, uint256 timestamp);
     event ProductUpdated(string productId, string status, uint256 timestamp);
     event UserRoleAssigned(string username, string role, uint256 timestamp);
+    event ProductLocated(string productId, string location, int32 latE6, int32 lonE6, uint256 timestamp);
+    event QuantityTransferred(string productId, string fromHolder, string toHolder, uint256 amount, uint256 timestamp);
+    event ProductSplit(string parentId, string childId, string holder, uint256 amount, uint256 timestamp);
+    event ProductMerged(string parentId, string childId, string holder, uint256 amount, uint256 timestamp);
     
     // Constructor
     constructor() {
@@ -119,7 +140,30 @@ contract SupplyChain {
         string memory _name,
         string memory _owner
     ) public {
+        _addProduct(_productId, _name, _owner, 1, "Produced", "", "Product created and registered");
+    }
+    
+    // Function to add a new product holding a number of units
+    function addProductLot(
+        string memory _productId,
+        string memory _name,
+        string memory _owner,
+        uint256 _quantity
+    ) public {
+        _addProduct(_productId, _name, _owner, _quantity, "Produced", "", "Product created and registered");
+    }
+    
+    function _addProduct(
+        string memory _productId,
+        string memory _name,
+        string memory _owner,
+        uint256 _quantity,
+        string memory _status,
+        string memory _location,
+        string memory _note
+    ) internal {
         // Ensure product doesn't already exist
+        require(bytes(_productId).length != 0, "Product ID required");
         require(bytes(products[_productId].productId).length == 0, "Product already exists");
         
         // Create new product with minimal info
@@ -128,23 +172,27 @@ contract SupplyChain {
             name: _name,
             category: "",
             description: "",
-            quantity: 1,
-            location: "",
+            quantity: _quantity,
+            location: _location,
             currentOwner: _owner,
-            status: "Produced",
+            status: _status,
             createdAt: block.timestamp,
             updatedAt: block.timestamp
         });
         
+        // The owner holds every unit
+        balances[_productId][_owner] = _quantity;
+        ledgerSeeded[_productId] = true;
+        
         // Add initial transaction to history
         productHistory[_productId].push(ProductTransaction({
             productId: _productId,
             fromOwner: _owner,
             toOwner: _owner,
             action: "Created",
-            status: "Produced",
-            location: "",
-            note: "Product created and registered",
+            status: _status,
+            location: _location,
+            note: _note,
             timestamp: block.timestamp
         }));
         
@@ -166,7 +214,7 @@ contract SupplyChain {
         // Update product details
         products[_productId].category = _category;
         products[_productId].description = _description;
-        products[_productId].quantity = _quantity;
+        _adjustQuantity(_productId, _quantity);
         products[_productId].location = _location;
         products[_productId].updatedAt = block.timestamp;
         
@@ -198,7 +246,8 @@ contract SupplyChain {
         // Get current owner for the transaction record
         string memory currentOwner = products[_productId].currentOwner;
         
-        // Update product
+        // Update product; the new owner takes every unit the old one held
+        _moveHolding(_productId, currentOwner, _newOwner);
         products[_productId].currentOwner = _newOwner;
         products[_productId].status = _newStatus;
         products[_productId].updatedAt = block.timestamp;
@@ -219,12 +268,280 @@ contract SupplyChain {
         emit ProductTransferred(_productId, currentOwner, _newOwner, block.timestamp);
     }
     
+    // Function to apply any combination of owner, status, location, quantity
+    // and position changes in one transaction with a single history record.
+    // Only the fields whose bit is set in _mask are written.
+    function updateProduct(
+        string memory _productId,
+        uint8 _mask,
+        string memory _newOwner,
+        string memory _newStatus,
+        string memory _newLocation,
+        uint256 _quantity,
+        int32 _latE6,
+        int32 _lonE6,
+        string memory _note
+    ) public {
+        // Ensure product exists
+        require(bytes(products[_productId].productId).length != 0, "Product does not exist");
+        
+        string memory previousOwner = products[_productId].currentOwner;
+        _applyFields(_productId, _mask, _newOwner, _newStatus, _newLocation, _quantity);
+        if (_mask & UPDATE_POSITION != 0) {
+            _setPosition(_productId, _latE6, _lonE6);
+        }
+        _recordUpdate(_productId, _mask, previousOwner, _note);
+    }
+    
+    // Helpers for updateProduct, split up to keep each stack frame small
+    function _applyFields(
+        string memory _productId,
+        uint8 _mask,
+        string memory _newOwner,
+        string memory _newStatus,
+        string memory _newLocation,
+        uint256 _quantity
+    ) internal {
+        Product storage product = products[_productId];
+        // Quantity changes apply to the owner before any transfer
+        if (_mask & UPDATE_QUANTITY != 0) {
+            _adjustQuantity(_productId, _quantity);
+        }
+        if (_mask & UPDATE_OWNER != 0) {
+            _moveHolding(_productId, product.currentOwner, _newOwner);
+            product.currentOwner = _newOwner;
+        }
+        if (_mask & UPDATE_STATUS != 0) {
+            product.status = _newStatus;
+        }
+        if (_mask & UPDATE_LOCATION != 0) {
+            product.location = _newLocation;
+        }
+        product.updatedAt = block.timestamp;
+    }
+    
+    function _setPosition(string memory _productId, int32 _latE6, int32 _lonE6) internal {
+        require(_latE6 >= -90000000 && _latE6 <= 90000000, "Latitude out of range");
+        require(_lonE6 >= -180000000 && _lonE6 <= 180000000, "Longitude out of range");
+        productPositions[_productId] = Position(_latE6, _lonE6, block.timestamp);
+        emit ProductLocated(_productId, products[_productId].location, _latE6, _lonE6, block.timestamp);
+    }
+    
+    function _recordUpdate(
+        string memory _productId,
+        uint8 _mask,
+        string memory _previousOwner,
+        string memory _note
+    ) internal {
+        Product storage product = products[_productId];
+        bool transferred = _mask & UPDATE_OWNER != 0;
+        string memory action = "Updated";
+        if (transferred) {
+            action = "Transferred";
+        }
+        
+        // Add one transaction to history for the whole update
+        productHistory[_productId].push(ProductTransaction({
+            productId: _productId,
+            fromOwner: _previousOwner,
+            toOwner: product.currentOwner,
+            action: action,
+            status: product.status,
+            location: product.location,
+            note: _note,
+            timestamp: block.timestamp
+        }));
+        
+        // Emit events
+        if (transferred) {
+            emit ProductTransferred(_productId, _previousOwner, product.currentOwner, block.timestamp);
+        }
+        if (_mask & UPDATE_STATUS != 0) {
+            emit ProductUpdated(_productId, product.status, block.timestamp);
+        }
+    }
+    
+    // Products added before balances were tracked: the owner holds every unit
+    function _seedBalances(string memory _productId) internal {
+        if (!ledgerSeeded[_productId]) {
+            Product storage product = products[_productId];
+            balances[_productId][product.currentOwner] = product.quantity;
+            ledgerSeeded[_productId] = true;
+        }
+    }
+    
+    // Sets the total quantity, adding or removing units held by the owner
+    function _adjustQuantity(string memory _productId, uint256 _quantity) internal {
+        _seedBalances(_productId);
+        Product storage product = products[_productId];
+        uint256 held = balances[_productId][product.currentOwner];
+        require(held + _quantity >= product.quantity, "Quantity below units held by others");
+        balances[_productId][product.currentOwner] = held + _quantity - product.quantity;
+        product.quantity = _quantity;
+    }
+    
+    function _moveHolding(string memory _productId, string memory _from, string memory _to) internal {
+        _seedBalances(_productId);
+        if (keccak256(bytes(_from)) != keccak256(bytes(_to))) {
+            balances[_productId][_to] += balances[_productId][_from];
+            balances[_productId][_from] = 0;
+        }
+    }
+    
+    // Function to move some units of a product to another holder. The
+    // product's owner is unchanged.
+    function transferQuantity(
+        string memory _productId,
+        string memory _from,
+        string memory _to,
+        uint256 _amount,
+        string memory _note
+    ) public {
+        // Ensure product exists
+        require(bytes(products[_productId].productId).length != 0, "Product does not exist");
+        require(_amount > 0, "Amount must be positive");
+        
+        _seedBalances(_productId);
+        require(balances[_productId][_from] >= _amount, "Insufficient balance");
+        balances[_productId][_from] -= _amount;
+        balances[_productId][_to] += _amount;
+        products[_productId].updatedAt = block.timestamp;
+        
+        // Add transaction to history
+        productHistory[_productId].push(ProductTransaction({
+            productId: _productId,
+            fromOwner: _from,
+            toOwner: _to,
+            action: "QuantityTransferred",
+            status: products[_productId].status,
+            location: products[_productId].location,
+            note: _note,
+            timestamp: block.timestamp
+        }));
+        
+        // Emit event
+        emit QuantityTransferred(_productId, _from, _to, _amount, block.timestamp);
+    }
+    
+    // Function to move some units held by _holder into a new product
+    // owned by them, starting in _status
+    function splitProduct(
+        string memory _parentId,
+        string memory _childId,
+        string memory _holder,
+        uint256 _amount,
+        string memory _status,
+        string memory _note
+    ) public {
+        // Ensure parent exists
+        require(bytes(products[_parentId].productId).length != 0, "Product does not exist");
+        require(_amount > 0, "Amount must be positive");
+        
+        _seedBalances(_parentId);
+        require(balances[_parentId][_holder] >= _amount, "Insufficient balance");
+        _withdraw(_parentId, _childId, _holder, _amount, "Split", _note);
+        
+        Product storage parent = products[_parentId];
+        _addProduct(_childId, parent.name, _holder, _amount, _status, parent.location, _note);
+        emit ProductSplit(_parentId, _childId, _holder, _amount, block.timestamp);
+    }
+    
+    // Function to combine every unit _holder has of several products into
+    // a new product owned by them, starting in _status
+    function mergeProducts(
+        string[] memory _parentIds,
+        string memory _childId,
+        string memory _holder,
+        string memory _status,
+        string memory _note
+    ) public {
+        require(_parentIds.length > 1, "Merge needs at least two products");
+        
+        uint256 total = 0;
+        for (uint256 i = 0; i < _parentIds.length; i++) {
+            require(bytes(products[_parentIds[i]].productId).length != 0, "Product does not exist");
+            _seedBalances(_parentIds[i]);
+            uint256 held = balances[_parentIds[i]][_holder];
+            require(held > 0, "Holder has no units of a product");
+            _withdraw(_parentIds[i], _childId, _holder, held, "Merged", _note);
+            emit ProductMerged(_parentIds[i], _childId, _holder, held, block.timestamp);
+            total += held;
+        }
+        
+        Product storage first = products[_parentIds[0]];
+        _addProduct(_childId, first.name, _holder, total, _status, first.location, _note);
+    }
+    
+    // Removes units from a parent product for split and merge
+    function _withdraw(
+        string memory _parentId,
+        string memory _childId,
+        string memory _holder,
+        uint256 _amount,
+        string memory _action,
+        string memory _note
+    ) internal {
+        Product storage parent = products[_parentId];
+        balances[_parentId][_holder] -= _amount;
+        parent.quantity -= _amount;
+        parent.updatedAt = block.timestamp;
+        
+        productHistory[_parentId].push(ProductTransaction({
+            productId: _parentId,
+            fromOwner: _holder,
+            toOwner: _holder,
+            action: _action,
+            status: parent.status,
+            location: parent.location,
+            note: string(abi.encodePacked(_note, " -> ", _childId)),
+            timestamp: block.timestamp
+        }));
+    }
+    
+    // Function to get the units of a product a holder has
+    function getBalance(string memory _productId, string memory _holder) public view returns (uint256) {
+        if (!ledgerSeeded[_productId]) {
+            Product storage product = products[_productId];
+            if (keccak256(bytes(product.currentOwner)) == keccak256(bytes(_holder))) {
+                return product.quantity;
+            }
+            return 0;
+        }
+        return balances[_productId][_holder];
+    }
+    
     // Function to update product location (for distributors)
     function updateProductLocation(
         string memory _productId,
         string memory _newLocation,
         string memory _note
     ) public {
+        _updateLocation(_productId, _newLocation, _note);
+    }
+    
+    // Function to update product location with coordinates
+    function updateProductLocationGeo(
+        string memory _productId,
+        string memory _newLocation,
+        int32 _latE6,
+        int32 _lonE6,
+        string memory _note
+    ) public {
+        require(_latE6 >= -90000000 && _latE6 <= 90000000, "Latitude out of range");
+        require(_lonE6 >= -180000000 && _lonE6 <= 180000000, "Longitude out of range");
+        
+        _updateLocation(_productId, _newLocation, _note);
+        productPositions[_productId] = Position(_latE6, _lonE6, block.timestamp);
+        
+        // Emit event
+        emit ProductLocated(_productId, _newLocation, _latE6, _lonE6, block.timestamp);
+    }
+    
+    function _updateLocation(
+        string memory _productId,
+        string memory _newLocation,
+        string memory _note
+    ) internal {
         // Ensure product exists
         require(bytes(products[_productId].productId).length != 0, "Product does not exist");
         
@@ -326,6 +643,16 @@ contract SupplyChain {
         );
     }
     
+    // Function to get the latest recorded position of a product
+    function getProductPosition(string memory _productId) public view returns (
+        int32 latE6,
+        int32 lonE6,
+        uint256 recordedAt
+    ) {
+        Position memory position = productPositions[_productId];
+        return (position.latE6, position.lonE6, position.recordedAt);
+    }
+    
     // Function to get transaction history count
     function getProductHistoryCount(string memory _productId) public view returns (uint256) {
         return productHistory[_productId].length;